@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 import dj_database_url
 
@@ -43,7 +44,7 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 # ==========================================
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Static file handling for Render
+    'codelab_project.middleware.AsyncWhiteNoiseMiddleware',  # Static file handling for Render
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -98,6 +99,34 @@ else:
         )
     }
 
+# ==========================================
+# ⚡ CACHE
+# ==========================================
+if os.environ.get('REDIS_URL'):
+    # Shared by all web and worker processes, so invalidations reach every one
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': 'codelab',
+        }
+    }
+else:
+    # Per process; other processes only see changes once entries expire
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'codelab',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+# Whole pages served to anonymous visitors (home, catalog): fresh for
+# TIMEOUT seconds, then served stale for up to STALE more while one
+# worker re-renders them; 0 turns the page cache off
+ANONYMOUS_PAGE_CACHE_TIMEOUT = int(os.environ.get('ANONYMOUS_PAGE_CACHE_TIMEOUT', 60))
+ANONYMOUS_PAGE_CACHE_STALE = int(os.environ.get('ANONYMOUS_PAGE_CACHE_STALE', 10 * 60))
+
 # ==========================================
 # 🖼️ STATIC & MEDIA FILES
 # ==========================================
@@ -142,3 +171,59 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = 'resend'
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'no-reply@resend.dev')
+
+# ==========================================
+# 🧪 CODE EXECUTION
+# ==========================================
+# Warm sandbox worker pool used to grade code submissions (per web process)
+CODE_EXECUTOR_POOL_ENABLED = os.environ.get('CODE_EXECUTOR_POOL_ENABLED', 'True').lower() == 'true'
+CODE_EXECUTOR_POOL_SIZE = int(os.environ.get('CODE_EXECUTOR_POOL_SIZE', 4))
+CODE_EXECUTOR_MAX_JOBS_PER_WORKER = int(os.environ.get('CODE_EXECUTOR_MAX_JOBS_PER_WORKER', 100))
+CODE_EXECUTOR_ACQUIRE_TIMEOUT = int(os.environ.get('CODE_EXECUTOR_ACQUIRE_TIMEOUT', 30))
+
+# Run test cases in parallel shards, each shard with its own time limit
+CODE_EXECUTOR_PARALLEL_TESTS = os.environ.get('CODE_EXECUTOR_PARALLEL_TESTS', 'False').lower() == 'true'
+CODE_EXECUTOR_TEST_SHARD_SIZE = int(os.environ.get('CODE_EXECUTOR_TEST_SHARD_SIZE', 1))
+
+# Results of identical submissions are reused; 0 disables the cache
+CODE_EXECUTOR_RESULT_CACHE_SIZE = int(os.environ.get('CODE_EXECUTOR_RESULT_CACHE_SIZE', 1024))
+
+# Limits applied to every sandboxed run
+CODE_EXECUTOR_MAX_OUTPUT_BYTES = int(os.environ.get('CODE_EXECUTOR_MAX_OUTPUT_BYTES', 64 * 1024))
+CODE_EXECUTOR_MEMORY_LIMIT_MB = int(os.environ.get('CODE_EXECUTOR_MEMORY_LIMIT_MB', 256))
+CODE_EXECUTOR_OPEN_FILES_LIMIT = int(os.environ.get('CODE_EXECUTOR_OPEN_FILES_LIMIT', 64))
+
+# C, C++ and Java builds are cached on disk, keyed by source and compiler flags
+CODE_EXECUTOR_ARTIFACT_DIR = os.environ.get(
+    'CODE_EXECUTOR_ARTIFACT_DIR', os.path.join(tempfile.gettempdir(), 'codelab-artifacts')
+)
+CODE_EXECUTOR_ARTIFACT_CACHE_SIZE = int(os.environ.get('CODE_EXECUTOR_ARTIFACT_CACHE_SIZE', 500))
+CODE_EXECUTOR_COMPILE_TIMEOUT = int(os.environ.get('CODE_EXECUTOR_COMPILE_TIMEOUT', 30))
+
+# Practice "Run tests" runs: per-user and per-process limits, kept below the
+# pool size so they can't starve real grading
+PRACTICE_RUN_PER_USER = int(os.environ.get('PRACTICE_RUN_PER_USER', 1))
+PRACTICE_RUN_CONCURRENCY = int(os.environ.get('PRACTICE_RUN_CONCURRENCY', 2))
+PRACTICE_RUN_QUEUE_SIZE = int(os.environ.get('PRACTICE_RUN_QUEUE_SIZE', 8))
+PRACTICE_RUN_QUEUE_TIMEOUT = int(os.environ.get('PRACTICE_RUN_QUEUE_TIMEOUT', 5))
+
+# ==========================================
+# 📝 MARKDOWN
+# ==========================================
+# Rendered results kept per process by the |markdown template filter
+MARKDOWN_RENDER_CACHE_SIZE = int(os.environ.get('MARKDOWN_RENDER_CACHE_SIZE', 1024))
+# Rendered lesson blocks are cached so edits only re-render what changed
+LESSON_BLOCK_CACHE_TIMEOUT = int(os.environ.get('LESSON_BLOCK_CACHE_TIMEOUT', 60 * 60 * 24 * 7))
+
+# ==========================================
+# 📚 COURSE CATALOG
+# ==========================================
+# Sidebar facet counts; saving a course or category invalidates them anyway
+COURSE_FACETS_CACHE_TIMEOUT = int(os.environ.get('COURSE_FACETS_CACHE_TIMEOUT', 60 * 60))
+# Approximate "N courses found" count under cursor pagination; 0 hides it
+COURSE_COUNT_CACHE_TIMEOUT = int(os.environ.get('COURSE_COUNT_CACHE_TIMEOUT', 5 * 60))
+# Co-enrollment neighbors stored per course by `manage.py build_course_neighbors`
+COURSE_NEIGHBORS_TOP_K = int(os.environ.get('COURSE_NEIGHBORS_TOP_K', 10))
+COURSE_NEIGHBORS_MIN_OVERLAP = int(os.environ.get('COURSE_NEIGHBORS_MIN_OVERLAP', 2))
+# Instructor dashboard figures; changes invalidate them, this only bounds drift
+INSTRUCTOR_STATS_CACHE_TIMEOUT = int(os.environ.get('INSTRUCTOR_STATS_CACHE_TIMEOUT', 60 * 60))
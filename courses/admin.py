@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Category, Course, Lesson, Enrollment, Instructor,LessonProgress
+from .models import Category, Course, Lesson, Enrollment, Instructor,LessonProgress, GradingJob, CodeQuestion, RegradeRun, Review
+from .grading import start_regrade
 # courses/admin.py
 @admin.register(Enrollment)
 class EnrollmentAdmin(admin.ModelAdmin):
@@ -26,14 +27,48 @@ class InstructorAdmin(admin.ModelAdmin):
 
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
-    list_display = ['title', 'instructor', 'category', 'price', 'difficulty', 'is_published', 'created_at']
+    list_display = ['title', 'instructor', 'category', 'price', 'difficulty', 'average_rating', 'rating_count', 'is_published', 'created_at']
     list_filter = ['category', 'difficulty', 'is_published', 'created_at']
     search_fields = ['title', 'description']
     list_editable = ['is_published']
 
+@admin.register(Review)
+class ReviewAdmin(admin.ModelAdmin):
+    list_display = ['user', 'course', 'rating', 'created_at']
+    list_filter = ['rating', 'course']
+    search_fields = ['user__username', 'course__title', 'comment']
+    readonly_fields = ['created_at', 'updated_at']
+
 @admin.register(Lesson)
 class LessonAdmin(admin.ModelAdmin):
     list_display = ['title', 'course', 'order', 'duration_minutes']
     list_filter = ['course']
     search_fields = ['title', 'content']
 
+@admin.register(GradingJob)
+class GradingJobAdmin(admin.ModelAdmin):
+    list_display = ['submission', 'status', 'attempts', 'claimed_by', 'created_at', 'wait_seconds', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = ['created_at', 'started_at', 'finished_at', 'wait_seconds']
+
+@admin.register(CodeQuestion)
+class CodeQuestionAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'assignment', 'language', 'points', 'timeout_seconds']
+    list_filter = ['language', 'assignment__course']
+    search_fields = ['question_text', 'assignment__title']
+    actions = ['regrade_submissions']
+
+    @admin.action(description='Re-grade all submissions')
+    def regrade_submissions(self, request, queryset):
+        runs = [start_regrade(question) for question in queryset]
+        self.message_user(
+            request,
+            f'Queued {len(runs)} re-grade(s). Grading workers will process them, '
+            f'or run "manage.py regrade --pending".'
+        )
+
+@admin.register(RegradeRun)
+class RegradeRunAdmin(admin.ModelAdmin):
+    list_display = ['question', 'status', 'processed', 'total', 'progress', 'changed', 'skipped', 'claimed_by', 'created_at', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = ['skipped_ids', 'created_at', 'started_at', 'updated_at', 'finished_at']
@@ -0,0 +1,133 @@
+# courses/admission.py
+"""
+Admission control for practice ("Run tests") runs.
+
+Practice runs share the sandbox pool with real grading, so they are
+bounded twice: each user may only have a few runs in flight, and each
+process only runs a few at once, with a short, bounded queue in front.
+Anything beyond that is rejected straight away with a Retry-After hint
+instead of piling up behind the grader.
+"""
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+
+class AdmissionRejected(Exception):
+    """The run was turned away; ``retry_after`` is a suggested wait in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    Concurrency limit with a bounded wait queue, for one event loop.
+
+    ``concurrency`` runs are admitted at once; up to ``queue_size`` more
+    wait at most ``queue_timeout`` seconds for a slot. Per-user counts are
+    kept in the Django cache so they hold across processes when the cache
+    is shared.
+    """
+
+    def __init__(self, concurrency, queue_size, queue_timeout, per_user, key_prefix='practice-runs'):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.per_user = per_user
+        self.key_prefix = key_prefix
+        self.waiting = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.average_seconds = 1.0
+        self._semaphore = None
+        self._loop = None
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    def retry_after(self):
+        """Rough time until a slot frees up, from the recent average run time"""
+        backlog = (self.waiting + self.running) / max(1, self.concurrency)
+        return max(1, math.ceil(self.average_seconds * backlog))
+
+    def _reject(self, message):
+        self.rejected += 1
+        raise AdmissionRejected(message, self.retry_after())
+
+    def _count_run(self, user_key):
+        """Add one to the user's count of runs in flight and return it"""
+        # The key expires eventually even if a process dies mid-run
+        timeout = max(60, self.queue_timeout * 10)
+        cache.add(user_key, 0, timeout)
+        try:
+            return cache.incr(user_key)
+        except ValueError:
+            # The key expired between add() and incr()
+            if cache.add(user_key, 1, timeout):
+                return 1
+            return cache.incr(user_key)
+
+    @asynccontextmanager
+    async def admit(self, user_id):
+        user_key = f'{self.key_prefix}:{user_id}'
+        # The cache's async incr() is a non-atomic get and set, so the
+        # atomic sync one is used
+        if await sync_to_async(self._count_run, thread_sensitive=False)(user_key) > self.per_user:
+            await sync_to_async(cache.decr, thread_sensitive=False)(user_key)
+            self._reject('You already have a run in progress')
+        try:
+            semaphore = self._get_semaphore()
+            if semaphore.locked() and self.waiting >= self.queue_size:
+                self._reject('Too many runs in progress, please try again shortly')
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject('Too many runs in progress, please try again shortly')
+            finally:
+                self.waiting -= 1
+
+            self.admitted += 1
+            self.running += 1
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                self.running -= 1
+                semaphore.release()
+                self.average_seconds = 0.8 * self.average_seconds + 0.2 * (time.monotonic() - started)
+        finally:
+            try:
+                await sync_to_async(cache.decr, thread_sensitive=False)(user_key)
+            except ValueError:
+                pass
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'running': self.running,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'average_seconds': round(self.average_seconds, 3),
+        }
+
+
+practice_runs = AdmissionGate(
+    concurrency=settings.PRACTICE_RUN_CONCURRENCY,
+    queue_size=settings.PRACTICE_RUN_QUEUE_SIZE,
+    queue_timeout=settings.PRACTICE_RUN_QUEUE_TIMEOUT,
+    per_user=settings.PRACTICE_RUN_PER_USER,
+)
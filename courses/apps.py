@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.signals import post_migrate
 
 
 class CoursesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courses'
+
+    def ready(self):
+        post_migrate.connect(rerender_lessons_after_migrate, sender=self)
+
+
+def rerender_lessons_after_migrate(sender, apps=None, **kwargs):
+    """Re-render lessons after a deploy that changed the Markdown renderer"""
+    from .rendering import rerender_stale_lessons
+
+    # Nothing to do if the database was migrated back before the HTML columns
+    try:
+        apps.get_model('courses', 'Lesson')._meta.get_field('content_html_version')
+    except (AttributeError, LookupError, FieldDoesNotExist):
+        return
+    rerender_stale_lessons()
@@ -0,0 +1,187 @@
+# courses/benchmark.py
+"""
+Throughput and latency benchmark for CodeExecutor.
+
+A corpus of representative submissions (fast, CPU-heavy, timing out,
+raising and flooding stdout) is graded at several concurrency levels, the
+way simultaneous web requests or grading workers would grade them. Run it
+with ``manage.py benchmark_executor``; results are plain JSON so runs on
+different commits can be diffed or plotted.
+"""
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .sandbox import get_worker_pool
+from .services import CodeExecutor
+
+ADD_TESTS = [
+    {'input': '1, 2', 'expected_output': '3'},
+    {'input': '10, -4', 'expected_output': '6'},
+    {'input': '0, 0', 'expected_output': '0'},
+]
+
+CORPUS = {
+    'fast': {
+        'code': 'def solution(a, b):\n    return a + b\n',
+        'tests': ADD_TESTS,
+    },
+    'cpu': {
+        'code': (
+            'def solution(a, b):\n'
+            '    total = 0\n'
+            '    for i in range(300000):\n'
+            '        total += i * i % 7\n'
+            '    return a + b\n'
+        ),
+        'tests': ADD_TESTS,
+    },
+    'timeout': {
+        'code': 'def solution(a, b):\n    while True:\n        pass\n',
+        'tests': ADD_TESTS,
+        'timeout': 1,
+    },
+    'exception': {
+        'code': 'def solution(a, b):\n    raise ValueError("bad input")\n',
+        'tests': ADD_TESTS,
+    },
+    'flood': {
+        'code': (
+            'def solution(a, b):\n'
+            '    for _ in range(2000):\n'
+            '        print("x" * 1000)\n'
+            '    return a + b\n'
+        ),
+        'tests': ADD_TESTS,
+    },
+}
+
+DEFAULT_MIX = ['fast', 'fast', 'fast', 'cpu', 'exception', 'flood', 'timeout']
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'p50': round(percentile(latencies, 50) * 1000, 2),
+        'p95': round(percentile(latencies, 95) * 1000, 2),
+        'p99': round(percentile(latencies, 99) * 1000, 2),
+        'max': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        'mean': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def host_peak_rss_kb():
+    """This process's peak resident set size so far; it never goes down"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def grade(kind, use_pool=None, use_cache=False):
+    """Grade one corpus entry and return (latency seconds, result)"""
+    entry = CORPUS[kind]
+    executor = CodeExecutor(timeout=entry.get('timeout', 5), use_pool=use_pool, use_cache=use_cache)
+    started = time.perf_counter()
+    result = executor.evaluate_code(entry['code'], 'python', entry['tests'])
+    return time.perf_counter() - started, result
+
+
+def run_level(concurrency, submissions, mix, use_pool=None, use_cache=False):
+    """Grade ``submissions`` corpus entries with ``concurrency`` callers at once"""
+    kinds = [mix[i % len(mix)] for i in range(submissions)]
+    by_kind = {kind: [] for kind in mix}
+    statuses = Counter()
+    sandbox_peak_rss_kb = 0
+    lock = threading.Lock()
+
+    def one(kind):
+        nonlocal sandbox_peak_rss_kb
+        latency, result = grade(kind, use_pool=use_pool, use_cache=use_cache)
+        with lock:
+            by_kind[kind].append(latency)
+            statuses[result.get('status', 'unknown')] += 1
+            rss = result.get('resources', {}).get('peak_rss_kb', 0)
+            sandbox_peak_rss_kb = max(sandbox_peak_rss_kb, rss)
+        return latency
+
+    peak_before = host_peak_rss_kb()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, kinds))
+    elapsed = time.perf_counter() - started
+    peak_after = host_peak_rss_kb()
+
+    return {
+        'concurrency': concurrency,
+        'submissions': submissions,
+        'seconds': round(elapsed, 3),
+        'submissions_per_second': round(submissions / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': latency_summary(latencies),
+        'latency_ms_by_kind': {kind: latency_summary(values) for kind, values in by_kind.items() if values},
+        'statuses': dict(statuses),
+        'sandbox_peak_rss_kb': sandbox_peak_rss_kb,
+        # How far this level raised the host's peak; 0 when an earlier level
+        # (or the warmup) already peaked higher
+        'host_peak_rss_growth_kb': peak_after - peak_before,
+        # The peak since the process started, including earlier levels
+        'host_lifetime_peak_rss_kb': peak_after,
+    }
+
+
+def git_revision():
+    try:
+        completed = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return completed.stdout.strip() or None
+
+
+def run_benchmark(levels=(1, 4, 8), submissions=70, mix=None, use_pool=None, use_cache=False, warmup=True):
+    """Run every concurrency level and return the full report as a dict"""
+    mix = mix or DEFAULT_MIX
+    executor = CodeExecutor(use_pool=use_pool)
+    if warmup:
+        if executor.use_pool:
+            get_worker_pool()
+        grade('fast', use_pool=use_pool, use_cache=False)
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'config': {
+            'use_pool': executor.use_pool,
+            'pool_size': settings.CODE_EXECUTOR_POOL_SIZE,
+            'parallel_tests': settings.CODE_EXECUTOR_PARALLEL_TESTS,
+            'use_cache': use_cache,
+            'mix': mix,
+        },
+        'levels': [],
+    }
+    for concurrency in levels:
+        report['levels'].append(
+            run_level(concurrency, submissions, mix, use_pool=use_pool, use_cache=use_cache)
+        )
+    if executor.use_pool:
+        report['pool'] = get_worker_pool().stats()
+    return report
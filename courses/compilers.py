@@ -0,0 +1,211 @@
+# courses/compilers.py
+"""
+Compiler toolchains for C, C++ and Java code questions, and the on-disk
+cache of their build artifacts.
+
+Compiled submissions read each test's input on stdin and are graded on
+what they print. Builds are keyed by a hash of the language, compiler
+version, compiler flags and normalized source, so re-grading a
+submission, or grading an identical one, reuses the existing build.
+Failed compilations are cached too, with the compiler's messages.
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+COMPILE_ERROR_FILE = 'compile_error.txt'
+ABANDONED_BUILD_SECONDS = 3600
+
+TOOLCHAINS = {
+    'c': {
+        'source': 'main.c',
+        'compile': ['gcc', '-O2', '-std=c11', '-pipe', '-o', 'main', 'main.c', '-lm'],
+        'run': ['{build}/main'],
+    },
+    'cpp': {
+        'source': 'main.cpp',
+        'compile': ['g++', '-O2', '-std=c++17', '-pipe', '-o', 'main', 'main.cpp'],
+        'run': ['{build}/main'],
+    },
+    'java': {
+        'source': '{main_class}.java',
+        'compile': ['javac', '-encoding', 'UTF-8', '-nowarn', '{main_class}.java'],
+        'run': ['java', '-Xmx{memory_mb}m', '-Xss64m', '-XX:+UseSerialGC', '-cp', '{build}', '{main_class}'],
+        # The JVM reserves far more address space than it uses, so its
+        # memory is bounded with -Xmx rather than RLIMIT_AS.
+        'limit_address_space': False,
+    },
+}
+
+JAVA_CLASS_RE = re.compile(r'public\s+(?:final\s+)?class\s+([A-Za-z_$][\w$]*)')
+
+
+def is_compiled(language):
+    return language in TOOLCHAINS
+
+
+def toolchain_for(language, code):
+    """Return the toolchain for ``language`` with the source-dependent names filled in"""
+    toolchain = dict(TOOLCHAINS[language])
+    match = JAVA_CLASS_RE.search(code) if language == 'java' else None
+    names = {
+        'main_class': match.group(1) if match else 'Main',
+        'memory_mb': settings.CODE_EXECUTOR_MEMORY_LIMIT_MB,
+    }
+    toolchain['source'] = toolchain['source'].format(**names)
+    toolchain['compile'] = [arg.format(**names) for arg in toolchain['compile']]
+    # The build directory is only known once the build is cached
+    toolchain['run'] = [arg.format(build='{build}', **names) for arg in toolchain['run']]
+    return toolchain
+
+
+@functools.lru_cache(maxsize=None)
+def compiler_version(command):
+    """First line of ``<compiler> --version``, so compiler upgrades invalidate builds"""
+    try:
+        completed = subprocess.run([command, '--version'], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return ''
+    output = completed.stdout or completed.stderr
+    return output.splitlines()[0] if output else ''
+
+
+def compiler_available(toolchain):
+    """Whether the compiler and, for Java, the runtime are installed; C and C++ run their own build"""
+    commands = [toolchain['compile'][0], toolchain['run'][0]]
+    return all(shutil.which(command) is not None for command in commands if '{build}' not in command)
+
+
+class ArtifactCache:
+    """
+    Directory of finished builds, one sub-directory per cache key.
+
+    Builds are made in a scratch directory next to the cache and renamed
+    into place, so readers never see a half-written build and concurrent
+    compilations of the same source simply race to publish the same thing.
+    Entries are touched on every hit and the least recently used are
+    pruned once there are more than ``max_entries``.
+    """
+
+    def __init__(self, root, max_entries=500):
+        self.root = root
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(language, source, toolchain):
+        payload = json.dumps([
+            language,
+            compiler_version(toolchain['compile'][0]),
+            toolchain['compile'],
+            toolchain['source'],
+            source,
+        ])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key):
+        """Return the build directory for ``key``, or None if it was never built"""
+        path = self.path(key)
+        hit = os.path.isdir(path)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return path
+        return None
+
+    def new_build_dir(self):
+        os.makedirs(self.root, exist_ok=True)
+        return tempfile.mkdtemp(prefix='.build-', dir=self.root)
+
+    def publish(self, build_dir, key):
+        """Move a finished build into the cache and return its final path"""
+        path = self.path(key)
+        try:
+            os.rename(build_dir, path)
+        except OSError:
+            # Someone else published the same build first
+            shutil.rmtree(build_dir, ignore_errors=True)
+        self.prune()
+        return path
+
+    def prune(self):
+        if self.max_entries <= 0:
+            return
+        try:
+            entries = [entry for entry in os.scandir(self.root) if entry.is_dir()]
+        except OSError:
+            return
+        # Scratch builds left behind by a grader that died mid-compile
+        abandoned_before = time.time() - ABANDONED_BUILD_SECONDS
+        for entry in entries:
+            if entry.name.startswith('.') and entry.stat().st_mtime < abandoned_before:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        entries = [entry for entry in entries if not entry.name.startswith('.')]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+artifact_cache = ArtifactCache(
+    root=settings.CODE_EXECUTOR_ARTIFACT_DIR,
+    max_entries=settings.CODE_EXECUTOR_ARTIFACT_CACHE_SIZE,
+)
+
+
+def read_compile_error(build_dir):
+    """Compiler messages of a failed build, or None if it succeeded"""
+    try:
+        with open(os.path.join(build_dir, COMPILE_ERROR_FILE), encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_compile_error(build_dir, message):
+    with open(os.path.join(build_dir, COMPILE_ERROR_FILE), 'w', encoding='utf-8') as f:
+        f.write(message)
+
+
+def normalize_output(text):
+    """Ignore trailing whitespace and line-ending differences when comparing program output"""
+    lines = str(text).replace('\r\n', '\n').strip().split('\n')
+    return '\n'.join(line.rstrip() for line in lines)
+
+
+def stdin_for(test_input):
+    if isinstance(test_input, (list, tuple)):
+        return ' '.join(str(value) for value in test_input) + '\n'
+    text = str(test_input)
+    return text if text.endswith('\n') or not text else text + '\n'
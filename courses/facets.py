@@ -0,0 +1,113 @@
+# courses/facets.py
+"""
+Counts for the course catalog's filter sidebar.
+
+Each facet (category, difficulty, price, duration) is counted with every
+other active filter applied but not its own, so the counts say how many
+courses ticking that box would show. All of them come from a single query
+grouped by the four facets, cached per search text. Saving or deleting a
+course or category bumps a generation number in the cache, which retires
+every cached entry at once.
+"""
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+GENERATION_KEY = 'course-facets:generation'
+
+PRICE_BUCKETS = {
+    'free': Q(price=0),
+    'paid': Q(price__gt=0),
+}
+
+DURATION_BUCKETS = {
+    'short': Q(duration_hours__lte=5),
+    'medium': Q(duration_hours__gt=5, duration_hours__lte=10),
+    'long': Q(duration_hours__gt=10),
+}
+
+FACETS = ('category', 'difficulty', 'price', 'duration')
+
+
+def generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        # Start from the clock, so an evicted counter can't come back to
+        # a number that older cached entries still carry
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        current = cache.get(GENERATION_KEY, time.time_ns())
+    return current
+
+
+def invalidate():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def _bucket(buckets):
+    return Case(
+        *[When(condition, then=Value(name)) for name, condition in buckets.items()],
+        output_field=CharField(),
+    )
+
+
+def grouped_counts(courses):
+    """Course counts grouped by every facet at once, as plain tuples"""
+    rows = (
+        courses.order_by()
+        .annotate(price_bucket=_bucket(PRICE_BUCKETS), duration_bucket=_bucket(DURATION_BUCKETS))
+        .values_list('category_id', 'difficulty', 'price_bucket', 'duration_bucket')
+        .annotate(total=Count('pk'))
+    )
+    return [tuple(row) for row in rows]
+
+
+def _cached(courses, search_text):
+    from .models import Category
+
+    digest = hashlib.sha256(search_text.strip().lower().encode('utf-8')).hexdigest()
+    key = f'course-facets:{generation()}:{digest}'
+    data = cache.get(key)
+    if data is None:
+        data = {
+            'categories': list(Category.objects.order_by('pk').values_list('pk', 'name')),
+            'rows': grouped_counts(courses),
+        }
+        cache.set(key, data, settings.COURSE_FACETS_CACHE_TIMEOUT)
+    return data
+
+
+def catalog_facets(courses, search_text, selected):
+    """
+    Facet counts for ``courses`` (published courses, already narrowed by
+    the search but not by any facet). ``selected`` maps each facet name
+    to the values picked for it; an empty collection means no filter.
+    """
+    data = _cached(courses, search_text or '')
+    selected = [{str(value) for value in selected.get(facet) or ()} for facet in FACETS]
+    counts = [Counter() for _ in FACETS]
+
+    for *values, total in data['rows']:
+        values = [str(value) for value in values]
+        matches = [not picked or value in picked for value, picked in zip(values, selected)]
+        for i, value in enumerate(values):
+            if all(matches[:i]) and all(matches[i + 1:]):
+                counts[i][value] += total
+
+    categories, difficulty, price, duration = counts
+    return {
+        'categories': [
+            {'id': pk, 'name': name, 'course_count': categories[str(pk)]}
+            for pk, name in data['categories']
+        ],
+        'difficulty': difficulty,
+        'price': price,
+        'price_total': sum(price.values()),
+        'duration': duration,
+    }
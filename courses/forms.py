@@ -1,5 +1,5 @@
 from django import forms
-from .models import Course, Lesson, Category, Instructor
+from .models import Course, Lesson, Category, Instructor, Review
 from .models import (
     Assignment, MultipleChoiceQuestion, CodeQuestion, TextQuestion,
     MultipleChoiceSubmission, CodeSubmission, TextSubmission
@@ -53,6 +53,19 @@ class CourseForm(forms.ModelForm):
             'description': forms.Textarea(attrs={'rows': 4}),
         }
 
+class ReviewForm(forms.ModelForm):
+    class Meta:
+        model = Review
+        fields = ['rating', 'comment']
+        widgets = {
+            'rating': forms.Select(attrs={'class': 'form-select'}),
+            'comment': forms.Textarea(attrs={
+                'class': 'form-control',
+                'rows': 3,
+                'placeholder': 'What did you think of this course?'
+            }),
+        }
+
 class CategoryForm(forms.ModelForm):
     class Meta:
         model = Category
@@ -99,7 +112,7 @@ class CodeQuestionForm(forms.ModelForm):
             'placeholder': 'Enter test cases as JSON array: [{"input": "1 2", "expected_output": "3", "points": 1}]'
         }),
         required=False,
-        help_text="Enter test cases as JSON array"
+        help_text='Enter test cases as JSON array. Add "hidden": true to keep a test case out of practice runs.'
     )
 
     class Meta:
@@ -0,0 +1,446 @@
+# courses/grading.py
+"""
+Grading queue for code answers.
+
+Submissions are saved straight away with their code answers marked as
+pending and a GradingJob row is queued. ``manage.py grading_worker``
+processes claim jobs with row locking, so any number of workers can run
+side by side on different machines.
+
+Re-grades (after a question's test cases change) are RegradeRun rows
+processed a chunk at a time, either by ``manage.py regrade`` or by idle
+grading workers, and pick up where they left off if interrupted.
+"""
+import functools
+import logging
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, FloatField, Max, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import (
+    AssignmentSubmission, CodeSubmission, GradingJob, MultipleChoiceSubmission, RegradeRun, TextSubmission,
+)
+from .services import CodeExecutor, is_grader_error
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+# Seconds before the first retry of a failed job, doubled for every further attempt
+RETRY_BACKOFF_SECONDS = 30
+REGRADE_CHUNK_SIZE = 200
+# A running re-grade that saved no chunk for this long is assumed abandoned
+REGRADE_STALE_AFTER = timedelta(minutes=10)
+PENDING_RESULT = {"status": "queued", "results": []}
+
+
+class GraderUnavailable(Exception):
+    """The grader, not the submitted code, failed; the answer must be graded again later"""
+
+
+def score_code_result(question, execution_result):
+    """Return (score, is_correct) for an execution result"""
+    passed_tests = [r for r in execution_result.get('results', []) if r.get('passed')]
+    score = (len(passed_tests) / len(question.test_cases)) * question.points if question.test_cases else 0
+    is_correct = len(passed_tests) == len(question.test_cases)
+    return score, is_correct
+
+
+def grade_code_submission(code_submission):
+    """Execute one code answer and store its score"""
+    question = code_submission.question
+    executor = CodeExecutor(timeout=question.timeout_seconds)
+    execution_result = executor.evaluate_code(
+        code_submission.code,
+        code_submission.language,
+        question.test_cases
+    )
+    if is_grader_error(execution_result):
+        raise GraderUnavailable(execution_result.get('message', ''))
+    return save_code_result(code_submission, execution_result)
+
+
+async def grade_code_submission_async(code_submission, on_result=None):
+    """grade_code_submission() for async views, passing each test result to ``on_result``"""
+    question = code_submission.question
+    executor = CodeExecutor(timeout=question.timeout_seconds)
+    execution_result = await executor.evaluate_code_async(
+        code_submission.code,
+        code_submission.language,
+        question.test_cases,
+        on_result
+    )
+    if is_grader_error(execution_result):
+        raise GraderUnavailable(execution_result.get('message', ''))
+    return await sync_to_async(save_code_result)(code_submission, execution_result)
+
+
+def mark_hidden_tests(question, execution_result):
+    """Flag the results of the question's hidden test cases before they are stored"""
+    for test_result in execution_result.get('results', []):
+        if question.is_hidden_test(test_result.get('test_case', 0)):
+            test_result['hidden'] = True
+    return execution_result
+
+
+def save_code_result(code_submission, execution_result):
+    """Score an execution result and store it on the code answer"""
+    question = code_submission.question
+    score, is_correct = score_code_result(question, execution_result)
+    mark_hidden_tests(question, execution_result)
+
+    code_submission.execution_result = execution_result
+    code_submission.score = score
+    code_submission.is_correct = is_correct
+    code_submission.feedback = execution_result.get('message', '')
+    code_submission.save(update_fields=['execution_result', 'score', 'is_correct', 'feedback'])
+    return code_submission
+
+
+def public_test_result(question, test_result):
+    """A test result as students see it: hidden tests only say whether they passed"""
+    if question.is_hidden_test(test_result.get('test_case', 0)):
+        return {'test_case': test_result.get('test_case'), 'passed': test_result.get('passed'), 'hidden': True}
+    return test_result
+
+
+def enqueue_submission(submission):
+    """Mark a submission as grading and queue a job for it"""
+    submission.status = 'grading'
+    submission.save(update_fields=['status'])
+    return GradingJob.objects.create(submission=submission)
+
+
+def finalize_submission(submission):
+    submission.total_score = submission.calculate_total_score()
+    submission.status = 'graded'
+    submission.is_completed = True
+    submission.save(update_fields=['total_score', 'status', 'is_completed'])
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _available():
+    return Q(available_at__isnull=True) | Q(available_at__lte=timezone.now())
+
+
+def _record_wait(job):
+    # A retried job has waited since its backoff ended, not since it was first queued
+    job.wait_seconds = (job.started_at - (job.available_at or job.created_at)).total_seconds()
+    GradingJob.objects.filter(pk=job.pk).update(wait_seconds=job.wait_seconds)
+
+
+def claim_jobs(limit=1, name=None):
+    """
+    Claim up to ``limit`` queued jobs for this worker.
+
+    Candidate rows are locked with SKIP LOCKED where the database supports
+    it, and the status change is conditional on the row still being queued,
+    so two workers can never claim the same job.
+    """
+    token = f"{name or worker_name()}:{uuid.uuid4().hex[:8]}"
+    now = timezone.now()
+    with transaction.atomic():
+        candidate_ids = list(
+            GradingJob.objects.select_for_update(skip_locked=True)
+            .filter(_available(), status='queued')
+            .order_by('created_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        GradingJob.objects.filter(id__in=candidate_ids, status='queued').update(
+            status='running',
+            claimed_by=token,
+            started_at=now,
+            attempts=F('attempts') + 1,
+        )
+    jobs = list(GradingJob.objects.filter(claimed_by=token, status='running').select_related('submission'))
+    for job in jobs:
+        _record_wait(job)
+    return jobs
+
+
+def claim_submission_job(submission, name=None):
+    """Claim the queued job of one submission, e.g. to grade it while its author watches"""
+    token = f"{name or worker_name()}:{uuid.uuid4().hex[:8]}"
+    claimed = GradingJob.objects.filter(_available(), submission=submission, status='queued').update(
+        status='running',
+        claimed_by=token,
+        started_at=timezone.now(),
+        attempts=F('attempts') + 1,
+    )
+    if not claimed:
+        return None
+    job = GradingJob.objects.select_related('submission').get(submission=submission, claimed_by=token)
+    _record_wait(job)
+    return job
+
+
+def process_job(job):
+    """Grade every code answer of the job's submission and record the outcome"""
+    submission = job.submission
+    try:
+        code_submissions = submission.codesubmission_submissions.select_related('question')
+        for code_submission in code_submissions:
+            grade_code_submission(code_submission)
+        finalize_submission(submission)
+    except Exception as e:
+        return fail_job(job, e)
+    return complete_job(job)
+
+
+async def process_job_async(job, on_result=None):
+    """
+    process_job() for async views. ``on_result(code_submission, result)``
+    is called with every test result as soon as it is known.
+    """
+    submission = job.submission
+    try:
+        code_submissions = await sync_to_async(list)(
+            submission.codesubmission_submissions.select_related('question')
+        )
+        for code_submission in code_submissions:
+            await grade_code_submission_async(
+                code_submission,
+                functools.partial(on_result, code_submission) if on_result else None
+            )
+        await sync_to_async(finalize_submission)(submission)
+    except Exception as e:
+        return await sync_to_async(fail_job)(job, e)
+    return await sync_to_async(complete_job)(job)
+
+
+def fail_job(job, error):
+    """Requeue a job that raised, after a backoff, or give up on it after MAX_ATTEMPTS"""
+    logger.error('Grading job %s failed', job.pk, exc_info=error)
+    job.last_error = str(error)
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = 'failed'
+        job.finished_at = timezone.now()
+        AssignmentSubmission.objects.filter(pk=job.submission_id).update(status='failed')
+    else:
+        job.status = 'queued'
+        job.available_at = timezone.now() + timedelta(seconds=RETRY_BACKOFF_SECONDS * 2 ** max(job.attempts - 1, 0))
+    job.save(update_fields=['status', 'last_error', 'finished_at', 'available_at'])
+    return job
+
+
+def complete_job(job):
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at'])
+    return job
+
+
+def requeue_stale_jobs(stale_after=timedelta(minutes=10)):
+    """
+    Put jobs and re-grades whose worker died mid-grading back on the queue.
+    Jobs already tried MAX_ATTEMPTS times fail instead.
+    """
+    cutoff = timezone.now() - stale_after
+    RegradeRun.objects.filter(status='running', updated_at__lt=cutoff).update(status='queued', claimed_by='')
+    stale = GradingJob.objects.filter(status='running', started_at__lt=cutoff)
+
+    # A submission that takes its worker down every time must not be retried forever
+    exhausted = list(stale.filter(attempts__gte=MAX_ATTEMPTS).values_list('id', 'submission_id'))
+    if exhausted:
+        logger.error('Grading jobs %s stopped their worker %d times', [pk for pk, _ in exhausted], MAX_ATTEMPTS)
+        with transaction.atomic():
+            GradingJob.objects.filter(pk__in=[pk for pk, _ in exhausted], status='running').update(
+                status='failed',
+                last_error='The grading worker stopped while grading this submission',
+                finished_at=timezone.now(),
+            )
+            AssignmentSubmission.objects.filter(pk__in=[pk for _, pk in exhausted]).update(status='failed')
+    return stale.update(
+        status='queued',
+        claimed_by='',
+        last_error='The grading worker stopped while grading this submission',
+    )
+
+
+def recompute_total_scores(submission_ids):
+    """Recompute ``total_score`` of many submissions with a single UPDATE"""
+    def score_sum(model):
+        scores = (
+            model.objects.filter(submission=OuterRef('pk'))
+            .values('submission')
+            .annotate(total=Sum('score'))
+            .values('total')
+        )
+        return Coalesce(Subquery(scores, output_field=FloatField()), Value(0.0))
+
+    return AssignmentSubmission.objects.filter(pk__in=submission_ids).update(
+        total_score=score_sum(MultipleChoiceSubmission) + score_sum(CodeSubmission) + score_sum(TextSubmission)
+    )
+
+
+def start_regrade(question, restart=False, submission_ids=None):
+    """
+    Queue a re-grade of every submission to ``question``, or only of the
+    code answers in ``submission_ids``, or return the unfinished one
+    """
+    unfinished = RegradeRun.objects.filter(question=question, status__in=['queued', 'running'])
+    if restart:
+        unfinished.update(status='failed', last_error='Superseded by a new re-grade', finished_at=timezone.now())
+    else:
+        run = unfinished.first()
+        if run:
+            return run
+    return RegradeRun.objects.create(
+        question=question,
+        submission_ids=submission_ids,
+        total=_regrade_submissions(question, submission_ids).count(),
+    )
+
+
+def _regrade_submissions(question, submission_ids=None):
+    code_submissions = CodeSubmission.objects.filter(question=question)
+    if submission_ids is not None:
+        code_submissions = code_submissions.filter(pk__in=submission_ids)
+    return code_submissions
+
+
+def claim_regrade_run(name, run_id=None, stale_after=REGRADE_STALE_AFTER):
+    """
+    Return the re-grade this worker is running, or claim a queued one, or
+    one whose worker stopped saving chunks ``stale_after`` ago. With
+    ``run_id``, only that run is considered; None means another worker has it.
+    """
+    runs = RegradeRun.objects.all() if run_id is None else RegradeRun.objects.filter(pk=run_id)
+    run = runs.filter(status='running', claimed_by=name).select_related('question').first()
+    if run:
+        return run
+    claimable = Q(status='queued') | Q(status='running', updated_at__lt=timezone.now() - stale_after)
+    with transaction.atomic():
+        candidate_ids = list(
+            runs.select_for_update(skip_locked=True)
+            .filter(claimable)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:1]
+        )
+        now = timezone.now()
+        runs.filter(claimable, id__in=candidate_ids).update(
+            status='running',
+            claimed_by=name,
+            started_at=Coalesce('started_at', Value(now)),
+            updated_at=now,
+        )
+    return RegradeRun.objects.filter(
+        id__in=candidate_ids, status='running', claimed_by=name
+    ).select_related('question').first()
+
+
+def release_regrade_run(run):
+    """Hand an interrupted re-grade back to the queue, to be resumed by anyone"""
+    RegradeRun.objects.filter(pk=run.pk, status='running', claimed_by=run.claimed_by).update(
+        status='queued', claimed_by='', updated_at=timezone.now()
+    )
+
+
+def regrade_chunk(run, chunk_size=REGRADE_CHUNK_SIZE, max_workers=None):
+    """
+    Re-grade the next ``chunk_size`` submissions of a run and return how
+    many were processed, or 0 once the run is finished.
+
+    Submissions are executed concurrently on the sandbox pool, written back
+    with one bulk_update, and the chunk's total scores are recomputed in
+    aggregate. The run's cursor moves in the same transaction, so an
+    interrupted run resumes after the last chunk that was saved.
+
+    An answer that times out is run once more on its own, in case the
+    timeout came from the load of the chunk, and then scored as it came
+    out. Answers the grader could not run keep their old score and are
+    added to the run's ``skipped_ids`` to be retried.
+    """
+    question = run.question
+    chunk = list(
+        _regrade_submissions(question, run.submission_ids).filter(pk__gt=run.last_submission_id)
+        .order_by('pk')
+        .only('id', 'submission_id', 'code', 'language', 'score', 'is_correct')[:chunk_size]
+    )
+    if not chunk:
+        run.status = 'done'
+        run.finished_at = timezone.now()
+        run.save(update_fields=['status', 'finished_at', 'updated_at'])
+        return 0
+
+    executor = CodeExecutor(timeout=question.timeout_seconds)
+    max_workers = min(max_workers or settings.CODE_EXECUTOR_POOL_SIZE, len(chunk))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(
+            lambda code_submission: executor.evaluate_code(
+                code_submission.code, code_submission.language, question.test_cases
+            ),
+            chunk
+        ))
+    results = [
+        executor.evaluate_code(code_submission.code, code_submission.language, question.test_cases)
+        if execution_result.get('status') == 'timeout' and not is_grader_error(execution_result)
+        else execution_result
+        for code_submission, execution_result in zip(chunk, results)
+    ]
+
+    changed = 0
+    regraded = []
+    skipped = []
+    for code_submission, execution_result in zip(chunk, results):
+        # A busy or broken sandbox says nothing about the code
+        if is_grader_error(execution_result):
+            skipped.append(code_submission.pk)
+            continue
+        regraded.append(code_submission)
+        score, is_correct = score_code_result(question, execution_result)
+        if score != code_submission.score or is_correct != code_submission.is_correct:
+            changed += 1
+        code_submission.execution_result = mark_hidden_tests(question, execution_result)
+        code_submission.score = score
+        code_submission.is_correct = is_correct
+        code_submission.feedback = execution_result.get('message', '')
+
+    with transaction.atomic():
+        CodeSubmission.objects.bulk_update(regraded, ['execution_result', 'score', 'is_correct', 'feedback'])
+        recompute_total_scores({code_submission.submission_id for code_submission in regraded})
+        RegradeRun.objects.filter(pk=run.pk).update(
+            last_submission_id=chunk[-1].pk,
+            processed=F('processed') + len(chunk),
+            changed=F('changed') + changed,
+            # Only the worker that claimed the run writes to it
+            skipped_ids=run.skipped_ids + skipped,
+            updated_at=timezone.now(),
+        )
+    run.refresh_from_db(fields=['last_submission_id', 'processed', 'changed', 'skipped_ids', 'updated_at'])
+    return len(chunk)
+
+
+def fail_regrade_run(run, error):
+    run.status = 'failed'
+    run.last_error = str(error)
+    run.finished_at = timezone.now()
+    run.save(update_fields=['status', 'last_error', 'finished_at', 'updated_at'])
+
+
+def queue_stats(window=timedelta(minutes=15)):
+    """Current queue depth and recent wait times, in seconds"""
+    now = timezone.now()
+    queued = GradingJob.objects.filter(status='queued').aggregate(depth=Count('id'), oldest=Min('created_at'))
+    recent = GradingJob.objects.filter(started_at__gte=now - window).aggregate(
+        avg_wait=Avg('wait_seconds'),
+        max_wait=Max('wait_seconds'),
+    )
+    return {
+        'depth': queued['depth'],
+        'running': GradingJob.objects.filter(status='running').count(),
+        'oldest_queued_seconds': (now - queued['oldest']).total_seconds() if queued['oldest'] else 0,
+        'avg_wait_seconds': recent['avg_wait'] or 0,
+        'max_wait_seconds': recent['max_wait'] or 0,
+    }
@@ -0,0 +1,113 @@
+# courses/instructor_stats.py
+"""
+Figures for the instructor dashboard.
+
+Everything the dashboard shows is computed with four queries, however many
+courses the instructor has:
+- their courses, whose enrollment and rating totals are stored on the row
+- assignment and submission counts grouped by course and assignment type
+- distinct students
+- the latest assignments, with question counts from subqueries
+
+The result is cached per instructor. The signal receivers in
+courses/models.py drop it when a course, enrollment, review, assignment,
+question or submission of theirs changes.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+RECENT_ASSIGNMENTS = 4
+
+
+def _cache_key(instructor_id):
+    return f'instructor-stats:{instructor_id}'
+
+
+def _question_count(model):
+    questions = (
+        model.objects.filter(assignment=OuterRef('pk'))
+        .order_by().values('assignment').annotate(total=Count('pk')).values('total')
+    )
+    return Coalesce(Subquery(questions, output_field=IntegerField()), 0)
+
+
+def compute_stats(instructor_id):
+    from .models import Assignment, CodeQuestion, Course, Enrollment, MultipleChoiceQuestion, TextQuestion
+
+    courses = list(
+        Course.objects.filter(instructor_id=instructor_id)
+        .values_list('pk', 'price', 'enrollment_count', 'rating_sum', 'rating_count')
+    )
+    enrollments = {pk: enrollment_count for pk, _, enrollment_count, _, _ in courses}
+
+    assignment_stats = {assignment_type: 0 for assignment_type, _ in Assignment.ASSIGNMENT_TYPES}
+    assignments_per_course = {pk: 0 for pk in enrollments}
+    total_submissions = 0
+    possible_submissions = 0
+    groups = (
+        Assignment.objects.filter(course__instructor_id=instructor_id)
+        .order_by().values_list('course_id', 'assignment_type')
+        .annotate(assignments=Count('pk', distinct=True), submissions=Count('submissions'))
+    )
+    for course_id, assignment_type, assignments, submissions in groups:
+        assignment_stats[assignment_type] = assignment_stats.get(assignment_type, 0) + assignments
+        assignments_per_course[course_id] += assignments
+        total_submissions += submissions
+        # Every enrolled student could submit every assignment once
+        possible_submissions += assignments * enrollments[course_id]
+
+    total_students = Enrollment.objects.filter(course__instructor_id=instructor_id).aggregate(
+        students=Count('user', distinct=True)
+    )['students']
+
+    recent_assignments = list(
+        Assignment.objects.filter(course__instructor_id=instructor_id)
+        .select_related('course')
+        .annotate(question_count=(
+            _question_count(MultipleChoiceQuestion) + _question_count(CodeQuestion) + _question_count(TextQuestion)
+        ))
+        .order_by('-created_at')[:RECENT_ASSIGNMENTS]
+    )
+
+    rating_sum = sum(row[3] for row in courses)
+    rating_count = sum(row[4] for row in courses)
+    return {
+        'total_students': total_students,
+        # The catalog value of the courses, as the dashboard has always shown it
+        'total_revenue': sum(price for _, price, _, _, _ in courses),
+        'total_assignments': sum(assignment_stats.values()),
+        'total_submissions': total_submissions,
+        'assignment_stats': assignment_stats,
+        'assignments_per_course': assignments_per_course,
+        'submission_rate': round(total_submissions / possible_submissions * 100, 1) if possible_submissions else 0,
+        'average_rating': round(rating_sum / rating_count, 1) if rating_count else None,
+        'recent_assignments': recent_assignments,
+    }
+
+
+def get_stats(instructor_id):
+    """The instructor's dashboard figures, from the cache when they are there"""
+    key = _cache_key(instructor_id)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_stats(instructor_id)
+        cache.set(key, stats, settings.INSTRUCTOR_STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def invalidate(instructor_id):
+    if instructor_id is None:
+        return
+    key = _cache_key(instructor_id)
+    # After the commit, so a dashboard loading meanwhile can't cache the old figures again
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def invalidate_course_owner(**course_lookup):
+    """Invalidate the stats of the instructor teaching the course matching ``course_lookup``"""
+    from .models import Course
+
+    invalidate(Course.objects.filter(**course_lookup).values_list('instructor_id', flat=True).first())
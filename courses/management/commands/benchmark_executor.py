@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.benchmark import CORPUS, DEFAULT_MIX, run_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Measure code grading throughput, latency percentiles and peak memory at several '
+            'concurrency levels. Prints JSON, so runs on different commits can be compared.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', default='1,4,8',
+                            help='Comma-separated concurrency levels')
+        parser.add_argument('--submissions', type=int, default=70,
+                            help='Submissions graded per concurrency level')
+        parser.add_argument('--mix', default=','.join(DEFAULT_MIX),
+                            help=f'Comma-separated corpus entries, repeated in order ({", ".join(CORPUS)})')
+        parser.add_argument('--no-pool', action='store_true',
+                            help='Cold-start a sandbox per submission instead of using the worker pool')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='Let identical submissions hit the result cache')
+        parser.add_argument('--output',
+                            help='Also write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',') if level]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma-separated list of numbers')
+        if not levels or min(levels) < 1:
+            raise CommandError('--concurrency levels must be 1 or more')
+        if options['submissions'] < 1:
+            raise CommandError('--submissions must be 1 or more')
+        mix = [kind.strip() for kind in options['mix'].split(',') if kind.strip()]
+        unknown = set(mix) - set(CORPUS)
+        if unknown:
+            raise CommandError(f'Unknown corpus entries: {", ".join(sorted(unknown))}')
+
+        report = run_benchmark(
+            levels=levels,
+            submissions=options['submissions'],
+            mix=mix,
+            use_pool=False if options['no_pool'] else None,
+            use_cache=options['with_cache'],
+        )
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
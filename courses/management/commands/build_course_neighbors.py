@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from courses.recommendations import build_neighbors
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the co-enrollment neighbors behind "related" and "recommended" courses. '
+            'Run it periodically, e.g. nightly from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=settings.COURSE_NEIGHBORS_TOP_K,
+                            help='Neighbors kept per course')
+        parser.add_argument('--min-overlap', type=int, default=settings.COURSE_NEIGHBORS_MIN_OVERLAP,
+                            help='Students two courses must share to count as neighbors')
+
+    def handle(self, *args, **options):
+        stored = build_neighbors(top_k=options['top_k'], min_overlap=options['min_overlap'])
+        self.stdout.write(self.style.SUCCESS(f'Stored {stored} course neighbor(s)'))
@@ -0,0 +1,87 @@
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from courses.grading import (
+    claim_jobs, claim_regrade_run, fail_regrade_run, process_job, queue_stats, regrade_chunk, requeue_stale_jobs,
+    worker_name,
+)
+
+
+class Command(BaseCommand):
+    help = 'Grade queued assignment submissions. Run as many workers as needed, on any number of machines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help='Jobs to claim per poll')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Seconds after which a running job is assumed abandoned and requeued')
+        parser.add_argument('--stats-interval', type=int, default=60,
+                            help='Seconds between queue depth/wait time log lines')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print queue statistics as JSON and exit')
+        parser.add_argument('--no-regrade', action='store_true',
+                            help='Do not work on queued re-grades while the grading queue is empty')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(queue_stats()))
+            return
+
+        name = worker_name()
+        stale_after = timedelta(seconds=options['stale_after'])
+        next_stats = 0
+        self.stdout.write(f'Grading worker {name} started')
+
+        while True:
+            now = time.monotonic()
+            if now >= next_stats:
+                requeued = requeue_stale_jobs(stale_after)
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale job(s)'))
+                self.stdout.write(json.dumps(queue_stats()))
+                next_stats = now + options['stats_interval']
+
+            jobs = claim_jobs(limit=options['batch_size'], name=name)
+            if not jobs and not options['no_regrade'] and self.regrade_step(name):
+                continue
+            if not jobs:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            for job in jobs:
+                job = process_job(job)
+                self.stdout.write(
+                    f'Job {job.pk} for submission {job.submission_id}: {job.status} '
+                    f'(waited {job.wait_seconds:.2f}s)'
+                )
+
+    def regrade_step(self, name):
+        """Re-grade one chunk of a queued re-grade; new submissions are checked for in between"""
+        run = claim_regrade_run(name)
+        if run is None:
+            return False
+        try:
+            processed = regrade_chunk(run)
+        except Exception as e:
+            fail_regrade_run(run, e)
+            self.stdout.write(self.style.ERROR(f'Re-grade {run.pk} failed: {e}'))
+            return True
+        if processed:
+            self.stdout.write(f'Re-grade {run.pk}: {run.processed}/{run.total} ({run.progress}%)')
+        else:
+            self.stdout.write(f'Re-grade {run.pk} finished, {run.changed} score(s) changed')
+            if run.skipped:
+                self.stdout.write(self.style.WARNING(
+                    f'Re-grade {run.pk} skipped {run.skipped} submission(s) the grader could not run; '
+                    f'retry them with: manage.py regrade --retry {run.pk}'
+                ))
+        return True
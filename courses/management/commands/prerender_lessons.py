@@ -0,0 +1,111 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, time as dt_time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from courses.models import Lesson
+from courses.rendering import RENDERER_VERSION, render_batch
+
+
+def parse_since(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'--changed-since must be a date or datetime, not {value!r}')
+        moment = datetime.combine(day, dt_time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = ('Re-render the stored HTML of lessons, e.g. after upgrading Markdown or Pygments or '
+            'changing the codehilite settings. Lessons are rendered in parallel worker processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', dest='courses',
+                            help='Only lessons of this course id (may be repeated)')
+        parser.add_argument('--changed-since',
+                            help='Only lessons edited on or after this date or datetime')
+        parser.add_argument('--stale', action='store_true',
+                            help='Only lessons rendered by a different renderer version')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Lessons rendered and saved per batch')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Rendering processes')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
+
+        lessons = Lesson.objects.order_by('pk')
+        if options['courses']:
+            lessons = lessons.filter(course_id__in=options['courses'])
+        if options['changed_since']:
+            lessons = lessons.filter(updated_at__gte=parse_since(options['changed_since']))
+        if options['stale']:
+            lessons = lessons.exclude(content_html_version=RENDERER_VERSION)
+
+        total = lessons.count()
+        if not total:
+            self.stdout.write('No lessons to render')
+            return
+        self.stdout.write(f'Rendering {total} lesson(s) with {workers} worker(s)')
+
+        started = time.monotonic()
+        done = 0
+        pending = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = lessons.values_list('pk', 'content', 'updated_at').iterator(chunk_size=batch_size)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == batch_size:
+                    self.submit(pool, batch, pending)
+                    batch = []
+                    # Keep a couple of batches per worker in flight, not the whole table
+                    if len(pending) >= workers * 2:
+                        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        done += self.save(finished, pending, total, done, started)
+            if batch:
+                self.submit(pool, batch, pending)
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done += self.save(finished, pending, total, done, started)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {done} lesson(s) in {elapsed:.1f}s ({done / elapsed:.1f}/s)'
+        ))
+
+    def submit(self, pool, batch, pending):
+        future = pool.submit(render_batch, [(pk, content) for pk, content, _ in batch])
+        # When each lesson was read, to tell whether it was edited while rendering
+        pending[future] = {pk: updated_at for pk, _, updated_at in batch}
+
+    def save(self, futures, pending, total, done, started):
+        saved = 0
+        for future in futures:
+            read_at = pending.pop(future)
+            with transaction.atomic():
+                # Locked, so an edit can't land between this check and the write
+                current = dict(
+                    Lesson.objects.select_for_update().filter(pk__in=read_at).values_list('pk', 'updated_at')
+                )
+                # A lesson edited meanwhile already stored the HTML of its new content
+                rendered = [
+                    Lesson(pk=pk, content_html=html, content_html_version=RENDERER_VERSION)
+                    for pk, html in future.result()
+                    if current.get(pk) == read_at[pk]
+                ]
+                Lesson.objects.bulk_update(rendered, ['content_html', 'content_html_version'])
+            saved += len(read_at)
+            rate = (done + saved) / (time.monotonic() - started)
+            self.stdout.write(f'  {done + saved}/{total} ({(done + saved) * 100 // total}%), {rate:.1f}/s')
+        return saved
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from courses import search
+from courses.models import Course
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the course full-text search index, e.g. after courses were changed with '
+            'update() or raw SQL, which bypass the signals that keep it current.')
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError('Full-text search needs SQLite (FTS5) or PostgreSQL; '
+                               'this database falls back to plain matching')
+        with transaction.atomic():
+            search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {Course.objects.count()} course(s)'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from courses.models import Course, Enrollment
+
+
+class Command(BaseCommand):
+    help = ('Recount Course.enrollment_count from the Enrollment table, fixing any drift from '
+            'enrollments created or deleted without signals (bulk_create, raw SQL, fixtures).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report courses whose count is wrong')
+
+    def handle(self, *args, **options):
+        counts = (
+            Enrollment.objects.filter(course=OuterRef('pk'))
+            .order_by().values('course').annotate(total=Count('pk')).values('total')
+        )
+        drifted = (
+            Course.objects.annotate(actual=Coalesce(Subquery(counts), 0))
+            .exclude(enrollment_count=F('actual'))
+        )
+        for course in drifted.only('id', 'title', 'enrollment_count'):
+            self.stdout.write(f'  {course.title} ({course.pk}): {course.enrollment_count} -> {course.actual}')
+
+        if options['dry_run']:
+            return
+        # One UPDATE, so enrollments made while reconciling aren't lost
+        fixed = Course.objects.filter(pk__in=drifted.values('pk')).update(
+            enrollment_count=Coalesce(Subquery(counts), 0)
+        )
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {fixed} course(s)'))
@@ -0,0 +1,102 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from courses.grading import (
+    REGRADE_CHUNK_SIZE, claim_regrade_run, fail_regrade_run, regrade_chunk, release_regrade_run, start_regrade,
+    worker_name,
+)
+from courses.models import CodeQuestion, RegradeRun
+
+
+class Command(BaseCommand):
+    help = ('Re-grade every submission to the given code questions, e.g. after fixing a test case. '
+            'Interrupted re-grades resume where they stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('question_ids', nargs='*', type=int,
+                            help='Code questions to re-grade')
+        parser.add_argument('--retry', type=int, metavar='RUN_ID', action='append', default=[],
+                            help='Re-grade again the submissions a finished re-grade had to skip')
+        parser.add_argument('--pending', action='store_true',
+                            help='Also run re-grades queued from the admin')
+        parser.add_argument('--restart', action='store_true',
+                            help='Start over instead of resuming an unfinished re-grade')
+        parser.add_argument('--chunk-size', type=int, default=REGRADE_CHUNK_SIZE,
+                            help='Submissions loaded and saved per chunk')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Submissions executed concurrently (defaults to the sandbox pool size)')
+
+    def handle(self, *args, **options):
+        if not options['question_ids'] and not options['pending'] and not options['retry']:
+            raise CommandError('Give one or more question ids, --retry or --pending')
+
+        runs = []
+        for question_id in options['question_ids']:
+            try:
+                question = CodeQuestion.objects.get(pk=question_id)
+            except CodeQuestion.DoesNotExist:
+                raise CommandError(f'Code question {question_id} does not exist')
+            runs.append(start_regrade(question, restart=options['restart']))
+        for run_id in options['retry']:
+            try:
+                skipped_run = RegradeRun.objects.select_related('question').get(pk=run_id)
+            except RegradeRun.DoesNotExist:
+                raise CommandError(f'Re-grade {run_id} does not exist')
+            if not skipped_run.skipped_ids:
+                self.stdout.write(f'Re-grade {run_id} skipped no submissions')
+                continue
+            runs.append(start_regrade(
+                skipped_run.question, restart=options['restart'], submission_ids=skipped_run.skipped_ids
+            ))
+        if options['pending']:
+            runs.extend(RegradeRun.objects.filter(status='queued').exclude(pk__in=[run.pk for run in runs]))
+
+        name = worker_name()
+        for run in runs:
+            claimed = claim_regrade_run(name, run_id=run.pk)
+            if claimed is None:
+                run.refresh_from_db()
+                reason = f'{run.claimed_by} is running it' if run.status == 'running' else f'it is {run.status}'
+                self.stdout.write(self.style.WARNING(f'Skipping re-grade {run.pk}: {reason}'))
+                continue
+            self.run(claimed, options['chunk_size'], options['workers'])
+
+    def run(self, run, chunk_size, workers):
+        if run.processed:
+            self.stdout.write(f'Resuming re-grade {run.pk} of question {run.question_id} '
+                              f'after {run.processed} submission(s)')
+        else:
+            self.stdout.write(f'Re-grading {run.total} submission(s) to question {run.question_id} (run {run.pk})')
+
+        started = time.monotonic()
+        done = 0
+        try:
+            while True:
+                processed = regrade_chunk(run, chunk_size=chunk_size, max_workers=workers)
+                if not processed:
+                    break
+                done += processed
+                rate = done / (time.monotonic() - started)
+                self.stdout.write(f'  {run.processed}/{run.total} ({run.progress}%), '
+                                  f'{run.changed} score(s) changed, {run.skipped} skipped, {rate:.1f}/s')
+        except KeyboardInterrupt:
+            release_regrade_run(run)
+            self.stdout.write(self.style.WARNING(
+                f'Interrupted; run the same command again to resume re-grade {run.pk}'
+            ))
+            raise
+        except Exception as e:
+            fail_regrade_run(run, e)
+            raise CommandError(f'Re-grade {run.pk} failed: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Re-grade {run.pk} finished: {run.processed} submission(s), {run.changed} score(s) changed '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
+        if run.skipped:
+            self.stdout.write(self.style.WARNING(
+                f'{run.skipped} submission(s) could not be graded and kept their old score '
+                f'(code submissions {", ".join(map(str, run.skipped_ids))}); '
+                f'retry them with: manage.py regrade --retry {run.pk}'
+            ))
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0005_regraderun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='content_html_version',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def render_lessons(apps, schema_editor):
+    from courses.rendering import RENDERER_VERSION, render_markdown
+
+    Lesson = apps.get_model('courses', 'Lesson')
+    for lesson in Lesson.objects.only('id', 'content').iterator():
+        lesson.content_html = render_markdown(lesson.content)
+        lesson.content_html_version = RENDERER_VERSION
+        lesson.save(update_fields=['content_html', 'content_html_version'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0006_lesson_content_html'),
+    ]
+
+    operations = [
+        migrations.RunPython(render_lessons, migrations.RunPython.noop),
+    ]
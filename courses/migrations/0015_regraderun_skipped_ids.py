@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0014_gradingjob_available_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='regraderun',
+            name='skipped_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='regraderun',
+            name='submission_ids',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
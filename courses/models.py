@@ -1,9 +1,21 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.urls import reverse
-from django.db.models import Sum
+from django.db.models import F, FloatField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from users.models import UserProfile
 
+from . import facets, instructor_stats, pagecache, search, typeahead
+from .rendering import render_lesson
+
+# Changes to these fields are reflected in the search index
+SEARCH_FIELDS = {'title', 'description', 'instructor'}
+INSTRUCTOR_NAME_FIELDS = {'first_name', 'last_name', 'username'}
+
 
 class Instructor(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -36,8 +48,21 @@ class Course(models.Model):
     thumbnail = models.ImageField(upload_to='course_thumbnails/')
     duration_hours = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    # Also moved by enrollments, reviews and lesson changes, so it says
+    # when anything shown about the course last changed
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     is_published = models.BooleanField(default=False)
+
+    COUNTER_FIELDS = {'enrollment_count', 'rating_sum', 'rating_count', 'average_rating'}
+
+    # Maintained by the Enrollment signals below; fix drift with
+    # manage.py reconcile_enrollment_counts
+    enrollment_count = models.PositiveIntegerField(default=0, editable=False)
+    # Maintained by the Review signals below, so rating sorts read one
+    # indexed column instead of averaging the reviews table
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.FloatField(default=0, editable=False, db_index=True)
     
     def __str__(self):
         return self.title
@@ -45,6 +70,16 @@ class Course(models.Model):
     def get_absolute_url(self):
         return reverse('course_detail', kwargs={'pk': self.pk})
 
+    def save(self, *args, **kwargs):
+        # Editing a course must not write back counters loaded before
+        # students enrolled or reviewed in the meantime
+        if self.pk and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 class Lesson(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='lessons')
     title = models.CharField(max_length=200)
@@ -53,6 +88,10 @@ class Lesson(models.Model):
     video_url = models.URLField(blank=True)
     duration_minutes = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Rendered from content on save; see courses/rendering.py
+    content_html = models.TextField(blank=True, editable=False)
+    content_html_version = models.CharField(max_length=32, blank=True, editable=False)
     
     class Meta:
         ordering = ['order']
@@ -60,6 +99,16 @@ class Lesson(models.Model):
     def __str__(self):
         return f"{self.course.title} - {self.title}"
 
+    def save(self, *args, **kwargs):
+        # Keep the stored HTML in step with the Markdown whenever content is saved
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            render_lesson(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'content_html', 'content_html_version', 'updated_at'}
+        super().save(*args, **kwargs)
+
+
 class Enrollment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
@@ -70,6 +119,170 @@ class Enrollment(models.Model):
     class Meta:
         unique_together = ['user', 'course']
 
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        search.index_courses([instance.pk])
+
+
+@receiver(post_delete, sender=Course)
+def unindex_course(sender, instance, **kwargs):
+    search.remove_courses([instance.pk])
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_caches(sender, **kwargs):
+    facets.invalidate()
+    pagecache.invalidate()
+
+
+@receiver(post_save, sender=Instructor)
+def index_instructor_courses(sender, instance, **kwargs):
+    search.index_courses(Course.objects.filter(instructor=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+def index_renamed_instructor_courses(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login only, so they don't touch the index
+    if update_fields is not None and not INSTRUCTOR_NAME_FIELDS & set(update_fields):
+        return
+    course_ids = list(Course.objects.filter(instructor__user=instance).values_list('pk', flat=True))
+    if course_ids:
+        search.index_courses(course_ids)
+        typeahead.invalidate()
+
+
+@receiver(post_save, sender=Course)
+def update_course_suggestions(sender, instance, **kwargs):
+    typeahead.course_changed(instance)
+
+
+@receiver(post_delete, sender=Course)
+def remove_course_suggestions(sender, instance, **kwargs):
+    typeahead.course_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Instructor)
+def invalidate_suggestions(sender, **kwargs):
+    typeahead.invalidate()
+
+
+@receiver(post_save, sender=Enrollment)
+def count_enrollment(sender, instance, created, **kwargs):
+    if created:
+        Course.objects.filter(pk=instance.course_id).update(
+            enrollment_count=F('enrollment_count') + 1, updated_at=timezone.now()
+        )
+
+
+@receiver(post_delete, sender=Enrollment)
+def count_unenrollment(sender, instance, **kwargs):
+    Course.objects.filter(pk=instance.course_id, enrollment_count__gt=0).update(
+        enrollment_count=F('enrollment_count') - 1, updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def touch_lesson_course(sender, instance, **kwargs):
+    Course.objects.filter(pk=instance.course_id).update(updated_at=timezone.now())
+
+class Review(models.Model):
+    RATING_CHOICES = [(rating, f'{rating} star{"s" if rating > 1 else ""}') for rating in range(1, 6)]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='reviews')
+    rating = models.PositiveSmallIntegerField(
+        choices=RATING_CHOICES, validators=[MinValueValidator(1), MaxValueValidator(5)]
+    )
+    comment = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Rating as last saved, so an edit can adjust the course totals by the difference
+    _saved_rating = None
+
+    class Meta:
+        unique_together = ['user', 'course']
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.user.username} - {self.course.title} ({self.rating})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_rating = instance.__dict__.get('rating')
+        return instance
+
+
+def update_course_rating(course_id, rating_change, count_change):
+    """Adjust a course's rating totals in one UPDATE, recomputing the average from them"""
+    rating_sum = F('rating_sum') + rating_change
+    rating_count = F('rating_count') + count_change
+    Course.objects.filter(pk=course_id).update(
+        rating_sum=rating_sum,
+        rating_count=rating_count,
+        average_rating=Coalesce(
+            Cast(rating_sum, FloatField()) / NullIf(rating_count, 0), Value(0.0), output_field=FloatField()
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created, **kwargs):
+    if created:
+        update_course_rating(instance.course_id, instance.rating, 1)
+    else:
+        # Runs for comment-only edits too, which still change the course page
+        saved_rating = instance._saved_rating if instance._saved_rating is not None else instance.rating
+        update_course_rating(instance.course_id, instance.rating - saved_rating, 0)
+    instance._saved_rating = instance.rating
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, **kwargs):
+    rating = instance._saved_rating if instance._saved_rating is not None else instance.rating
+    update_course_rating(instance.course_id, -rating, -1)
+
+
+@receiver(post_save, sender=User)
+def touch_renamed_user_courses(sender, instance, update_fields=None, **kwargs):
+    # Course pages show the names of their instructor and reviewers
+    if update_fields is not None and not INSTRUCTOR_NAME_FIELDS & set(update_fields):
+        return
+    courses = Course.objects.filter(Q(instructor__user=instance) | Q(reviews__user=instance))
+    if courses.update(updated_at=timezone.now()):
+        pagecache.invalidate()
+
+
+class CourseNeighbor(models.Model):
+    """
+    A course often taken by the same students as ``course``, precomputed by
+    ``manage.py build_course_neighbors``; ``rank`` 1 is the most similar.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.FloatField()
+    # Students enrolled in both courses
+    overlap = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ['course', 'rank']
+        ordering = ['course', 'rank']
+
+    def __str__(self):
+        return f"{self.course_id} -> {self.neighbor_id} ({self.score:.3f})"
+
+
 class LessonProgress(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE)
@@ -182,6 +395,15 @@ class CodeQuestion(BaseQuestion):
     class Meta:
         ordering = ['order']
 
+    @property
+    def visible_test_cases(self):
+        """Test cases students can run their code against before submitting"""
+        return [test_case for test_case in self.test_cases if not test_case.get('hidden')]
+
+    def is_hidden_test(self, number):
+        """Whether the 1-based test case ``number`` is hidden from students"""
+        return 0 < number <= len(self.test_cases) and bool(self.test_cases[number - 1].get('hidden'))
+
 
 class TextQuestion(BaseQuestion):
     expected_answer = models.TextField(blank=True)
@@ -191,12 +413,19 @@ class TextQuestion(BaseQuestion):
         ordering = ['order']
 
 class AssignmentSubmission(models.Model):
+    STATUS_CHOICES = [
+        ('grading', 'Grading'),
+        ('graded', 'Graded'),
+        ('failed', 'Grading Failed'),
+    ]
+
     assignment = models.ForeignKey(Assignment, on_delete=models.CASCADE, related_name='submissions')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     submitted_at = models.DateTimeField(auto_now_add=True)
     total_score = models.FloatField(default=0)
     is_completed = models.BooleanField(default=False)
     time_taken_minutes = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='graded')
 
     class Meta:
         unique_together = ['assignment', 'user']
@@ -207,12 +436,83 @@ class AssignmentSubmission(models.Model):
 
     def calculate_total_score(self):
         """Calculate total score from all question submissions"""
-        mc_score = self.mc_submissions.aggregate(total=Sum('score'))['total'] or 0
-        code_score = self.code_submissions.aggregate(total=Sum('score'))['total'] or 0
-        text_score = self.text_submissions.aggregate(total=Sum('score'))['total'] or 0
+        mc_score = self.multiplechoicesubmission_submissions.aggregate(total=Sum('score'))['total'] or 0
+        code_score = self.codesubmission_submissions.aggregate(total=Sum('score'))['total'] or 0
+        text_score = self.textsubmission_submissions.aggregate(total=Sum('score'))['total'] or 0
         return mc_score + code_score + text_score
 
 
+class GradingJob(models.Model):
+    """Queued grading work for the code answers of a submission"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    submission = models.OneToOneField(AssignmentSubmission, on_delete=models.CASCADE, related_name='grading_job')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    wait_seconds = models.FloatField(null=True, blank=True)
+    # Set when a failed job is requeued, so retries back off
+    available_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Grading job {self.pk} ({self.status})"
+
+
+class RegradeRun(models.Model):
+    """Re-grade of every submission to a code question, resumable chunk by chunk"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    question = models.ForeignKey(CodeQuestion, on_delete=models.CASCADE, related_name='regrade_runs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    claimed_by = models.CharField(max_length=100, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    changed = models.PositiveIntegerField(default=0)
+    # Submissions are re-graded in primary key order; this is the last one done
+    last_submission_id = models.PositiveBigIntegerField(default=0)
+    # Code answers to re-grade, when only some are, e.g. to retry skipped ones
+    submission_ids = models.JSONField(null=True, blank=True)
+    # Code answers the grader could not run; they keep their old score
+    skipped_ids = models.JSONField(default=list, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"Re-grade of question {self.question_id} ({self.status})"
+
+    @property
+    def progress(self):
+        return min(100, round(self.processed * 100 / self.total)) if self.total else 100
+
+    @property
+    def skipped(self):
+        return len(self.skipped_ids)
+
+
 class BaseQuestionSubmission(models.Model):
     submission = models.ForeignKey(AssignmentSubmission, on_delete=models.CASCADE, related_name='%(class)s_submissions')
     question = models.ForeignKey('%(class)sQuestion', on_delete=models.CASCADE)
@@ -242,4 +542,42 @@ class CodeSubmission(BaseQuestionSubmission):
 
 class TextSubmission(BaseQuestionSubmission):
     question = models.ForeignKey(TextQuestion, on_delete=models.CASCADE)
-    answer_text = models.TextField()
\ No newline at end of file
+    answer_text = models.TextField()
+
+
+# Instructor dashboard figures; see courses/instructor_stats.py
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def invalidate_instructor_stats(sender, instance, **kwargs):
+    instructor_stats.invalidate(instance.instructor_id)
+
+
+@receiver(post_delete, sender=Enrollment)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Assignment)
+@receiver(post_delete, sender=Assignment)
+def invalidate_course_instructor_stats(sender, instance, **kwargs):
+    instructor_stats.invalidate_course_owner(pk=instance.course_id)
+
+
+@receiver(post_save, sender=Enrollment)
+def invalidate_enrolled_instructor_stats(sender, instance, created, **kwargs):
+    # Later saves (marking the course completed) change no figures
+    if created:
+        instructor_stats.invalidate_course_owner(pk=instance.course_id)
+
+
+@receiver(post_save, sender=AssignmentSubmission)
+@receiver(post_delete, sender=AssignmentSubmission)
+@receiver(post_save, sender=MultipleChoiceQuestion)
+@receiver(post_delete, sender=MultipleChoiceQuestion)
+@receiver(post_save, sender=CodeQuestion)
+@receiver(post_delete, sender=CodeQuestion)
+@receiver(post_save, sender=TextQuestion)
+@receiver(post_delete, sender=TextQuestion)
+def invalidate_assignment_instructor_stats(sender, instance, created=True, **kwargs):
+    # Only adding or removing one changes the counts; grading saves submissions often
+    if created:
+        instructor_stats.invalidate_course_owner(assignments=instance.assignment_id)
@@ -0,0 +1,121 @@
+# courses/pagecache.py
+"""
+Whole-page cache for anonymous visitors to the home page and catalog.
+
+Every anonymous visitor sees the same page for a given URL and language,
+so the rendered HTML is kept in the cache. Each entry remembers the
+catalog generation it was rendered under; saving or deleting a course or
+category bumps the generation, which makes every entry stale at once.
+
+Only one process re-renders a stale or missing entry: it takes a short
+lock in the cache. Meanwhile everyone else gets the stale copy, or, when
+there is none yet, waits briefly for the new one. A burst of identical
+requests after a marketing email costs one render, not thousands.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+GENERATION_KEY = 'page-cache:generation'
+
+# Longest a render may hold the lock before another process takes over
+LOCK_TIMEOUT = 10
+
+# How often a request with nothing to serve checks for the new copy
+WAIT_INTERVAL = 0.05
+
+
+def generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        current = cache.get(GENERATION_KEY, time.time_ns())
+    return current
+
+
+def invalidate():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def _cache_key(request):
+    page = f"{getattr(request, 'LANGUAGE_CODE', '')}:{request.get_full_path()}"
+    return 'page-cache:' + hashlib.sha256(page.encode('utf-8')).hexdigest()
+
+
+def _cacheable(request):
+    return (
+        settings.ANONYMOUS_PAGE_CACHE_TIMEOUT > 0
+        and request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        # Flash messages are shown once, to one visitor
+        and not len(get_messages(request))
+    )
+
+
+def _from_entry(entry):
+    return HttpResponse(entry['content'], content_type=entry['content_type'])
+
+
+def _render(view, request, args, kwargs, key, current):
+    response = view(request, *args, **kwargs)
+    if callable(getattr(response, 'render', None)) and not response.is_rendered:
+        response.render()
+    # A page that hands out a CSRF token or touches the session belongs to one visitor
+    personal = (
+        response.cookies
+        or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+        or getattr(getattr(request, 'session', None), 'modified', False)
+    )
+    if response.status_code == 200 and not personal:
+        entry = {
+            'generation': current,
+            'fresh_until': time.time() + settings.ANONYMOUS_PAGE_CACHE_TIMEOUT,
+            'content': response.content,
+            'content_type': response['Content-Type'],
+        }
+        cache.set(key, entry, settings.ANONYMOUS_PAGE_CACHE_TIMEOUT + settings.ANONYMOUS_PAGE_CACHE_STALE)
+    return response
+
+
+def anonymous_page_cache(view):
+    """Serve ``view`` to anonymous visitors from the page cache"""
+    @wraps(view)
+    def inner(request, *args, **kwargs):
+        if not _cacheable(request):
+            return view(request, *args, **kwargs)
+
+        key = _cache_key(request)
+        current = generation()
+        entry = cache.get(key)
+        if entry is not None and entry['generation'] == current and entry['fresh_until'] > time.time():
+            return _from_entry(entry)
+
+        lock = f'{key}:lock'
+        if cache.add(lock, 1, LOCK_TIMEOUT):
+            try:
+                return _render(view, request, args, kwargs, key, current)
+            finally:
+                cache.delete(lock)
+        if entry is not None:
+            # Another process is re-rendering it; the stale copy will do until then
+            return _from_entry(entry)
+
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(WAIT_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return _from_entry(entry)
+            if cache.get(lock) is None:
+                # The render finished without storing a page (an error, cookies)
+                break
+        return view(request, *args, **kwargs)
+    return inner
@@ -0,0 +1,151 @@
+# courses/pagination.py
+"""
+Keyset ("cursor") pagination.
+
+Instead of ``OFFSET n``, each page continues from the sort key of the last
+row shown (``WHERE (created_at, id) < (...)``), so deep pages cost the same
+as the first one and rows published in the meantime don't shift the pages
+being read. The position travels in an opaque, signed token; a token from
+another listing or sort order just starts over at the first page.
+"""
+import datetime
+import decimal
+import hashlib
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+SALT = 'courses.pagination.cursor'
+
+
+class CursorPage:
+    """One page of results plus the tokens for the pages either side of it"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by ``ordering``, a list of fields or annotations
+    like ``('-created_at', '-pk')`` whose last entry must be unique. ``key``
+    identifies the listing (filters, sort order) that tokens belong to.
+    """
+
+    def __init__(self, queryset, ordering, per_page, key=''):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.key = key
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def _encode(self, obj, backwards):
+        values = []
+        for name in self.fields:
+            value = getattr(obj, name)
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            elif isinstance(value, decimal.Decimal):
+                value = str(value)
+            values.append(value)
+        return signing.dumps({'k': self.key, 'v': values, 'b': backwards}, salt=SALT, compress=True)
+
+    def _decode(self, cursor):
+        try:
+            data = signing.loads(cursor, salt=SALT)
+        except signing.BadSignature:
+            return None
+        if not isinstance(data, dict) or data.get('k') != self.key or len(data.get('v') or ()) != len(self.fields):
+            return None
+        model = self.queryset.model
+        values = []
+        for name, value in zip(self.fields, data['v']):
+            field = model._meta.pk if name == 'pk' else next(
+                (field for field in model._meta.concrete_fields if field.name == name), None
+            )
+            values.append(field.to_python(value) if field is not None else value)
+        return values, bool(data.get('b'))
+
+    def _beyond(self, values, backwards):
+        """Rows after ``values`` in the listing's order (before them if ``backwards``)"""
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.ordering, values):
+            field = name.lstrip('-')
+            descending = name.startswith('-') != backwards
+            condition |= Q(**equal, **{f'{field}__{"lt" if descending else "gt"}': value})
+            equal[field] = value
+        return condition
+
+    def page(self, cursor=None):
+        position = self._decode(cursor) if cursor else None
+        queryset = self.queryset
+        backwards = False
+        if position is not None:
+            values, backwards = position
+            queryset = queryset.filter(self._beyond(values, backwards))
+        if backwards:
+            queryset = queryset.order_by(*[
+                name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering
+            ])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # One extra row tells whether there is another page in this direction
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            # Everything past a stale cursor is gone; start over
+            return self.page() if position is not None else CursorPage([])
+
+        has_next = more if not backwards else True
+        has_previous = more if backwards else position is not None
+        return CursorPage(
+            rows,
+            next_cursor=self._encode(rows[-1], backwards=False) if has_next else None,
+            previous_cursor=self._encode(rows[0], backwards=True) if has_previous else None,
+        )
+
+
+def listing_key(params, ignore=('cursor', 'page')):
+    """Fingerprint of a listing's query parameters, for CursorPaginator's ``key``"""
+    items = sorted((name, value) for name, values in params.lists() if name not in ignore for value in values)
+    return hashlib.sha256(repr(items).encode('utf-8')).hexdigest()[:16]
+
+
+def cached_count(queryset, timeout):
+    """
+    ``queryset.count()``, cached for ``timeout`` seconds under a key derived
+    from its SQL. Good enough for a "N results" label, not for paging.
+    """
+    sql, params = queryset.order_by().query.sql_with_params()
+    key = 'queryset-count:' + hashlib.sha256(repr((sql, params)).encode('utf-8')).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
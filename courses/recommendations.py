@@ -0,0 +1,155 @@
+# courses/recommendations.py
+"""
+"Students who took this also took" recommendations.
+
+``manage.py build_course_neighbors`` turns the Enrollment table into a
+sparse student-by-course matrix, multiplies it by its transpose to count
+the students every pair of courses shares, and stores each course's top
+neighbors by cosine similarity as CourseNeighbor rows. Page views only read
+those rows, so NumPy and SciPy are needed by the job, not by the site.
+Every build bumps a generation number in the cache, which goes into the
+course pages' ETags.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+
+GENERATION_KEY = 'course-neighbors:generation'
+
+
+def generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        current = cache.get(GENERATION_KEY, time.time_ns())
+    return current
+
+
+def invalidate():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def co_enrollment_neighbors(pairs, top_k, min_overlap=1):
+    """
+    The ``top_k`` nearest neighbors of every course, given ``(user_id,
+    course_id)`` enrollment pairs, as ``(course_id, neighbor_id, score,
+    overlap, rank)`` tuples. ``score`` is the cosine similarity of the two
+    courses' students, overlap / sqrt(students_a * students_b); pairs
+    sharing fewer than ``min_overlap`` students are left out.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    if not len(pairs):
+        return []
+    user_ids, users = np.unique(pairs[:, 0], return_inverse=True)
+    course_ids, courses = np.unique(pairs[:, 1], return_inverse=True)
+    students = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int64), (users, courses)),
+        shape=(len(user_ids), len(course_ids)),
+    )
+    students.data[:] = 1  # a repeated pair still counts once
+    sizes = np.asarray(students.sum(axis=0)).ravel()
+
+    shared = (students.T @ students).tocoo()
+    keep = (shared.row != shared.col) & (shared.data >= min_overlap)
+    rows, cols, overlap = shared.row[keep], shared.col[keep], shared.data[keep]
+    scores = overlap / np.sqrt(sizes[rows].astype(np.float64) * sizes[cols])
+
+    # Group by course, best first; ties go to the bigger overlap, then the lower id
+    order = np.lexsort((course_ids[cols], -overlap, -scores, rows))
+    rows, cols, overlap, scores = rows[order], cols[order], overlap[order], scores[order]
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows) + 1
+    top = ranks <= top_k
+    return list(zip(
+        course_ids[rows[top]].tolist(),
+        course_ids[cols[top]].tolist(),
+        scores[top].tolist(),
+        overlap[top].tolist(),
+        ranks[top].tolist(),
+    ))
+
+
+def build_neighbors(top_k=None, min_overlap=None):
+    """Recompute and replace every CourseNeighbor row; returns how many were stored"""
+    from .models import CourseNeighbor, Enrollment
+
+    if top_k is None:
+        top_k = settings.COURSE_NEIGHBORS_TOP_K
+    if min_overlap is None:
+        min_overlap = settings.COURSE_NEIGHBORS_MIN_OVERLAP
+    pairs = Enrollment.objects.filter(course__is_published=True).values_list('user_id', 'course_id')
+    neighbors = co_enrollment_neighbors(list(pairs.iterator(chunk_size=10000)), top_k, min_overlap)
+
+    with transaction.atomic():
+        CourseNeighbor.objects.all().delete()
+        CourseNeighbor.objects.bulk_create(
+            [
+                CourseNeighbor(course_id=course_id, neighbor_id=neighbor_id, score=score, overlap=overlap, rank=rank)
+                for course_id, neighbor_id, score, overlap, rank in neighbors
+            ],
+            batch_size=1000,
+        )
+    invalidate()
+    return len(neighbors)
+
+
+def _popular(exclude, limit):
+    from .models import Course
+
+    return list(
+        Course.objects.filter(is_published=True)
+        .exclude(pk__in=exclude)
+        .order_by('-enrollment_count', '-pk')[:limit]
+    )
+
+
+def related_courses(course, limit=4, user=None):
+    """
+    Courses most often taken alongside ``course``, leaving out any ``user``
+    is already enrolled in. Topped up from the same category while the
+    neighbors haven't been built for a new course.
+    """
+    from .models import Course, Enrollment
+
+    candidates = Course.objects.filter(is_published=True)
+    if user is not None and user.is_authenticated:
+        candidates = candidates.exclude(pk__in=Enrollment.objects.filter(user=user).values('course_id'))
+    related = list(candidates.filter(neighbor_of__course=course).order_by('neighbor_of__rank')[:limit])
+
+    if len(related) < limit:
+        seen = [course.pk] + [other.pk for other in related]
+        related += list(
+            candidates.filter(category_id=course.category_id)
+            .exclude(pk__in=seen)
+            .order_by('-enrollment_count', '-pk')[:limit - len(related)]
+        )
+    return related
+
+
+def recommended_courses(user, limit=3):
+    """
+    Courses for ``user``, scored by summing their similarity to every course
+    the user is enrolled in. Falls back to the most popular courses for
+    users without enrollments.
+    """
+    from .models import Course, Enrollment
+
+    enrolled = Enrollment.objects.filter(user=user).values('course_id')
+    recommended = list(
+        Course.objects.filter(is_published=True, neighbor_of__course__in=enrolled)
+        .exclude(pk__in=enrolled)
+        .annotate(recommendation_score=Sum('neighbor_of__score'))
+        .order_by('-recommendation_score', '-enrollment_count', '-pk')[:limit]
+    )
+    if len(recommended) < limit:
+        exclude = list(enrolled.values_list('course_id', flat=True)) + [course.pk for course in recommended]
+        recommended += _popular(exclude, limit - len(recommended))
+    return recommended
@@ -0,0 +1,262 @@
+# courses/rendering.py
+"""
+Markdown rendering for lesson content.
+
+Lessons are rendered when they are saved and the HTML is stored on the
+row, so page views never run Markdown or Pygments. ``RENDERER_VERSION`` is
+a hash of everything that affects the output; lessons rendered with a
+different version are re-rendered after the next migrate.
+
+Lessons are rendered block by block (paragraphs, headings, fenced code)
+and each block's HTML is cached by its hash, so saving a small edit to a
+long lesson only re-renders, and re-highlights, the blocks that changed.
+
+Short texts rendered in templates (course descriptions, question text) go
+through ``markdown_renderer``, which keeps one Markdown engine per thread
+and remembers recent results.
+"""
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+import markdown
+import pygments
+from django.conf import settings
+from django.core.cache import cache
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+
+MARKDOWN_EXTENSIONS = [
+    'fenced_code',  # For code blocks with ```
+    'codehilite',   # For syntax highlighting
+    'tables',       # For tables
+    'nl2br',        # For line breaks
+]
+
+MARKDOWN_EXTENSION_CONFIGS = {
+    'codehilite': {
+        'css_class': 'highlight',
+        'linenums': False,
+        'guess_lang': True,
+    }
+}
+
+
+TEMPLATE_MARKDOWN_EXTENSIONS = MARKDOWN_EXTENSIONS + [
+    'toc',          # Table of contents
+    'sane_lists',   # Better list handling
+]
+
+
+def renderer_version(extensions=MARKDOWN_EXTENSIONS, extension_configs=MARKDOWN_EXTENSION_CONFIGS):
+    payload = json.dumps(
+        [markdown.__version__, pygments.__version__, extensions, extension_configs],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+RENDERER_VERSION = renderer_version()
+
+
+class MarkdownRenderer:
+    """
+    Markdown to HTML with one reusable engine per thread.
+
+    Building a ``markdown.Markdown`` loads and configures every extension,
+    which costs more than converting a short text, so each thread keeps
+    its own engine and resets it between documents. Results are kept in a
+    bounded LRU keyed by the renderer config and a hash of the text;
+    ``cache_size=0`` turns the cache off.
+    """
+
+    def __init__(self, extensions, extension_configs=None, cache_size=1024):
+        self.extensions = list(extensions)
+        self.extension_configs = extension_configs or {}
+        self.cache_size = cache_size
+        self.version = renderer_version(self.extensions, self.extension_configs)
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _engine(self):
+        engine = getattr(self._local, 'engine', None)
+        if engine is None:
+            engine = markdown.Markdown(extensions=self.extensions, extension_configs=self.extension_configs)
+            self._local.engine = engine
+        return engine
+
+    def _convert(self, text):
+        engine = self._engine()
+        try:
+            return engine.convert(text)
+        finally:
+            engine.reset()
+
+    def convert(self, text):
+        if not text:
+            return ''
+        if self.cache_size <= 0:
+            return self._convert(text)
+
+        key = (self.version, hashlib.sha256(text.encode('utf-8')).digest())
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = self._convert(text)
+        with self._lock:
+            self._cache[key] = html
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._cache),
+                'max_size': self.cache_size,
+            }
+
+
+# Lessons are rendered once on save, so their results aren't worth caching
+lesson_renderer = MarkdownRenderer(MARKDOWN_EXTENSIONS, MARKDOWN_EXTENSION_CONFIGS, cache_size=0)
+
+markdown_renderer = MarkdownRenderer(
+    TEMPLATE_MARKDOWN_EXTENSIONS,
+    MARKDOWN_EXTENSION_CONFIGS,
+    cache_size=settings.MARKDOWN_RENDER_CACHE_SIZE,
+)
+
+
+def render_markdown(text):
+    return lesson_renderer.convert(text)
+
+
+# The pattern fenced_code itself uses, so blocks split exactly where it
+# would. It always renders a fence as a block of its own.
+FENCED_BLOCK_RE = FencedBlockPreprocessor.FENCED_BLOCK_RE
+
+# Link references and raw HTML can span or reach across blocks
+UNSPLITTABLE_RE = re.compile(r'^(?:[ ]{0,3}\[[^\]\n]+\]:|<)', re.MULTILINE)
+
+HIGHLIGHT_END = '</code></pre></div>'
+
+# After a blank line, indented lines, list items and quotes still belong to
+# the block above (Markdown merges loose lists and adjacent quotes)
+CONTINUATION_RE = re.compile(r'[ >]|[*+-][ ]|\d+\.[ ]')
+
+
+def _split_prose(text):
+    blocks = []
+    lines = []
+    after_blank = False
+    for line in text.split('\n'):
+        if not line.strip():
+            after_blank = True
+            lines.append('')
+            continue
+        if after_blank and not CONTINUATION_RE.match(line):
+            blocks.append('\n'.join(lines).strip('\n'))
+            lines = []
+        after_blank = False
+        lines.append(line)
+    blocks.append('\n'.join(lines).strip('\n'))
+    return [block for block in blocks if block]
+
+
+def split_blocks(text):
+    """
+    Split Markdown into top-level blocks that render the same on their own
+    as they do in the whole document. Text that can't be split safely is
+    returned as a single block.
+    """
+    text = text.replace('\r\n', '\n').replace('\r', '\n').expandtabs(4)
+    if UNSPLITTABLE_RE.search(text):
+        return [text]
+    blocks = []
+    position = 0
+    for match in FENCED_BLOCK_RE.finditer(text):
+        blocks.extend(_split_prose(text[position:match.start()]))
+        blocks.append(match.group(0))
+        position = match.end()
+    blocks.extend(_split_prose(text[position:]))
+    return blocks
+
+
+def block_cache_key(block):
+    digest = hashlib.sha256(block.encode('utf-8')).hexdigest()
+    return f'lesson-block:{RENDERER_VERSION}:{digest}'
+
+
+def render_blocks(text):
+    """Render lesson Markdown block by block, reusing cached block HTML"""
+    if not text:
+        return ''
+    blocks = split_blocks(text)
+    keys = [block_cache_key(block) for block in blocks]
+    cached = cache.get_many(keys)
+    rendered = {}
+    parts = []
+    for key, block in zip(keys, blocks):
+        html = cached.get(key)
+        if html is None:
+            html = rendered.get(key)
+        if html is None:
+            html = rendered[key] = lesson_renderer.convert(block)
+        parts.append(html)
+    if rendered:
+        cache.set_many(rendered, settings.LESSON_BLOCK_CACHE_TIMEOUT)
+    parts = [part for part in parts if part]
+    # Highlighted code ends in a newline that Markdown only strips at the
+    # end of the whole document
+    return ''.join(
+        part + ('\n\n' if part.endswith(HIGHLIGHT_END) else '\n') for part in parts[:-1]
+    ) + ''.join(parts[-1:])
+
+
+def render_lesson(lesson):
+    """Render a lesson's content onto its content_html fields; doesn't save"""
+    lesson.content_html = render_blocks(lesson.content)
+    lesson.content_html_version = RENDERER_VERSION
+    return lesson
+
+
+def render_batch(rows):
+    """
+    Render ``(pk, content)`` pairs to ``(pk, html)``; runs in
+    prerender_lessons' worker processes. Their block cache writes only
+    reach the site with a shared cache such as Redis; a LocMemCache goes
+    away with the worker.
+    """
+    return [(pk, render_blocks(content)) for pk, content in rows]
+
+
+def rerender_stale_lessons():
+    """Re-render lessons rendered by another renderer version; returns how many"""
+    from .models import Lesson
+
+    stale = Lesson.objects.exclude(content_html_version=RENDERER_VERSION).only('id', 'content')
+    count = 0
+    for lesson in stale.iterator():
+        render_lesson(lesson)
+        lesson.save(update_fields=['content_html', 'content_html_version'])
+        count += 1
+    return count
@@ -0,0 +1,385 @@
+# courses/sandbox.py
+"""
+Pool of pre-started sandbox workers used by CodeExecutor.
+
+Each worker is a long-lived ``sandbox_worker.py`` process that already has
+the standard library imported and forks a fresh child per job, so grading
+a submission no longer pays for interpreter start-up.
+
+Jobs are dicts with the submitted ``code``, its ``tests``, the test
+number ``offset`` and the ``timeout``, or "exec" jobs naming a program
+to run (see sandbox_worker). Running one returns the worker's
+"exit" frame (returncode, stdout, stderr, timed_out, duration); the
+per-test records are passed to ``on_record`` as they stream in.
+
+``SandboxPool.run_async`` is the same for async views: waiting for a free
+worker and for its frames happens on the event loop, so a process can
+hold many grading streams open without a thread for each.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from . import sandbox_worker
+from .sandbox_worker import READ_SIZE, RESULT_FD_ENV, FrameReader, collect, write_frame
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = sandbox_worker.__file__
+
+# Submissions must never see the web process environment (secret key,
+# database and mail credentials), so sandboxes get a minimal one.
+SANDBOX_ENV_KEYS = ['PATH', 'LANG', 'LC_ALL', 'TZ']
+
+# Extra time allowed on top of the job timeout before the pool gives up on
+# a worker that has stopped answering.
+WORKER_GRACE_SECONDS = 5
+WORKER_START_TIMEOUT = 10
+
+
+def sandbox_env(**extra):
+    env = {key: os.environ[key] for key in SANDBOX_ENV_KEYS if key in os.environ}
+    env.update(PYTHONDONTWRITEBYTECODE='1', PYTHONIOENCODING='utf-8', HOME='/tmp')
+    env.update(extra)
+    return env
+
+
+async def read_frame_async(reader, deadline):
+    """FrameReader.read() for the event loop"""
+    loop = asyncio.get_running_loop()
+    while True:
+        for frame in reader.frames():
+            return frame
+        readable = loop.create_future()
+        loop.add_reader(reader.fd, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            raise TimeoutError('No frame received before the deadline')
+        finally:
+            loop.remove_reader(reader.fd)
+        chunk = os.read(reader.fd, READ_SIZE)
+        if not chunk:
+            if reader.buffer:
+                raise EOFError('Stream closed in the middle of a frame')
+            return None
+        reader.feed(chunk)
+
+
+class SandboxError(Exception):
+    """A sandbox worker crashed or stopped responding"""
+
+
+class SandboxPoolExhausted(SandboxError):
+    """No worker became free within the acquire timeout"""
+
+
+class SandboxWorker:
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+            close_fds=True,
+            env=sandbox_env(),
+        )
+        self.reader = FrameReader(self.process.stdout.fileno())
+        self.jobs_run = 0
+
+    def wait_ready(self, timeout=WORKER_START_TIMEOUT):
+        frame = self.reader.read(deadline=time.monotonic() + timeout)
+        if not frame or not frame.get('ready'):
+            raise SandboxError('Sandbox worker failed to start')
+
+    def run(self, job, on_record):
+        """Send a job, forward its records and return the exit frame"""
+        self.jobs_run += 1
+        write_frame(self.process.stdin.fileno(), job)
+        deadline = time.monotonic() + job['timeout'] + WORKER_GRACE_SECONDS
+        while True:
+            frame = self.reader.read(deadline=deadline)
+            if frame is None:
+                raise SandboxError('Sandbox worker exited unexpectedly')
+            if frame.get('type') == 'record':
+                on_record(frame['record'])
+            else:
+                return frame
+
+    async def run_async(self, job, on_record):
+        """run() for the event loop"""
+        self.jobs_run += 1
+        write_frame(self.process.stdin.fileno(), job)
+        deadline = time.monotonic() + job['timeout'] + WORKER_GRACE_SECONDS
+        while True:
+            frame = await read_frame_async(self.reader, deadline)
+            if frame is None:
+                raise SandboxError('Sandbox worker exited unexpectedly')
+            if frame.get('type') == 'record':
+                on_record(frame['record'])
+            else:
+                return frame
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class SandboxPool:
+    """
+    Fixed-size pool of warm sandbox workers.
+
+    Workers are recycled after ``max_jobs_per_worker`` jobs, or immediately
+    if they crash or stop responding. ``stats()`` reports how often callers
+    had to queue for a free worker and for how long.
+    """
+
+    def __init__(self, size=4, max_jobs_per_worker=100, acquire_timeout=30):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.acquire_timeout = acquire_timeout
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._async_waiters = []
+        self._busy = 0
+        self._closed = False
+
+        self._jobs = 0
+        self._acquires = 0
+        self._saturated_acquires = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._peak_busy = 0
+        self._recycled = 0
+
+        workers = [SandboxWorker() for _ in range(size)]
+        for worker in workers:
+            worker.wait_ready()
+        self._idle.extend(workers)
+
+    def _acquire(self):
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        with self._cond:
+            self._count_acquire()
+            while not self._idle:
+                remaining = deadline - time.monotonic()
+                if self._closed or remaining <= 0:
+                    raise SandboxPoolExhausted('No sandbox worker became available')
+                self._cond.wait(remaining)
+            worker = self._checkout(started)
+        return worker
+
+    async def _acquire_async(self):
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            self._count_acquire()
+        while True:
+            with self._cond:
+                if self._idle:
+                    return self._checkout(started)
+                if self._closed:
+                    raise SandboxPoolExhausted('No sandbox worker became available')
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, max(0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise SandboxPoolExhausted('No sandbox worker became available')
+
+    def _count_acquire(self):
+        self._acquires += 1
+        if not self._idle:
+            self._saturated_acquires += 1
+
+    def _checkout(self, started):
+        """Take an idle worker; the caller holds the condition"""
+        worker = self._idle.pop()
+        self._busy += 1
+        self._peak_busy = max(self._peak_busy, self._busy)
+        waited = time.monotonic() - started
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        if waited > 0.5:
+            logger.warning('Sandbox pool saturated, waited %.2fs for a worker: %s', waited, self.stats())
+        return worker
+
+    def _wake_async_waiter(self):
+        """Wake one event loop caller waiting for a worker; the caller holds the condition"""
+        while self._async_waiters:
+            loop, waiter = self._async_waiters.pop(0)
+            if not waiter.done():
+                loop.call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(None))
+                return
+
+    def _needs_recycle(self, worker, healthy):
+        return not healthy or worker.jobs_run >= self.max_jobs_per_worker
+
+    def _release(self, worker, healthy):
+        recycle = self._needs_recycle(worker, healthy)
+        if recycle:
+            worker.close()
+            try:
+                worker = SandboxWorker()
+                worker.wait_ready()
+            except (OSError, SandboxError):
+                logger.exception('Could not start a replacement sandbox worker')
+                worker = None
+
+        with self._cond:
+            self._busy -= 1
+            self._jobs += 1
+            if recycle:
+                self._recycled += 1
+            if worker is not None:
+                if self._closed:
+                    worker.close()
+                else:
+                    self._idle.append(worker)
+            self._cond.notify()
+            self._wake_async_waiter()
+
+    def run(self, job, on_record=None):
+        """Run a job on a free worker and return its exit frame"""
+        worker = self._acquire()
+        healthy = False
+        try:
+            frame = worker.run(job, on_record or (lambda record: None))
+            healthy = True
+        except (OSError, EOFError, TimeoutError) as e:
+            raise SandboxError(f'Sandbox worker failed: {e}') from e
+        finally:
+            self._release(worker, healthy)
+        return frame
+
+    async def run_async(self, job, on_record=None):
+        """run() for the event loop"""
+        worker = await self._acquire_async()
+        healthy = False
+        try:
+            frame = await worker.run_async(job, on_record or (lambda record: None))
+            healthy = True
+        except (OSError, EOFError, TimeoutError) as e:
+            raise SandboxError(f'Sandbox worker failed: {e}') from e
+        finally:
+            # A worker abandoned mid-job (e.g. the stream was cancelled) is
+            # replaced; starting its replacement blocks, so not on the loop.
+            if self._needs_recycle(worker, healthy):
+                await asyncio.to_thread(self._release, worker, healthy)
+            else:
+                self._release(worker, healthy)
+        return frame
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'busy': self._busy,
+                'peak_busy': self._peak_busy,
+                'jobs': self._jobs,
+                'recycled_workers': self._recycled,
+                'acquires': self._acquires,
+                'saturated_acquires': self._saturated_acquires,
+                'saturation_ratio': self._saturated_acquires / self._acquires if self._acquires else 0.0,
+                'total_wait_seconds': round(self._total_wait, 3),
+                'max_wait_seconds': round(self._max_wait, 3),
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+            while self._async_waiters:
+                self._wake_async_waiter()
+        for worker in idle:
+            worker.close()
+
+
+def run_cold(job, on_record=None):
+    """Run a job in a brand-new interpreter, for when the pool is disabled"""
+    res_r, res_w = os.pipe()
+    env = sandbox_env(**{RESULT_FD_ENV: str(res_w)})
+    deadline = time.monotonic() + job['timeout']
+    try:
+        process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, '--run'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=(res_w,),
+            env=env,
+            start_new_session=True,
+        )
+    finally:
+        os.close(res_w)
+
+    try:
+        try:
+            process.stdin.write(json.dumps(job).encode('utf-8'))
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        frame = collect(
+            process.pid,
+            process.stdout.fileno(),
+            process.stderr.fileno(),
+            res_r,
+            deadline,
+            on_record or (lambda record: None),
+            job,
+        )
+        # collect() reaped the child already
+        process.returncode = frame['returncode']
+        return frame
+    finally:
+        os.close(res_r)
+        process.stdout.close()
+        process.stderr.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Return this process's sandbox pool, starting it on first use"""
+    global _pool
+    with _pool_lock:
+        # A pool inherited through fork (e.g. gunicorn --preload) belongs to
+        # the parent, so every process starts its own.
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = SandboxPool(
+                size=settings.CODE_EXECUTOR_POOL_SIZE,
+                max_jobs_per_worker=settings.CODE_EXECUTOR_MAX_JOBS_PER_WORKER,
+                acquire_timeout=settings.CODE_EXECUTOR_ACQUIRE_TIMEOUT,
+            )
+        return _pool
+
+
+def pool_supported():
+    return hasattr(os, 'fork')
+
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None and _pool.pid == os.getpid():
+        _pool.close()
@@ -0,0 +1,408 @@
+# courses/sandbox_worker.py
+"""
+Sandbox worker process and test harness.
+
+SandboxPool starts one of these per pool slot. The worker imports the
+commonly used standard library modules once, then reads length-prefixed
+JSON jobs from stdin and runs each job in a freshly forked child.
+
+Jobs carry the submitted code and its test cases as data. The child runs
+the tests and writes one length-prefixed record per test to a dedicated
+result pipe as soon as it finishes, so anything the submission prints
+stays on its own stdout. The worker forwards those records to the pool
+as they arrive, followed by a final "exit" frame.
+
+Jobs of kind "exec" run a program instead (a compiler, or a compiled
+submission): the child applies the job's limits and replaces itself with
+the program, with the job's ``stdin`` text as its standard input.
+
+Run with ``--run`` the same code executes a single job read from stdin
+in the current process, which is how jobs run when the pool is disabled.
+
+This file is executed directly, so it must only import from the standard
+library.
+"""
+import ast
+import json
+import os
+import resource
+import select
+import signal
+import struct
+import sys
+import tempfile
+import time
+import traceback
+
+# Modules that submissions commonly import. Loading them here means every
+# forked child gets them for free instead of paying for the import per run.
+PRELOAD_MODULES = [
+    'bisect', 'collections', 'copy', 'dataclasses', 'datetime', 'decimal',
+    'fractions', 'functools', 'heapq', 'io', 'itertools', 'json', 'math',
+    'operator', 'random', 're', 'statistics', 'string', 'typing',
+]
+
+HEADER = struct.Struct('>I')
+READ_SIZE = 65536
+RESULT_FD_ENV = 'SANDBOX_RESULT_FD'
+
+# Defaults used when a job does not say otherwise
+DEFAULT_MAX_OUTPUT_BYTES = 64 * 1024
+DEFAULT_MAX_RESULT_BYTES = 1024 * 1024
+
+
+def write_frame(fd, obj):
+    """Write one length-prefixed JSON frame to a file descriptor"""
+    data = json.dumps(obj).encode('utf-8')
+    view = memoryview(HEADER.pack(len(data)) + data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+class FrameReader:
+    """Incrementally decode length-prefixed JSON frames from a file descriptor"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = bytearray()
+
+    def feed(self, chunk):
+        self.buffer.extend(chunk)
+
+    def frames(self):
+        """Yield every complete frame currently buffered"""
+        while len(self.buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer)
+            end = HEADER.size + length
+            if len(self.buffer) < end:
+                return
+            body = bytes(self.buffer[HEADER.size:end])
+            del self.buffer[:end]
+            yield json.loads(body.decode('utf-8'))
+
+    def read(self, deadline=None):
+        """Block for the next frame. Returns None on EOF, raises TimeoutError past deadline."""
+        while True:
+            for frame in self.frames():
+                return frame
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('No frame received before the deadline')
+                ready, _, _ = select.select([self.fd], [], [], remaining)
+                if not ready:
+                    raise TimeoutError('No frame received before the deadline')
+            chunk = os.read(self.fd, READ_SIZE)
+            if not chunk:
+                if self.buffer:
+                    raise EOFError('Stream closed in the middle of a frame')
+                return None
+            self.feed(chunk)
+
+
+# ------------------------------------------------------------------
+# Test harness (runs inside the sandboxed child)
+# ------------------------------------------------------------------
+
+def parse_arguments(raw_input):
+    """
+    Turn a test case input into positional arguments for ``solution``.
+
+    String inputs are parsed as a comma-separated list of Python literals
+    ("1, [2, 3], 'x'"), never evaluated as code. A JSON list is used as the
+    argument list directly.
+    """
+    if isinstance(raw_input, list):
+        return raw_input
+    if raw_input is None or (isinstance(raw_input, str) and not raw_input.strip()):
+        return []
+    if not isinstance(raw_input, str):
+        return [raw_input]
+    return list(ast.literal_eval(f'({raw_input},)'))
+
+
+def run_tests(job, result_fd):
+    """Load the submission and stream one record per test case to result_fd"""
+    namespace = {'__name__': '__main__', '__builtins__': __builtins__}
+    try:
+        exec(compile(job['code'], '<submission>', 'exec'), namespace)
+    except SystemExit:
+        raise
+    except BaseException:
+        write_frame(result_fd, {'type': 'error', 'message': traceback.format_exc()})
+        return
+
+    solution = namespace.get('solution')
+    for number, test_case in enumerate(job['tests'], start=job.get('offset', 0) + 1):
+        raw_input = test_case.get('input', '')
+        expected = str(test_case.get('expected_output', ''))
+        record = {'type': 'test', 'test_case': number, 'input': str(raw_input), 'expected': expected}
+        try:
+            if solution is None:
+                raise NameError("name 'solution' is not defined")
+            try:
+                arguments = parse_arguments(raw_input)
+            except (ValueError, SyntaxError):
+                raise ValueError('test input is not a list of Python literals')
+            actual = str(solution(*arguments))
+            record.update(actual=actual, passed=actual == expected)
+        except Exception as e:
+            record.update(actual=f'Error: {e}', passed=False)
+        write_frame(result_fd, record)
+
+    write_frame(result_fd, {'type': 'done'})
+
+
+def apply_limits(limits):
+    """Apply CPU time, address space and open file limits to this process"""
+    cpu_seconds = limits.get('cpu_seconds')
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    memory_bytes = limits.get('memory_bytes')
+    if memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    open_files = limits.get('open_files')
+    if open_files:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (open_files, open_files))
+
+
+def execute(job, result_fd):
+    """Apply the job's limits, run the harness and return the exit status"""
+    status = 0
+    try:
+        apply_limits(job.get('limits', {}))
+        run_tests(job, result_fd)
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            status = e.code
+        elif e.code is not None:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except BaseException:
+            pass
+    return status
+
+
+def exec_program(job):
+    """Replace this process with the job's program; only returns on failure"""
+    stdin = tempfile.TemporaryFile()
+    stdin.write(job.get('stdin', '').encode('utf-8'))
+    stdin.seek(0)
+    os.dup2(stdin.fileno(), 0)
+    stdin.close()
+    if job.get('cwd'):
+        os.chdir(job['cwd'])
+    apply_limits(job.get('limits', {}))
+    try:
+        os.execvp(job['argv'][0], job['argv'])
+    except OSError as e:
+        print(f"Could not run {job['argv'][0]}: {e}", file=sys.stderr)
+    return 127
+
+
+def run_child(job, result_fd):
+    """Run a job in the current process and return its exit status"""
+    if job.get('kind') == 'exec':
+        # Programs report through their output only
+        os.close(result_fd)
+        return exec_program(job)
+    return execute(job, result_fd)
+
+
+# ------------------------------------------------------------------
+# Supervision (runs in the worker, or in the web process for cold runs)
+# ------------------------------------------------------------------
+
+def _kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class CappedBuffer:
+    """Keep the first ``limit`` bytes of a stream and count the rest"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+        self.dropped = 0
+
+    def write(self, chunk):
+        room = self.limit - len(self.data)
+        if room > 0:
+            self.data.extend(chunk[:room])
+        self.dropped += max(0, len(chunk) - max(room, 0))
+
+    def text(self):
+        text = self.data.decode('utf-8', errors='replace')
+        if self.dropped:
+            text += f'\n... [output truncated, {self.dropped} more bytes]'
+        return text
+
+
+def supervise(pid, handlers, deadline):
+    """
+    Feed a child's output to handlers until it exits or the deadline passes.
+
+    ``handlers`` maps pipe file descriptors to callables that receive each
+    chunk read. Returns (exit status, resource usage, timed_out). Once the
+    deadline is reached the child is killed together with anything it
+    spawned.
+    """
+    open_fds = list(handlers)
+    timed_out = False
+    status = None
+
+    while status is None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        if open_fds:
+            ready, _, _ = select.select(open_fds, [], [], remaining)
+            for fd in ready:
+                chunk = os.read(fd, READ_SIZE)
+                if chunk:
+                    handlers[fd](chunk)
+                else:
+                    open_fds.remove(fd)
+        else:
+            # Output is closed; the child is about to exit (or closed its
+            # streams on purpose), so poll for it until the deadline.
+            reaped, wait_status, rusage = os.wait4(pid, os.WNOHANG)
+            if reaped:
+                status = wait_status
+            else:
+                time.sleep(0.005)
+
+    if status is None:
+        _kill_group(pid)
+        _, status, rusage = os.wait4(pid, 0)
+    return status, rusage, timed_out
+
+
+def collect(pid, stdout_fd, stderr_fd, result_fd, deadline, on_record, job=None):
+    """
+    Supervise a harness child, passing each result record to on_record.
+
+    Output is captured up to the job's byte caps (anything past the cap is
+    read and dropped so the child never blocks). Returns the "exit" frame
+    describing how the child finished and what it used.
+    """
+    job = job or {}
+    max_output = job.get('max_output_bytes', DEFAULT_MAX_OUTPUT_BYTES)
+    started = time.monotonic()
+    stdout = CappedBuffer(max_output)
+    stderr = CappedBuffer(max_output)
+    records = FrameReader(result_fd)
+    result_bytes = [job.get('max_result_bytes', DEFAULT_MAX_RESULT_BYTES)]
+
+    def read_records(chunk):
+        # A submission could write to the result pipe itself; stop
+        # decoding rather than buffer without bound.
+        result_bytes[0] -= len(chunk)
+        if result_bytes[0] < 0:
+            return
+        records.feed(chunk)
+        for record in records.frames():
+            on_record(record)
+
+    status, rusage, timed_out = supervise(pid, {
+        stdout_fd: stdout.write,
+        stderr_fd: stderr.write,
+        result_fd: read_records,
+    }, deadline)
+
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    peak_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return {
+        'type': 'exit',
+        'returncode': os.waitstatus_to_exitcode(status),
+        'stdout': stdout.text(),
+        'stderr': stderr.text(),
+        'timed_out': timed_out,
+        'duration': time.monotonic() - started,
+        'cpu_seconds': round(rusage.ru_utime + rusage.ru_stime, 4),
+        'peak_rss_kb': peak_rss_kb,
+    }
+
+
+def run_job(job, channel_fds, on_record):
+    """Run a single job in a forked child and return its exit frame"""
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    res_r, res_w = os.pipe()
+    deadline = time.monotonic() + job['timeout']
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.setsid()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            for fd in (devnull, out_r, out_w, err_r, err_w, res_r) + tuple(channel_fds):
+                os.close(fd)
+            status = run_child(job, res_w)
+        finally:
+            os._exit(status)
+
+    for fd in (out_w, err_w, res_w):
+        os.close(fd)
+    try:
+        return collect(pid, out_r, err_r, res_r, deadline, on_record, job)
+    finally:
+        for fd in (out_r, err_r, res_r):
+            os.close(fd)
+
+
+def main():
+    for name in PRELOAD_MODULES:
+        __import__(name)
+
+    # Keep private copies of the job channel and point the standard streams
+    # elsewhere, so stray output can never corrupt a frame.
+    channel_in = os.dup(0)
+    channel_out = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    channel_fds = (channel_in, channel_out)
+
+    def forward(record):
+        write_frame(channel_out, {'type': 'record', 'record': record})
+
+    reader = FrameReader(channel_in)
+    write_frame(channel_out, {'ready': True, 'pid': os.getpid()})
+
+    while True:
+        job = reader.read()
+        if job is None:
+            break
+        write_frame(channel_out, run_job(job, channel_fds, forward))
+
+
+def run_standalone():
+    """Run one job read from stdin in this process (cold start)"""
+    job = json.loads(sys.stdin.buffer.read().decode('utf-8'))
+    result_fd = int(os.environ.pop(RESULT_FD_ENV))
+    os._exit(run_child(job, result_fd))
+
+
+if __name__ == '__main__':
+    if '--run' in sys.argv[1:]:
+        run_standalone()
+    else:
+        main()
@@ -0,0 +1,166 @@
+# courses/search.py
+"""
+Full-text search over the course catalog.
+
+Each course's title, description and instructor name are indexed in a
+side table: an FTS5 virtual table on SQLite, or a ``tsvector`` column with
+a GIN index on PostgreSQL. The index is kept up to date by the Course,
+Instructor and User signals in courses/models.py, and can be rebuilt with
+``manage.py rebuild_search_index``. Other databases fall back to
+``icontains`` matching without ranking.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'courses_course_search'
+
+# Query words; anything else the user typed is ignored, so it can't break
+# the FTS5 or tsquery syntax
+TOKEN_RE = re.compile(r'\w+')
+MAX_TOKENS = 10
+
+# Relative weight of matches in the title, description and instructor name
+SQLITE_WEIGHTS = (10.0, 1.0, 5.0)
+
+SQLITE_DOCUMENTS = '''
+    SELECT c.id, c.title, c.description,
+           COALESCE(u.first_name, '') || ' ' || COALESCE(u.last_name, '') || ' ' || COALESCE(u.username, '')
+    FROM courses_course c
+    LEFT JOIN courses_instructor i ON i.id = c.instructor_id
+    LEFT JOIN auth_user u ON u.id = i.user_id
+'''
+
+POSTGRES_DOCUMENTS = '''
+    SELECT c.id,
+           setweight(to_tsvector('english', c.title), 'A')
+           || setweight(to_tsvector('english', concat_ws(' ', u.first_name, u.last_name, u.username)), 'B')
+           || setweight(to_tsvector('english', c.description), 'C')
+    FROM courses_course c
+    LEFT JOIN courses_instructor i ON i.id = c.instructor_id
+    LEFT JOIN auth_user u ON u.id = i.user_id
+'''
+
+
+def is_supported(conn=connection):
+    return conn.vendor in ('sqlite', 'postgresql')
+
+
+def create_index(schema_editor):
+    """Create the search table for the migration's database, and fill it"""
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            f"title, description, instructor, "
+            f"tokenize='porter unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE {SEARCH_TABLE} ('
+            f'course_id bigint PRIMARY KEY REFERENCES courses_course (id) '
+            f'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            f'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(f'CREATE INDEX {SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)')
+    else:
+        return
+    rebuild_index(conn=schema_editor.connection)
+
+
+def drop_index(schema_editor):
+    if is_supported(schema_editor.connection):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+def _write(course_ids=None, conn=connection):
+    if conn.vendor == 'sqlite':
+        delete = f'DELETE FROM {SEARCH_TABLE}'
+        insert = f'INSERT INTO {SEARCH_TABLE} (rowid, title, description, instructor) {SQLITE_DOCUMENTS}'
+        upsert = ''
+    else:
+        delete = f'DELETE FROM {SEARCH_TABLE}' if course_ids is None else ''
+        insert = f'INSERT INTO {SEARCH_TABLE} (course_id, document) {POSTGRES_DOCUMENTS}'
+        upsert = ' ON CONFLICT (course_id) DO UPDATE SET document = EXCLUDED.document'
+
+    params = []
+    if course_ids is not None:
+        placeholders = ', '.join(['%s'] * len(course_ids))
+        if delete:
+            delete += f' WHERE rowid IN ({placeholders})'
+        insert += f' WHERE c.id IN ({placeholders})'
+        params = list(course_ids)
+
+    with conn.cursor() as cursor:
+        if delete:
+            cursor.execute(delete, params)
+        cursor.execute(insert + upsert, params)
+
+
+def index_courses(course_ids, conn=connection):
+    """(Re-)index the given courses"""
+    course_ids = list(course_ids)
+    if course_ids and is_supported(conn):
+        _write(course_ids, conn=conn)
+
+
+def remove_courses(course_ids, conn=connection):
+    course_ids = list(course_ids)
+    # PostgreSQL rows go with the course through the foreign key
+    if course_ids and conn.vendor == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(course_ids))
+        with conn.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', course_ids)
+
+
+def rebuild_index(conn=connection):
+    if is_supported(conn):
+        _write(conn=conn)
+
+
+def query_tokens(text):
+    return TOKEN_RE.findall(text.lower())[:MAX_TOKENS]
+
+
+def search_courses(courses, text):
+    """
+    Filter a Course queryset to the courses matching ``text`` and annotate
+    each with ``search_rank`` (higher is more relevant). Every word must
+    match, and the last characters of a word may be left off.
+    """
+    tokens = query_tokens(text)
+    if not tokens or not is_supported(connection):
+        return courses.filter(
+            Q(title__icontains=text) |
+            Q(description__icontains=text) |
+            Q(instructor__user__first_name__icontains=text) |
+            Q(instructor__user__last_name__icontains=text)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    if connection.vendor == 'sqlite':
+        query = ' '.join(f'"{token}"*' for token in tokens)
+        matches = RawSQL(
+            f'courses_course.id IN (SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s)',
+            (query,), output_field=BooleanField(),
+        )
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        # bm25() is lower for better matches
+        rank = RawSQL(
+            f'SELECT -bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s AND rowid = courses_course.id',
+            (query,), output_field=FloatField(),
+        )
+    else:
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        matches = RawSQL(
+            f"courses_course.id IN (SELECT course_id FROM {SEARCH_TABLE} "
+            f"WHERE document @@ to_tsquery('english', %s))",
+            (query,), output_field=BooleanField(),
+        )
+        rank = RawSQL(
+            f"SELECT ts_rank_cd(document, to_tsquery('english', %s)) FROM {SEARCH_TABLE} "
+            f"WHERE course_id = courses_course.id",
+            (query,), output_field=FloatField(),
+        )
+    return courses.filter(matches).annotate(search_rank=rank)
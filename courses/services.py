@@ -1,87 +1,538 @@
 # courses/services.py
+import asyncio
 import subprocess
 import tempfile
 import os
 import json
 import uuid
+import copy
+import hashlib
+import math
+import shutil
+import signal
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from django.utils import timezone
 
+from .compilers import (
+    artifact_cache, compiler_available, is_compiled, normalize_output, read_compile_error, stdin_for,
+    toolchain_for, write_compile_error,
+)
+from .sandbox import SandboxError, SandboxPoolExhausted, get_worker_pool, pool_supported, run_cold
+
+# Bump whenever the harness or result format changes, so cached results
+# produced by an older executor are never served.
+EXECUTOR_VERSION = '3'
+
+
+def grader_error(message, results=None, **extra):
+    """
+    A result for a run the grader itself failed (busy pool, broken sandbox,
+    missing toolchain). It says nothing about the code, so it must be
+    retried rather than scored.
+    """
+    return dict(status="error", message=message, results=results or [], grader_error=True, **extra)
+
+
+def is_grader_error(result):
+    return bool(result and result.get('grader_error'))
+
+
+def normalize_code(code):
+    """Normalize line endings and trailing whitespace so trivially different copies hash the same"""
+    lines = code.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+
+class ExecutionResultCache:
+    """
+    Size-bounded LRU cache of execution results, shared by every
+    CodeExecutor in the process.
+
+    Keys are content addresses: a hash of the normalized code, language,
+    test cases, timeout and executor version. Editing a question's test
+    cases or timeout therefore changes the key, so stale results are never
+    served and simply age out.
+
+    Measurements of the run that produced a result (``PER_RUN_KEYS``) are
+    not stored; a hit is marked ``cached`` instead.
+    """
+
+    PER_RUN_KEYS = ('resources', 'timing')
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(code, language, test_cases, timeout):
+        payload = json.dumps(
+            [EXECUTOR_VERSION, language, normalize_code(code), test_cases, timeout],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return dict(copy.deepcopy(result), cached=True)
+
+    def set(self, key, result):
+        if self.max_entries <= 0:
+            return
+        result = {name: value for name, value in result.items() if name not in self.PER_RUN_KEYS}
+        with self._lock:
+            self._entries[key] = copy.deepcopy(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+result_cache = ExecutionResultCache(max_entries=settings.CODE_EXECUTOR_RESULT_CACHE_SIZE)
+
+
+class PythonRunState:
+    """Collects the records of one Python harness run and turns its outcome into a result"""
+
+    def __init__(self, on_result=None):
+        self.on_result = on_result
+        self.results = []
+        self.errors = []
+        self.finished = False
+
+    def handle_record(self, record):
+        record_type = record.pop('type', None)
+        if record_type == 'test':
+            self.results.append(record)
+            if self.on_result:
+                self.on_result(record)
+        elif record_type == 'error':
+            self.errors.append(record.get('message', ''))
+        elif record_type == 'done':
+            self.finished = True
+
+    def busy_result(self):
+        return grader_error("The grader is busy, please try again shortly")
+
+    def failed_result(self):
+        return grader_error("The grader failed while running your code, please try again", self.results)
+
+    def result(self, outcome):
+        if outcome['timed_out']:
+            result = {
+                "status": "timeout",
+                "message": "Code execution timed out",
+                "results": self.results
+            }
+        elif self.errors:
+            result = {
+                "status": "error",
+                "message": self.errors[0],
+                "results": self.results
+            }
+        elif outcome['returncode'] == -signal.SIGXCPU:
+            result = {
+                "status": "error",
+                "message": "CPU time limit exceeded",
+                "results": self.results
+            }
+        elif not self.finished:
+            result = {
+                "status": "error",
+                "message": outcome['stderr'] or f"Program exited with code {outcome['returncode']} before all tests ran",
+                "results": self.results
+            }
+        else:
+            result = {"status": "success", "results": self.results}
+
+        # Whatever the submission printed is kept apart from the results
+        if outcome['stdout']:
+            result["output"] = outcome['stdout']
+        result["resources"] = {
+            "cpu_seconds": outcome['cpu_seconds'],
+            "peak_rss_kb": outcome['peak_rss_kb'],
+            "wall_seconds": round(outcome['duration'], 4),
+        }
+        return result
+
+
 class CodeExecutor:
-    def __init__(self, timeout=10):
+    def __init__(self, timeout=10, use_pool=None, parallel_tests=None, shard_size=None, use_cache=True):
         self.timeout = timeout
+        self.use_cache = use_cache
+        if use_pool is None:
+            use_pool = settings.CODE_EXECUTOR_POOL_ENABLED and pool_supported()
+        self.use_pool = use_pool
+        if parallel_tests is None:
+            parallel_tests = settings.CODE_EXECUTOR_PARALLEL_TESTS
+        self.parallel_tests = parallel_tests
+        self.shard_size = max(1, shard_size or settings.CODE_EXECUTOR_TEST_SHARD_SIZE)
     
-    def execute_python(self, code, test_cases):
-        """Execute Python code with test cases"""
-        results = []
+    def execute_python(self, code, test_cases, on_result=None):
+        """
+        Execute Python code with test cases.
+
+        ``on_result`` is called with each test result as soon as it is
+        reported. In parallel mode it may be called from several threads
+        and out of test order.
+        """
+        if self.parallel_tests and len(test_cases) > self.shard_size:
+            return self._execute_python_sharded(code, test_cases, on_result)
+        return self._execute_python_shard(code, test_cases, on_result=on_result)
+    
+    def _execute_python_sharded(self, code, test_cases, on_result=None):
+        """
+        Run test cases in shards, in parallel, each shard with its own
+        time limit, and merge the results back into a single result.
+        """
+        shards = self._shards(test_cases)
+        max_workers = min(len(shards), os.cpu_count() or 1)
+        if self.use_pool:
+            max_workers = min(max_workers, settings.CODE_EXECUTOR_POOL_SIZE)
         
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            # Wrap the user code in a test harness
-            test_code = f"""
-{code}
-
-# Test cases
-test_results = []
-try:
-{self._generate_python_tests(test_cases)}
-    print(json.dumps({{"status": "success", "results": test_results}}))
-except Exception as e:
-    print(json.dumps({{"status": "error", "message": str(e), "results": test_results}}))
-"""
-            f.write(test_code)
-            temp_file = f.name
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            outcomes = list(pool.map(
+                lambda shard: self._execute_python_shard(code, shard[1], offset=shard[0], on_result=on_result),
+                shards
+            ))
+        return self._merge_shards(shards, outcomes)
+    
+    def _shards(self, test_cases):
+        return [
+            (offset, test_cases[offset:offset + self.shard_size])
+            for offset in range(0, len(test_cases), self.shard_size)
+        ]
+    
+    def _merge_shards(self, shards, outcomes):
+        """Merge per-shard results back into a single result"""
+        results = []
+        failures = []
+        for (offset, shard_cases), outcome in zip(shards, outcomes):
+            shard_results = outcome.get('results', [])
+            results.extend(shard_results)
+            if outcome['status'] == 'success':
+                continue
+            failures.append(outcome)
+            # Tests that never reported because the shard timed out or
+            # crashed count as failed, like they would in a single run.
+            reported = {r.get('test_case') for r in shard_results}
+            for i, test_case in enumerate(shard_cases):
+                if offset + i + 1 not in reported:
+                    results.append({
+                        "test_case": offset + i + 1,
+                        "input": str(test_case.get('input', '')),
+                        "expected": str(test_case.get('expected_output', '')),
+                        "actual": f"Error: {outcome.get('message', '')}",
+                        "passed": False,
+                    })
         
+        results.sort(key=lambda r: r.get('test_case', 0))
+        merged = {"status": "success", "results": results}
+        usage = [outcome['resources'] for outcome in outcomes if 'resources' in outcome]
+        if usage:
+            merged["resources"] = {
+                "cpu_seconds": round(sum(u['cpu_seconds'] for u in usage), 4),
+                "peak_rss_kb": max(u['peak_rss_kb'] for u in usage),
+                "wall_seconds": max(u['wall_seconds'] for u in usage),
+            }
+        if failures:
+            # A timeout anywhere makes the whole result a timeout
+            worst = next((f for f in failures if f['status'] == 'timeout'), failures[0])
+            merged["status"] = worst["status"]
+            merged["message"] = worst.get("message", "")
+            if any(is_grader_error(failure) for failure in failures):
+                merged["grader_error"] = True
+        return merged
+    
+    def _execute_python_shard(self, code, test_cases, offset=0, on_result=None):
+        """Execute Python code against a run of test cases in one process"""
+        job = self._python_job(code, test_cases, offset)
+        state = PythonRunState(on_result)
         try:
-            # Execute the code
-            result = subprocess.run(
-                ['python', temp_file],
-                capture_output=True,
-                text=True,
-                timeout=self.timeout
-            )
+            outcome = self._run_job(job, state.handle_record)
+        except SandboxPoolExhausted:
+            return state.busy_result()
+        except SandboxError:
+            return state.failed_result()
+        return state.result(outcome)
+    
+    async def _execute_python_shard_async(self, code, test_cases, offset=0, on_result=None):
+        """_execute_python_shard() for the event loop"""
+        job = self._python_job(code, test_cases, offset)
+        state = PythonRunState(on_result)
+        try:
+            outcome = await self._run_job_async(job, state.handle_record)
+        except SandboxPoolExhausted:
+            return state.busy_result()
+        except SandboxError:
+            return state.failed_result()
+        return state.result(outcome)
+    
+    def _python_job(self, code, test_cases, offset=0):
+        return {
+            'code': code,
+            'tests': test_cases,
+            'offset': offset,
+            'timeout': self.timeout,
+            'limits': self._resource_limits(),
+            'max_output_bytes': settings.CODE_EXECUTOR_MAX_OUTPUT_BYTES,
+        }
+    
+    def _resource_limits(self):
+        """rlimits for the sandboxed child; the wall-clock timeout is enforced separately"""
+        return {
+            # One second of slack so a plain busy loop hits the wall-clock
+            # timeout; the CPU limit catches multi-threaded burners.
+            'cpu_seconds': int(math.ceil(self.timeout)) + 1,
+            'memory_bytes': settings.CODE_EXECUTOR_MEMORY_LIMIT_MB * 1024 * 1024,
+            'open_files': settings.CODE_EXECUTOR_OPEN_FILES_LIMIT,
+        }
+    
+    async def _run_job_async(self, job, on_record):
+        """_run_job() for the event loop; waiting for the sandbox doesn't hold a thread"""
+        if self.use_pool:
+            delivered = []
             
-            if result.returncode == 0:
-                output = json.loads(result.stdout.strip())
-                return output
-            else:
-                return {
-                    "status": "error",
-                    "message": result.stderr,
-                    "results": []
-                }
-                
-        except subprocess.TimeoutExpired:
+            def forward(record):
+                delivered.append(True)
+                on_record(record)
+            
+            try:
+                # Starting the pool blocks, but only on first use
+                pool = await asyncio.to_thread(get_worker_pool)
+                return await pool.run_async(job, forward)
+            except SandboxPoolExhausted:
+                raise
+            except SandboxError:
+                if delivered:
+                    raise
+        loop = asyncio.get_running_loop()
+        return await asyncio.to_thread(
+            run_cold, job, lambda record: loop.call_soon_threadsafe(on_record, record)
+        )
+    
+    def _run_job(self, job, on_record):
+        """Run a sandbox job on a warm pool worker, or cold-start python for it"""
+        if self.use_pool:
+            delivered = []
+            
+            def forward(record):
+                delivered.append(True)
+                on_record(record)
+            
+            try:
+                return get_worker_pool().run(job, forward)
+            except SandboxPoolExhausted:
+                raise
+            except SandboxError:
+                # A broken worker has already been replaced. Retry cold
+                # unless results were already streamed to the caller.
+                if delivered:
+                    raise
+        return run_cold(job, on_record)
+    
+    def execute_compiled(self, code, language, test_cases, on_result=None):
+        """
+        Compile C, C++ or Java code, or reuse a cached build of it, and run
+        the program once per test case with the test input on stdin.
+        """
+        toolchain = toolchain_for(language, code)
+        if not compiler_available(toolchain):
+            return grader_error(f"The grader has no {language} toolchain installed")
+        
+        try:
+            build_dir, compile_error, timing = self._compile(language, code, toolchain)
+        except SandboxPoolExhausted:
+            return grader_error("The grader is busy, please try again shortly")
+        except SandboxError:
+            return grader_error("The grader failed while compiling your code, please try again")
+        if compile_error is not None:
             return {
-                "status": "timeout",
-                "message": "Code execution timed out",
-                "results": []
+                "status": "error",
+                "message": f"Compilation failed:\n{compile_error}",
+                "results": [],
+                "timing": timing
             }
-        except json.JSONDecodeError:
-            return {
-                "status": "error", 
-                "message": "Invalid output format",
-                "results": []
+        
+        argv = [arg.format(build=build_dir) for arg in toolchain['run']]
+        limits = self._resource_limits()
+        if not toolchain.get('limit_address_space', True):
+            del limits['memory_bytes']
+        
+        tests = list(enumerate(test_cases, 1))
+        if self.parallel_tests and len(tests) > 1:
+            # Like sharded Python runs, every test gets the full time limit
+            max_workers = min(len(tests), os.cpu_count() or 1)
+            if self.use_pool:
+                max_workers = min(max_workers, settings.CODE_EXECUTOR_POOL_SIZE)
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                runs = list(pool.map(
+                    lambda test: self._run_compiled_test(argv, limits, test[0], test[1], self.timeout, on_result),
+                    tests
+                ))
+        else:
+            runs = []
+            deadline = time.monotonic() + self.timeout
+            for number, test_case in tests:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                run = self._run_compiled_test(argv, limits, number, test_case, remaining, on_result)
+                runs.append(run)
+                if run[1] is None or run[1]['timed_out']:
+                    break
+        
+        results = [record for record, outcome in runs]
+        outcomes = [outcome for record, outcome in runs if outcome is not None]
+        timing["run_seconds"] = round(sum(outcome['duration'] for outcome in outcomes), 4)
+        result = {"status": "success", "results": results, "timing": timing}
+        if outcomes:
+            result["resources"] = {
+                "cpu_seconds": round(sum(outcome['cpu_seconds'] for outcome in outcomes), 4),
+                "peak_rss_kb": max(outcome['peak_rss_kb'] for outcome in outcomes),
+                "wall_seconds": timing["run_seconds"],
             }
-        finally:
-            # Clean up
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
-    
-    def _generate_python_tests(self, test_cases):
-        """Generate Python test cases from JSON"""
-        test_code = ""
-        for i, test_case in enumerate(test_cases):
-            input_data = test_case.get('input', '')
-            expected_output = test_case.get('expected_output', '')
+        if len(outcomes) < len(runs):
+            result["status"] = "error"
+            result["message"] = "The grader failed while running your code, please try again"
+            result["grader_error"] = True
+        elif any(outcome['timed_out'] for outcome in outcomes) or len(runs) < len(tests):
+            result["status"] = "timeout"
+            result["message"] = "Code execution timed out"
+        return result
+    
+    def _compile(self, language, code, toolchain):
+        """Return (build_dir, compile_error, timing), compiling only on a cache miss"""
+        started = time.monotonic()
+        source = normalize_code(code) + '\n'
+        key = artifact_cache.make_key(language, source, toolchain)
+        build_dir = artifact_cache.lookup(key)
+        cached = build_dir is not None
+        compile_error = None
+        
+        if not cached:
+            build_dir = artifact_cache.new_build_dir()
+            with open(os.path.join(build_dir, toolchain['source']), 'w', encoding='utf-8') as f:
+                f.write(source)
+            limits = {
+                'cpu_seconds': settings.CODE_EXECUTOR_COMPILE_TIMEOUT + 1,
+                'open_files': 256,
+            }
+            if toolchain.get('limit_address_space', True):
+                limits['memory_bytes'] = max(1024, settings.CODE_EXECUTOR_MEMORY_LIMIT_MB * 4) * 1024 * 1024
+            job = {
+                'kind': 'exec',
+                'argv': toolchain['compile'],
+                'cwd': build_dir,
+                'timeout': settings.CODE_EXECUTOR_COMPILE_TIMEOUT,
+                'limits': limits,
+                'max_output_bytes': settings.CODE_EXECUTOR_MAX_OUTPUT_BYTES,
+            }
+            try:
+                outcome = self._run_job(job, lambda record: None)
+            except SandboxError:
+                shutil.rmtree(build_dir, ignore_errors=True)
+                raise
             
-            # Simple test case generation - you can extend this based on your needs
-            test_code += f'    try:\n'
-            test_code += f'        result = solution({input_data})\n'
-            test_code += f'        test_results.append({{"test_case": {i + 1}, "input": "{input_data}", "expected": "{expected_output}", "actual": str(result), "passed": str(result) == "{expected_output}"}})\n'
-            test_code += f'    except Exception as e:\n'
-            test_code += f'        test_results.append({{"test_case": {i + 1}, "input": "{input_data}", "expected": "{expected_output}", "actual": f"Error: {{e}}", "passed": False}})\n'
+            if outcome['timed_out'] or outcome['returncode'] < 0:
+                # Killed compilers say nothing about the source; don't cache
+                shutil.rmtree(build_dir, ignore_errors=True)
+                build_dir = None
+                compile_error = "Compilation timed out" if outcome['timed_out'] else "The compiler ran out of resources"
+            else:
+                if outcome['returncode'] != 0:
+                    write_compile_error(
+                        build_dir,
+                        outcome['stderr'] or outcome['stdout'] or f"Compiler exited with code {outcome['returncode']}"
+                    )
+                build_dir = artifact_cache.publish(build_dir, key)
+        
+        if build_dir is not None:
+            compile_error = read_compile_error(build_dir)
+        timing = {
+            "compile_seconds": round(time.monotonic() - started, 4),
+            "compile_cached": cached,
+        }
+        return build_dir, compile_error, timing
+    
+    def _run_compiled_test(self, argv, limits, number, test_case, timeout, on_result=None):
+        """Run a compiled program on one test case; returns (result, outcome)"""
+        test_input = test_case.get('input', '')
+        expected = str(test_case.get('expected_output', ''))
+        record = {
+            "test_case": number,
+            "input": str(test_input),
+            "expected": expected,
+        }
+        scratch = tempfile.mkdtemp(prefix='codelab-run-')
+        job = {
+            'kind': 'exec',
+            'argv': argv,
+            'stdin': stdin_for(test_input),
+            'cwd': scratch,
+            'timeout': timeout,
+            'limits': limits,
+            'max_output_bytes': settings.CODE_EXECUTOR_MAX_OUTPUT_BYTES,
+        }
+        try:
+            outcome = self._run_job(job, lambda record: None)
+        except SandboxError:
+            record.update(actual="Error: The grader failed while running your code", passed=False)
+            return record, None
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
         
-        return test_code
+        returncode = outcome['returncode']
+        if outcome['timed_out']:
+            record.update(actual="Error: Time limit exceeded", passed=False)
+        elif returncode == -signal.SIGXCPU:
+            record.update(actual="Error: CPU time limit exceeded", passed=False)
+        elif returncode < 0:
+            reason = signal.strsignal(-returncode) or f"signal {-returncode}"
+            record.update(actual=f"Error: Killed ({reason})", passed=False)
+        elif returncode != 0:
+            message = f"Error: Exited with code {returncode}"
+            if outcome['stderr'].strip():
+                message += f"\n{outcome['stderr'].strip()}"
+            record.update(actual=message, passed=False)
+        else:
+            record.update(
+                actual=outcome['stdout'].rstrip(),
+                passed=normalize_output(outcome['stdout']) == normalize_output(expected),
+            )
+        if on_result:
+            on_result(record)
+        return record, outcome
     
     def execute_javascript(self, code, test_cases):
         """Execute JavaScript code with test cases"""
@@ -89,11 +540,68 @@ except Exception as e:
         # You can use Node.js for server-side execution
         pass
     
-    def evaluate_code(self, code, language, test_cases):
-        """Evaluate code based on language"""
+    def evaluate_code(self, code, language, test_cases, on_result=None):
+        """
+        Evaluate code based on language, reusing cached results for identical
+        submissions. ``on_result`` receives each test result as it completes.
+        """
+        if not self.use_cache:
+            return self._evaluate_code(code, language, test_cases, on_result)
+        
+        key = result_cache.make_key(code, language, test_cases, self.timeout)
+        cached = result_cache.get(key)
+        if cached is not None:
+            if on_result:
+                for test_result in cached.get('results', []):
+                    on_result(test_result)
+            return cached
+        
+        result = self._evaluate_code(code, language, test_cases, on_result)
+        # Only deterministic outcomes are cached; timeouts and errors can
+        # depend on load (busy grader, killed worker) and must be retried.
+        if result and result.get('status') == 'success':
+            result_cache.set(key, result)
+        return result
+    
+    async def evaluate_code_async(self, code, language, test_cases, on_result=None):
+        """
+        evaluate_code() for async views. Python submissions are awaited on the
+        event loop; other languages run in a thread. ``on_result`` is always
+        called on the event loop.
+        """
+        key = result_cache.make_key(code, language, test_cases, self.timeout) if self.use_cache else None
+        cached = result_cache.get(key) if key else None
+        if cached is not None:
+            if on_result:
+                for test_result in cached.get('results', []):
+                    on_result(test_result)
+            return cached
+        
+        if language == 'python':
+            if self.parallel_tests and len(test_cases) > self.shard_size:
+                shards = self._shards(test_cases)
+                outcomes = await asyncio.gather(*[
+                    self._execute_python_shard_async(code, shard_cases, offset=offset, on_result=on_result)
+                    for offset, shard_cases in shards
+                ])
+                result = self._merge_shards(shards, outcomes)
+            else:
+                result = await self._execute_python_shard_async(code, test_cases, on_result=on_result)
+        else:
+            loop = asyncio.get_running_loop()
+            threadsafe_on_result = (lambda record: loop.call_soon_threadsafe(on_result, record)) if on_result else None
+            result = await asyncio.to_thread(self._evaluate_code, code, language, test_cases, threadsafe_on_result)
+        
+        if key and result and result.get('status') == 'success':
+            result_cache.set(key, result)
+        return result
+    
+    def _evaluate_code(self, code, language, test_cases, on_result=None):
         if language == 'python':
-            return self.execute_python(code, test_cases)
+            return self.execute_python(code, test_cases, on_result)
         elif language == 'javascript':
             return self.execute_javascript(code, test_cases)
+        elif is_compiled(language):
+            return self.execute_compiled(code, language, test_cases, on_result)
         else:
             return {"status": "error", "message": f"Unsupported language: {language}"}
\ No newline at end of file
@@ -1,3 +1,919 @@
-from django.test import TestCase
+import json
+import os
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import markdown
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.template import Context, Template
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .grading import (
+    claim_jobs, claim_regrade_run, enqueue_submission, process_job, regrade_chunk, requeue_stale_jobs, start_regrade,
+)
+from .models import (
+    Assignment, AssignmentSubmission, Category, CodeQuestion, CodeSubmission, Course, Enrollment, GradingJob,
+    Instructor, Lesson, RegradeRun, Review,
+)
+from . import typeahead
+from .admission import AdmissionGate
+from .compilers import compiler_available, toolchain_for
+from .facets import catalog_facets
+from .instructor_stats import compute_stats, get_stats
+from .sandbox import run_cold
+from .sandbox_worker import HEADER, CappedBuffer, FrameReader, write_frame
+from .pagination import CursorPaginator
+from .recommendations import build_neighbors, related_courses
+from .rendering import (
+    MARKDOWN_EXTENSION_CONFIGS, RENDERER_VERSION, TEMPLATE_MARKDOWN_EXTENSIONS, MarkdownRenderer,
+    lesson_renderer, render_batch, render_blocks, render_markdown,
+)
+from .search import search_courses
+from .services import CodeExecutor, grader_error, result_cache
+
+User = get_user_model()
+
+# Pages render without running collectstatic first
+page_settings = override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+
+
+def make_course(title='Python Basics', **fields):
+    user = User.objects.create_user(username=f'teacher-{User.objects.count()}')
+    instructor = Instructor.objects.create(user=user, bio='Teaches')
+    fields.setdefault('category', Category.objects.get_or_create(name='Programming')[0])
+    fields.setdefault('is_published', True)
+    fields.setdefault('description', f'All about {title}')
+    return Course.objects.create(title=title, instructor=instructor, thumbnail='x.jpg', **fields)
+
+
+def make_code_submission(code='print(1)', test_cases=None):
+    course = make_course()
+    assignment = Assignment.objects.create(course=course, title='Loops', description='Loops', is_published=True)
+    question = CodeQuestion.objects.create(
+        assignment=assignment, question_text='Print one', points=10,
+        test_cases=test_cases or [{'input': '', 'expected_output': '1'}],
+    )
+    student = User.objects.create_user(username=f'student-{User.objects.count()}')
+    submission = AssignmentSubmission.objects.create(assignment=assignment, user=student)
+    code_submission = CodeSubmission.objects.create(
+        submission=submission, question=question, code=code, language='python'
+    )
+    return submission, code_submission
+
+
+class SandboxFrameTests(SimpleTestCase):
+    def setUp(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.addCleanup(os.close, self.read_fd)
+
+    def test_frames_round_trip(self):
+        frames = [{'type': 'test', 'test_case': 1, 'actual': 'héllo'}, {'type': 'done'}]
+        for frame in frames:
+            write_frame(self.write_fd, frame)
+        os.close(self.write_fd)
+
+        reader = FrameReader(self.read_fd)
+        self.assertEqual([reader.read(), reader.read()], frames)
+        self.assertIsNone(reader.read())
+
+    def test_frame_split_across_reads(self):
+        os.close(self.write_fd)
+        reader = FrameReader(self.read_fd)
+        body = b'{"type": "done"}'
+        data = HEADER.pack(len(body)) + body
+        reader.feed(data[:3])
+        self.assertEqual(list(reader.frames()), [])
+        reader.feed(data[3:])
+        self.assertEqual(list(reader.frames()), [{'type': 'done'}])
+
+    def test_eof_in_the_middle_of_a_frame(self):
+        os.write(self.write_fd, HEADER.pack(100) + b'{"type"')
+        os.close(self.write_fd)
+        with self.assertRaises(EOFError):
+            FrameReader(self.read_fd).read()
+
+    def test_capped_buffer_counts_what_it_drops(self):
+        buffer = CappedBuffer(5)
+        buffer.write(b'abc')
+        buffer.write(b'defgh')
+        self.assertEqual(buffer.text(), 'abcde\n... [output truncated, 3 more bytes]')
+
+    def test_output_past_the_cap_is_dropped(self):
+        job = {
+            'code': "print('x' * 100000)\ndef solution():\n    return 1",
+            'tests': [{'input': '', 'expected_output': '1'}],
+            'offset': 0,
+            'timeout': 5,
+            'max_output_bytes': 1000,
+        }
+        records = []
+        frame = run_cold(job, records.append)
+        self.assertEqual(frame['returncode'], 0)
+        self.assertTrue(frame['stdout'].startswith('x' * 1000 + '\n... [output truncated'))
+        self.assertTrue(records[0]['passed'])
+
+
+ADD_TESTS = [{'input': f'{a}, 1', 'expected_output': str(a + 1)} for a in range(5)]
+
+
+class ShardedExecutionTests(SimpleTestCase):
+    def executor(self):
+        return CodeExecutor(timeout=1, use_pool=False, parallel_tests=True, shard_size=2, use_cache=False)
+
+    def test_shards_are_numbered_and_ordered_like_a_single_run(self):
+        result = self.executor().evaluate_code('def solution(a, b):\n    return a + b\n', 'python', ADD_TESTS)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual([r['test_case'] for r in result['results']], [1, 2, 3, 4, 5])
+        self.assertEqual([r['input'] for r in result['results']], [test['input'] for test in ADD_TESTS])
+        self.assertTrue(all(r['passed'] for r in result['results']))
+
+    def test_timeout_in_one_shard_times_out_the_whole_result(self):
+        code = 'def solution(a, b):\n    while a == 3:\n        pass\n    return a + b\n'
+        result = self.executor().evaluate_code(code, 'python', ADD_TESTS)
+        self.assertEqual(result['status'], 'timeout')
+        self.assertEqual(
+            [(r['test_case'], r['passed']) for r in result['results']],
+            [(1, True), (2, True), (3, True), (4, False), (5, True)],
+        )
+
+    def test_merge_fills_in_tests_a_failed_shard_never_reported(self):
+        executor = self.executor()
+        shards = executor._shards(ADD_TESTS)
+        self.assertEqual([offset for offset, _ in shards], [0, 2, 4])
+        outcomes = [
+            {'status': 'success', 'results': [{'test_case': 2, 'passed': True}, {'test_case': 1, 'passed': True}]},
+            {'status': 'timeout', 'message': 'Code execution timed out', 'results': [{'test_case': 3, 'passed': True}]},
+            grader_error('The grader is busy, please try again shortly'),
+        ]
+        merged = executor._merge_shards(shards, outcomes)
+        self.assertEqual((merged['status'], merged['message']), ('timeout', 'Code execution timed out'))
+        self.assertTrue(merged['grader_error'])
+        self.assertEqual(
+            [(r['test_case'], r['passed']) for r in merged['results']],
+            [(1, True), (2, True), (3, True), (4, False), (5, False)],
+        )
+        self.assertEqual(merged['results'][3]['input'], '3, 1')
+
+
+class SandboxLimitTests(SimpleTestCase):
+    def run_code(self, body):
+        code = f'def solution(a, b):\n{body}\n    return a + b\n'
+        return CodeExecutor(timeout=2, use_pool=False, use_cache=False).evaluate_code(code, 'python', ADD_TESTS[:1])
+
+    def test_resources_are_recorded(self):
+        result = self.run_code('    pass')
+        self.assertEqual(set(result['resources']), {'cpu_seconds', 'peak_rss_kb', 'wall_seconds'})
+        self.assertGreater(result['resources']['peak_rss_kb'], 0)
+
+    @override_settings(CODE_EXECUTOR_MEMORY_LIMIT_MB=64)
+    def test_memory_limit(self):
+        [test] = self.run_code('    data = bytearray(256 * 1024 * 1024)')['results']
+        self.assertFalse(test['passed'])
+
+    @override_settings(CODE_EXECUTOR_OPEN_FILES_LIMIT=16)
+    def test_open_files_limit(self):
+        [test] = self.run_code("    files = [open('/dev/null') for _ in range(32)]")['results']
+        self.assertIn('Too many open files', test['actual'])
+
+
+class CompilerAvailableTests(SimpleTestCase):
+    def test_java_needs_the_runtime_as_well_as_the_compiler(self):
+        toolchain = toolchain_for('java', 'public class Main {}')
+        with mock.patch('shutil.which', lambda command: f'/usr/bin/{command}' if command == 'javac' else None):
+            self.assertFalse(compiler_available(toolchain))
+        with mock.patch('shutil.which', lambda command: f'/usr/bin/{command}'):
+            self.assertTrue(compiler_available(toolchain))
+
+    def test_c_runs_its_own_build(self):
+        with mock.patch('shutil.which', lambda command: '/usr/bin/gcc' if command == 'gcc' else None):
+            self.assertTrue(compiler_available(toolchain_for('c', 'int main() {}')))
+
+
+class AdmissionGateTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.gate = AdmissionGate(concurrency=1, queue_size=0, queue_timeout=1, per_user=2, key_prefix='test-runs')
+
+    def test_count_survives_the_key_expiring_before_incr(self):
+        incr = cache.incr
+
+        def expire_then_incr(key, delta=1):
+            cache.delete(key)
+            return incr(key, delta)
+
+        with mock.patch.object(cache, 'incr', side_effect=expire_then_incr, create=True):
+            self.assertEqual(self.gate._count_run('test-runs:1'), 1)
+        self.assertEqual(self.gate._count_run('test-runs:1'), 2)
+
+
+class ExecutionResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        result_cache.clear()
+        self.addCleanup(result_cache.clear)
+
+    def test_hits_leave_out_the_first_runs_measurements(self):
+        result = {
+            'status': 'success',
+            'results': [{'test_case': 1, 'passed': True}],
+            'resources': {'cpu_seconds': 0.5, 'peak_rss_kb': 9000, 'wall_seconds': 0.6},
+            'timing': {'compile_seconds': 1.2, 'compile_cached': False},
+        }
+        executor = CodeExecutor(timeout=5)
+        with mock.patch.object(CodeExecutor, '_evaluate_code', return_value=result) as evaluate:
+            self.assertEqual(executor.evaluate_code('int main() {}', 'c', []), result)
+            cached = executor.evaluate_code('int main() {}', 'c', [])
+        evaluate.assert_called_once()
+        self.assertEqual(cached, {'status': 'success', 'results': result['results'], 'cached': True})
+
+
+class BenchmarkCommandTests(SimpleTestCase):
+    def test_concurrency_levels_below_one_are_rejected(self):
+        for levels in ('0', '4,-1', ','):
+            with self.subTest(levels=levels), self.assertRaisesMessage(CommandError, '--concurrency'):
+                call_command('benchmark_executor', concurrency=levels, stdout=StringIO())
+
+
+class GradingJobTests(TestCase):
+    def setUp(self):
+        self.submission, self.code_submission = make_code_submission()
+        self.job = enqueue_submission(self.submission)
+
+    def passing_result(self, *args):
+        return {'status': 'success', 'results': [{'test_case': 1, 'passed': True}]}
+
+    def test_claimed_job_is_graded_and_done(self):
+        [job] = claim_jobs()
+        self.assertEqual(job.status, 'running')
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(claim_jobs(), [])
+
+        with mock.patch.object(CodeExecutor, 'evaluate_code', self.passing_result):
+            process_job(job)
+        job.refresh_from_db()
+        self.submission.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(self.submission.status, 'graded')
+        self.assertEqual(self.submission.total_score, 10)
+
+    def test_grader_failure_requeues_with_backoff_instead_of_grading(self):
+        busy = grader_error('The grader is busy, please try again shortly')
+        [job] = claim_jobs()
+        with mock.patch.object(CodeExecutor, 'evaluate_code', return_value=busy), self.assertLogs('courses.grading'):
+            process_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertGreater(job.available_at, timezone.now())
+        self.code_submission.refresh_from_db()
+        self.assertEqual(self.code_submission.execution_result, {})
+        self.submission.refresh_from_db()
+        self.assertEqual(self.submission.status, 'grading')
+        # Not claimable again until the backoff has passed
+        self.assertEqual(claim_jobs(), [])
+
+        GradingJob.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        [job] = claim_jobs()
+        self.assertEqual(job.attempts, 2)
+
+    def test_stale_job_is_requeued_then_fails_after_max_attempts(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        for attempt in range(1, 4):
+            [job] = claim_jobs()
+            GradingJob.objects.filter(pk=job.pk).update(started_at=long_ago)
+            if attempt < 3:
+                self.assertEqual(requeue_stale_jobs(), 1)
+        with self.assertLogs('courses.grading'):
+            self.assertEqual(requeue_stale_jobs(), 0)
+
+        job.refresh_from_db()
+        self.submission.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertEqual(self.submission.status, 'failed')
+
+    def test_wait_is_measured_from_the_end_of_the_backoff(self):
+        available_at = timezone.now() - timedelta(seconds=2)
+        GradingJob.objects.filter(pk=self.job.pk).update(
+            created_at=timezone.now() - timedelta(hours=1), available_at=available_at
+        )
+        [job] = claim_jobs()
+        self.assertLess(job.wait_seconds, 60)
+
+    def test_job_fails_after_max_attempts(self):
+        failing = mock.patch.object(CodeExecutor, 'evaluate_code', side_effect=RuntimeError('sandbox gone'))
+        with failing, self.assertLogs('courses.grading'):
+            for _ in range(3):
+                GradingJob.objects.filter(pk=self.job.pk).update(available_at=None)
+                [job] = claim_jobs()
+                process_job(job)
+
+        job.refresh_from_db()
+        self.submission.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.last_error, 'sandbox gone')
+        self.assertEqual(self.submission.status, 'failed')
+
+
+class GradingStreamTests(TestCase):
+    def setUp(self):
+        self.submission, self.code_submission = make_code_submission(test_cases=[
+            {'input': '', 'expected_output': '1'},
+            {'input': '', 'expected_output': '1'},
+        ])
+        enqueue_submission(self.submission)
+        self.async_client.force_login(self.submission.user)
+        self.url = reverse('courses:assignment_submission_stream', kwargs={
+            'course_pk': self.submission.assignment.course_id, 'assignment_pk': self.submission.assignment_id
+        })
+
+    async def events(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        return [
+            (event.split('\n')[0].removeprefix('event: '), json.loads(event.split('\n')[1].removeprefix('data: ')))
+            for event in body.strip().split('\n\n')
+        ]
+
+    async def passing_result(self, code, language, test_cases, on_result=None):
+        results = [{'test_case': i, 'passed': True} for i in range(1, len(test_cases) + 1)]
+        for result in results:
+            on_result(result)
+        return {'status': 'success', 'results': results}
+
+    async def test_test_results_stream_before_the_outcome(self):
+        with mock.patch.object(CodeExecutor, 'evaluate_code_async', self.passing_result):
+            events = await self.events()
+
+        self.assertEqual([event for event, _ in events], ['test', 'test', 'complete'])
+        self.assertEqual([data['test_case'] for _, data in events[:2]], [1, 2])
+        self.assertEqual(events[0][1]['question_id'], self.code_submission.question_id)
+        self.assertEqual(events[2][1]['status'], 'graded')
+        job = await GradingJob.objects.aget(submission=self.submission)
+        self.assertEqual(job.status, 'done')
+
+    async def test_graded_submission_only_gets_the_outcome(self):
+        await AssignmentSubmission.objects.filter(pk=self.submission.pk).aupdate(status='graded')
+        with mock.patch.object(CodeExecutor, 'evaluate_code_async') as evaluate:
+            events = await self.events()
+        evaluate.assert_not_called()
+        self.assertEqual([event for event, _ in events], ['complete'])
+
+
+class RegradeTests(TestCase):
+    def test_regrade_keeps_hidden_flag(self):
+        submission, code_submission = make_code_submission(test_cases=[
+            {'input': '', 'expected_output': '1'},
+            {'input': '', 'expected_output': '1', 'hidden': True},
+        ])
+        result = {'status': 'success', 'results': [
+            {'test_case': 1, 'passed': True, 'output': '1'},
+            {'test_case': 2, 'passed': True, 'output': '1'},
+        ]}
+        start_regrade(code_submission.question)
+        run = claim_regrade_run('tests')
+        with mock.patch.object(CodeExecutor, 'evaluate_code', return_value=result):
+            self.assertEqual(regrade_chunk(run, max_workers=1), 1)
+
+        code_submission.refresh_from_db()
+        first, second = code_submission.execution_result['results']
+        self.assertNotIn('hidden', first)
+        self.assertTrue(second['hidden'])
+        self.assertEqual(code_submission.score, 10)
+        submission.refresh_from_db()
+        self.assertEqual(submission.total_score, 10)
+
+    def test_grader_failures_keep_old_score_and_can_be_retried(self):
+        submission, code_submission = make_code_submission()
+        other = CodeSubmission.objects.create(
+            submission=AssignmentSubmission.objects.create(
+                assignment=submission.assignment, user=User.objects.create_user(username='other')
+            ),
+            question=code_submission.question, code='print(2)', language='python',
+        )
+        CodeSubmission.objects.filter(pk=code_submission.pk).update(score=10, is_correct=True)
+        passing = {'status': 'success', 'results': [{'test_case': 1, 'passed': True}]}
+
+        def evaluate(code, language, test_cases):
+            return passing if code == 'print(2)' else grader_error('The grader is busy, please try again shortly')
+
+        start_regrade(code_submission.question)
+        run = claim_regrade_run('tests')
+        with mock.patch.object(CodeExecutor, 'evaluate_code', side_effect=evaluate):
+            self.assertEqual(regrade_chunk(run, max_workers=1), 2)
+            self.assertEqual(regrade_chunk(run, max_workers=1), 0)
+
+        code_submission.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(code_submission.score, 10)
+        self.assertEqual(code_submission.execution_result, {})
+        self.assertEqual(other.score, 10)
+        self.assertEqual((run.status, run.processed, run.changed), ('done', 2, 1))
+        self.assertEqual(run.skipped_ids, [code_submission.pk])
+
+        out = StringIO()
+        with mock.patch.object(CodeExecutor, 'evaluate_code', return_value=passing):
+            call_command('regrade', retry=[run.pk], workers=1, stdout=out)
+        retry = RegradeRun.objects.latest('created_at')
+        self.assertEqual(retry.submission_ids, [code_submission.pk])
+        self.assertEqual((retry.status, retry.processed, retry.skipped_ids), ('done', 1, []))
+        code_submission.refresh_from_db()
+        self.assertEqual(code_submission.execution_result, passing)
+
+    def test_command_leaves_runs_other_workers_are_running_alone(self):
+        _, code_submission = make_code_submission()
+        run = start_regrade(code_submission.question)
+        self.assertEqual(claim_regrade_run('worker-1').pk, run.pk)
+
+        out = StringIO()
+        with mock.patch.object(CodeExecutor, 'evaluate_code') as evaluate:
+            call_command('regrade', code_submission.question_id, stdout=out)
+        evaluate.assert_not_called()
+        self.assertIn('worker-1 is running it', out.getvalue())
+        run.refresh_from_db()
+        self.assertEqual((run.claimed_by, run.processed), ('worker-1', 0))
+
+        # Taken over once the other worker has stopped saving chunks
+        RegradeRun.objects.filter(pk=run.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim_regrade_run('worker-2', run_id=run.pk).claimed_by, 'worker-2')
+
+    def test_timeout_is_retried_alone_then_scored(self):
+        submission, code_submission = make_code_submission()
+        CodeSubmission.objects.filter(pk=code_submission.pk).update(score=10, is_correct=True)
+        timeout = {'status': 'timeout', 'message': 'Code execution timed out', 'results': []}
+
+        start_regrade(code_submission.question)
+        run = claim_regrade_run('tests')
+        with mock.patch.object(CodeExecutor, 'evaluate_code', return_value=timeout) as evaluate:
+            regrade_chunk(run, max_workers=1)
+        self.assertEqual(evaluate.call_count, 2)
+
+        code_submission.refresh_from_db()
+        self.assertEqual((code_submission.score, code_submission.is_correct), (0, False))
+        self.assertEqual(run.skipped_ids, [])
+        self.assertEqual(run.changed, 1)
+        submission.refresh_from_db()
+        self.assertEqual(submission.total_score, 0)
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_course('Machine Learning')
+        self.index = typeahead.PrefixIndex()
+
+    def labels(self, query):
+        return [item['label'] for item in self.index.lookup(query)]
+
+    def test_index_is_rebuilt_once_too_old_without_a_generation_bump(self):
+        self.assertEqual(self.labels('learn'), ['Machine Learning'])
+        # Changed by another process whose generation bump this cache never saw
+        Course.objects.filter(title='Machine Learning').update(title='Deep Learning')
+        self.assertEqual(self.labels('deep'), [])
+
+        later = time.monotonic() + typeahead.MAX_INDEX_AGE_SECONDS + 1
+        with mock.patch.object(typeahead.time, 'monotonic', return_value=later):
+            self.assertEqual(self.labels('deep'), ['Deep Learning'])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.title_match = make_course('Python Basics', description='Variables, loops and functions')
+        self.description_match = make_course('Data Science', description='Analysing data with Python and pandas')
+        make_course('French Cooking')
+
+    def search(self, text):
+        return list(search_courses(Course.objects.all(), text).order_by('-search_rank'))
+
+    def test_title_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('python'), [self.title_match, self.description_match])
+
+    def test_words_match_as_prefixes_and_all_must_match(self):
+        self.assertEqual(self.search('pyth'), [self.title_match, self.description_match])
+        self.assertEqual(self.search('python pandas'), [self.description_match])
+        self.assertEqual(self.search('python "); DROP'), [])
+
+    def test_index_follows_course_saves(self):
+        self.title_match.title = 'Rust Basics'
+        self.title_match.save()
+        self.assertEqual(self.search('rust'), [self.title_match])
+        self.assertEqual(self.search('python'), [self.description_match])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.programming = Category.objects.create(name='Programming')
+        self.design = Category.objects.create(name='Design')
+        make_course('Python Basics', category=self.programming, difficulty='beginner', duration_hours=4)
+        make_course('Advanced Python', category=self.programming, difficulty='advanced', price=20, duration_hours=12)
+        make_course('Logo Design', category=self.design, difficulty='beginner', price=10, duration_hours=8)
+        make_course('Draft', category=self.design, is_published=False)
+
+    def facets(self, **selected):
+        return catalog_facets(Course.objects.filter(is_published=True), '', selected)
+
+    def category_counts(self, facets):
+        return {category['name']: category['course_count'] for category in facets['categories']}
+
+    def test_counts_without_filters(self):
+        facets = self.facets()
+        self.assertEqual(self.category_counts(facets), {'Programming': 2, 'Design': 1})
+        self.assertEqual(facets['difficulty'], {'beginner': 2, 'advanced': 1})
+        self.assertEqual(facets['price'], {'free': 1, 'paid': 2})
+        self.assertEqual(facets['duration'], {'short': 1, 'medium': 1, 'long': 1})
+
+    def test_each_facet_ignores_its_own_filter(self):
+        facets = self.facets(category=[self.programming.pk], difficulty=['beginner'])
+        # Other categories still count the beginner courses they would add
+        self.assertEqual(self.category_counts(facets), {'Programming': 1, 'Design': 1})
+        self.assertEqual(facets['difficulty'], {'beginner': 1, 'advanced': 1})
+        self.assertEqual(facets['price'], {'free': 1})
+        self.assertEqual(facets['price_total'], 1)
+
+    def test_saving_a_course_refreshes_cached_counts(self):
+        self.assertEqual(self.facets()['difficulty']['advanced'], 1)
+        make_course('Advanced Design', category=self.design, difficulty='advanced')
+        self.assertEqual(self.facets()['difficulty']['advanced'], 2)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.courses = [make_course(f'Course {i}') for i in range(5)]
+        self.newest_first = list(reversed(self.courses))
+
+    def paginator(self, key='all'):
+        return CursorPaginator(Course.objects.all(), ('-created_at', '-pk'), per_page=2, key=key)
+
+    def test_pages_are_stable_when_courses_are_added(self):
+        page = self.paginator().page()
+        self.assertEqual(list(page), self.newest_first[:2])
+        self.assertFalse(page.has_previous())
+
+        make_course('Published meanwhile')
+        seen = list(page)
+        while page.has_next():
+            page = self.paginator().page(page.next_cursor)
+            seen += list(page)
+        self.assertEqual(seen, self.newest_first)
+
+    def test_previous_cursor_goes_back(self):
+        first = self.paginator().page()
+        second = self.paginator().page(first.next_cursor)
+        self.assertEqual(list(self.paginator().page(second.previous_cursor)), list(first))
+
+    def test_cursor_from_another_listing_starts_over(self):
+        second = self.paginator().page(self.paginator().page().next_cursor)
+        self.assertEqual(list(self.paginator(key='other').page(second.next_cursor)), self.newest_first[:2])
+        self.assertEqual(list(self.paginator().page('garbage')), self.newest_first[:2])
+
+
+class EnrollmentCountTests(TestCase):
+    def setUp(self):
+        self.course = make_course()
+        self.students = [User.objects.create_user(username=f'student-{i}') for i in range(3)]
+
+    def enrollment_count(self):
+        return Course.objects.values_list('enrollment_count', flat=True).get(pk=self.course.pk)
+
+    def test_count_follows_enrollments(self):
+        for student in self.students:
+            Enrollment.objects.create(user=student, course=self.course)
+        self.assertEqual(self.enrollment_count(), 3)
+
+        Enrollment.objects.filter(user=self.students[0]).delete()
+        self.assertEqual(self.enrollment_count(), 2)
+
+    def test_editing_a_course_keeps_enrollments_made_meanwhile(self):
+        Enrollment.objects.create(user=self.students[0], course=self.course)
+        self.course.title = 'Python Advanced'
+        self.course.save()
+        self.assertEqual(self.enrollment_count(), 1)
+
+    def test_reconcile_fixes_enrollments_made_without_signals(self):
+        Enrollment.objects.bulk_create(Enrollment(user=student, course=self.course) for student in self.students)
+        self.assertEqual(self.enrollment_count(), 0)
+
+        out = StringIO()
+        call_command('reconcile_enrollment_counts', '--dry-run', stdout=out)
+        self.assertIn('0 -> 3', out.getvalue())
+        self.assertEqual(self.enrollment_count(), 0)
+
+        call_command('reconcile_enrollment_counts', stdout=StringIO())
+        self.assertEqual(self.enrollment_count(), 3)
+
+
+class InstructorStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.submission, self.code_submission = make_code_submission()
+        self.course = self.submission.assignment.course
+        self.instructor_id = self.course.instructor_id
+        Enrollment.objects.create(user=self.submission.user, course=self.course)
+        Enrollment.objects.create(user=User.objects.create_user(username='idle'), course=self.course)
+        Review.objects.create(user=self.submission.user, course=self.course, rating=4)
+
+    def test_figures_take_four_queries(self):
+        with self.assertNumQueries(4):
+            stats = compute_stats(self.instructor_id)
+        self.assertEqual(stats['total_students'], 2)
+        self.assertEqual(stats['total_assignments'], 1)
+        self.assertEqual(stats['assignment_stats']['mixed'], 1)
+        self.assertEqual(stats['assignments_per_course'], {self.course.pk: 1})
+        self.assertEqual(stats['total_submissions'], 1)
+        self.assertEqual(stats['submission_rate'], 50.0)
+        self.assertEqual(stats['average_rating'], 4.0)
+        [assignment] = stats['recent_assignments']
+        self.assertEqual(assignment.question_count, 1)
+
+    def test_cached_figures_are_dropped_when_they_change(self):
+        self.assertEqual(get_stats(self.instructor_id)['total_students'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrollment.objects.create(user=User.objects.create_user(username='new'), course=self.course)
+        with self.assertNumQueries(4):
+            self.assertEqual(get_stats(self.instructor_id)['total_students'], 3)
+
+    def test_grading_a_submission_keeps_the_cached_figures(self):
+        get_stats(self.instructor_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.submission.status = 'graded'
+            self.submission.save()
+        with self.assertNumQueries(0):
+            get_stats(self.instructor_id)
+
+
+class ReviewAggregateTests(TestCase):
+    def setUp(self):
+        self.course = make_course()
+
+    def review(self, rating):
+        return Review.objects.create(
+            user=User.objects.create_user(username=f'reviewer-{User.objects.count()}'), course=self.course, rating=rating
+        )
+
+    def totals(self):
+        self.course.refresh_from_db()
+        return self.course.rating_sum, self.course.rating_count, self.course.average_rating
+
+    def test_totals_follow_create_update_and_delete(self):
+        first = self.review(5)
+        second = self.review(2)
+        self.assertEqual(self.totals(), (7, 2, 3.5))
+
+        second.rating = 4
+        second.save()
+        self.assertEqual(self.totals(), (9, 2, 4.5))
+
+        # A fresh copy from the database knows its saved rating too
+        first = Review.objects.get(pk=first.pk)
+        first.rating = 1
+        first.save()
+        self.assertEqual(self.totals(), (5, 2, 2.5))
+
+        first.delete()
+        self.assertEqual(self.totals(), (4, 1, 4.0))
+        second.delete()
+        self.assertEqual(self.totals(), (0, 0, 0.0))
+
+    @page_settings
+    def test_concurrent_first_reviews_end_up_as_one(self):
+        student = User.objects.create_user(username='student')
+        Enrollment.objects.create(user=student, course=self.course)
+        Review.objects.create(user=student, course=self.course, rating=2)
+        self.client.force_login(student)
+
+        # As if the other request's review was created just after this one looked
+        select_for_update = Review.objects.select_for_update
+        missed = [Review.objects.none()]
+        with mock.patch.object(
+            Review.objects, 'select_for_update', side_effect=lambda: missed.pop() if missed else select_for_update()
+        ):
+            response = self.client.post(reverse('courses:review_course', kwargs={'pk': self.course.pk}), {'rating': 5})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.totals(), (5, 1, 5.0))
+
+    def test_deleting_a_reviewer_removes_their_rating(self):
+        review = self.review(3)
+        review.user.delete()
+        self.assertEqual(self.totals(), (0, 0, 0.0))
+
+
+@page_settings
+class ConditionalPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.course = make_course()
+        self.url = reverse('courses:course_detail', kwargs={'pk': self.course.pk})
+
+    def test_unchanged_course_page_is_not_modified(self):
+        # The first visit hands out the CSRF cookie, which is part of the ETag
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_saving_the_course_changes_the_etag(self):
+        self.client.get(self.url)
+        etag = self.client.get(self.url)['ETag']
+        self.course.title = 'Python Basics, 2nd edition'
+        self.course.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, '2nd edition')
+
+
+    def etag(self):
+        return self.client.get(self.url)['ETag']
+
+    def test_etag_follows_what_else_the_course_page_shows(self):
+        student = User.objects.create_user(username='student')
+        self.client.force_login(student)
+        self.client.get(self.url)
+
+        etag = self.etag()
+        Enrollment.objects.create(user=student, course=make_course('Rust Basics'))
+        self.assertNotEqual(self.etag(), etag)
+
+        etag = self.etag()
+        build_neighbors()
+        self.assertNotEqual(self.etag(), etag)
+
+        Review.objects.create(user=student, course=self.course, rating=4)
+        etag = self.etag()
+        student.first_name = 'Ada'
+        student.save()
+        self.assertNotEqual(self.etag(), etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag()).status_code, 304)
+
+@page_settings
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.course = make_course('Python Basics', description='Variables and loops')
+        self.url = reverse('courses:course_list')
+
+    def test_catalog_is_served_from_cache_until_a_course_is_saved(self):
+        self.assertContains(self.client.get(self.url), 'Python Basics')
+        # Renamed without signals, so the cached page still has the old title
+        Course.objects.filter(pk=self.course.pk).update(title='Rust Basics')
+        self.assertContains(self.client.get(self.url), 'Python Basics')
+
+        self.course.refresh_from_db()
+        self.course.save()
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Rust Basics')
+        self.assertNotContains(response, 'Python Basics')
+
+    def test_signed_in_visitors_bypass_the_cache(self):
+        self.client.get(self.url)
+        Course.objects.filter(pk=self.course.pk).update(title='Rust Basics')
+        self.client.force_login(User.objects.create_user(username='student'))
+        self.assertContains(self.client.get(self.url), 'Rust Basics')
+
+
+class MarkdownFilterTests(SimpleTestCase):
+    def setUp(self):
+        self.renderer = MarkdownRenderer(TEMPLATE_MARKDOWN_EXTENSIONS, MARKDOWN_EXTENSION_CONFIGS, cache_size=2)
+
+    def test_reused_engine_renders_like_a_fresh_one(self):
+        texts = ['# Intro\n\n1. one\n2. two', '# Intro\n\nLine\nbreak', '```python\nx = 1\n```']
+        fresh = [
+            markdown.markdown(text, extensions=TEMPLATE_MARKDOWN_EXTENSIONS, extension_configs=MARKDOWN_EXTENSION_CONFIGS)
+            for text in texts
+        ]
+        self.assertEqual([self.renderer.convert(text) for text in texts], fresh)
+
+    def test_recent_results_are_reused_up_to_the_cache_size(self):
+        for text in ['one', 'two', 'one', 'three', 'two']:
+            self.renderer.convert(text)
+        stats = self.renderer.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 4, 2))
+
+    def test_filter_marks_the_html_safe(self):
+        html = Template('{% load markdown_extras %}{{ text|markdown }}').render(Context({'text': '*hi*'}))
+        self.assertEqual(html, '<p><em>hi</em></p>')
+
+
+LESSON_DOCUMENTS = [
+    '# Loops\n\nA `for` loop\nrepeats.\n\n## While\n\nAnother *loop*.',
+    'Intro\n\n```python\nfor i in range(3):\n\n    print(i)\n```\n\nAfter the code.',
+    '- one\n- two\n\n- loose three\n\n    indented part of three\n\nParagraph',
+    '> quoted\n\n> still the same quote\n\n1. first\n\n2. second',
+    '| a | b |\n|---|---|\n| 1 | 2 |\n\nText with a [link][ref].\n\n[ref]: https://example.com',
+    'Text\n\n<div>\n\nraw html\n\n</div>\n\nMore',
+    'Windows\r\nline\r\n\r\n\tTabbed code',
+]
+
+
+class BlockRenderingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_blocks_render_like_the_whole_document(self):
+        for text in LESSON_DOCUMENTS:
+            with self.subTest(text=text):
+                self.assertEqual(render_blocks(text), render_markdown(text))
+                # Again, from the block cache
+                self.assertEqual(render_blocks(text), render_markdown(text))
+
+    def test_only_changed_blocks_are_rendered_again(self):
+        text = '# Loops\n\nFirst paragraph.\n\n```python\nx = 1\n```\n\nLast paragraph.'
+        render_blocks(text)
+        with mock.patch.object(lesson_renderer, 'convert', wraps=lesson_renderer.convert) as convert:
+            html = render_blocks(text.replace('Last', 'Final'))
+        convert.assert_called_once_with('Final paragraph.')
+        self.assertEqual(html, render_markdown(text.replace('Last', 'Final')))
+
+
+@page_settings
+class LessonRenderingTests(TestCase):
+    def setUp(self):
+        self.lesson = Lesson.objects.create(course=make_course(), title='One', content='# Loops\n\nSome *text*')
+
+    def test_save_stores_the_rendered_html(self):
+        self.lesson.refresh_from_db()
+        self.assertIn('<em>text</em>', self.lesson.content_html)
+        self.assertEqual(self.lesson.content_html_version, RENDERER_VERSION)
+
+        self.lesson.content = 'Other *words*'
+        self.lesson.save(update_fields=['content'])
+        self.lesson.refresh_from_db()
+        self.assertIn('<em>words</em>', self.lesson.content_html)
+
+    def test_lesson_page_shows_the_stored_html_without_rendering(self):
+        self.client.force_login(User.objects.create_user(username='student'))
+        url = reverse('courses:lesson_detail', kwargs={'course_pk': self.lesson.course_id, 'lesson_pk': self.lesson.pk})
+        with mock.patch.object(lesson_renderer, 'convert') as convert:
+            response = self.client.get(url)
+        convert.assert_not_called()
+        self.assertContains(response, '<em>text</em>')
+
+
+class InlineExecutor:
+    """Runs submitted work right away, in this thread"""
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class PrerenderLessonsTests(TestCase):
+    def setUp(self):
+        course = make_course()
+        self.edited = Lesson.objects.create(course=course, title='One', content='# Old')
+        self.other = Lesson.objects.create(course=course, title='Two', content='Some *text*')
+        Lesson.objects.update(content_html='', content_html_version='old')
+
+    def test_lessons_edited_while_rendering_keep_their_new_html(self):
+        def render_then_edit(rows):
+            rendered = render_batch(rows)
+            self.edited.content = '# New'
+            self.edited.save()
+            return rendered
+
+        command = 'courses.management.commands.prerender_lessons'
+        with mock.patch(f'{command}.ProcessPoolExecutor', InlineExecutor), \
+                mock.patch(f'{command}.render_batch', render_then_edit):
+            call_command('prerender_lessons', stdout=StringIO())
+
+        self.edited.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertIn('New', self.edited.content_html)
+        self.assertIn('<em>text</em>', self.other.content_html)
+        self.assertEqual(self.other.content_html_version, RENDERER_VERSION)
+
+
+class CourseNeighborTests(TestCase):
+    def setUp(self):
+        self.python, self.rust = make_course('Python Basics'), make_course('Rust Basics')
+        student = User.objects.create_user(username='student')
+        for course in (self.python, self.rust):
+            Enrollment.objects.create(user=student, course=course)
+
+    @override_settings(COURSE_NEIGHBORS_MIN_OVERLAP=5)
+    def test_explicit_zero_min_overlap_is_not_replaced_by_the_default(self):
+        self.assertEqual(build_neighbors(), 0)
+        self.assertEqual(build_neighbors(min_overlap=0), 2)
+        self.assertEqual(related_courses(self.python), [self.rust])
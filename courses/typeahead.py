@@ -0,0 +1,225 @@
+# courses/typeahead.py
+"""
+In-process prefix index for search-as-you-type suggestions.
+
+Published course titles, category names and the names of instructors with
+published courses are kept in a sorted list of normalized keys; a lookup
+is a bisect to the first key starting with the prefix and a short walk
+from there, with no database access. Every word of a name is indexed, so
+"learn" finds "Machine Learning".
+
+Course saves and deletes patch the index of the process that made them
+and bump a generation number in the cache; other processes see the new
+number on their next lookup and rebuild from the database. That only
+reaches other processes through a shared cache such as Redis, so every
+index is also rebuilt once it is MAX_INDEX_AGE_SECONDS old: with the
+per-process LocMemCache, that bounds how stale other workers get.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.urls import reverse
+
+GENERATION_KEY = 'typeahead:generation'
+
+# Suggestion kinds, in the order they are listed for equally good matches
+KIND_ORDER = {'course': 0, 'category': 1, 'instructor': 2}
+
+# Matches looked at per query; keys sharing a very short prefix can run
+# into the thousands
+SCAN_LIMIT = 200
+
+# How often a lookup checks the shared generation number, in seconds
+GENERATION_CHECK_SECONDS = 1
+
+# Age at which an index is rebuilt even though the generation is unchanged
+MAX_INDEX_AGE_SECONDS = 300
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lowercase, accent-free words separated by single spaces"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+
+def item_keys(label):
+    """The label from each of its words on, so any word can start a match"""
+    words = normalize(label).split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+def _generation():
+    current = cache.get(GENERATION_KEY)
+    if current is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        current = cache.get(GENERATION_KEY, 0)
+    return current
+
+
+class PrefixIndex:
+    """Sorted ``(key, item_id)`` pairs searched with bisect"""
+
+    def __init__(self):
+        self._keys = []
+        self._ids = []
+        self._items = {}
+        self._labels = {}
+        self._lock = threading.Lock()
+        self.generation = None
+        self._checked_at = 0
+        self._built_at = None
+
+    def _add(self, item_id, item):
+        self._items[item_id] = item
+        self._labels[item_id] = normalize(item['label'])
+        for key in item_keys(item['label']):
+            position = bisect.bisect_left(self._keys, key)
+            self._keys.insert(position, key)
+            self._ids.insert(position, item_id)
+
+    def _remove(self, item_id):
+        item = self._items.pop(item_id, None)
+        if item is None:
+            return
+        del self._labels[item_id]
+        for key in item_keys(item['label']):
+            position = bisect.bisect_left(self._keys, key)
+            while position < len(self._keys) and self._keys[position] == key:
+                if self._ids[position] == item_id:
+                    del self._keys[position]
+                    del self._ids[position]
+                    break
+                position += 1
+
+    def rebuild(self):
+        from .models import Category, Course, Instructor
+
+        generation = _generation()
+        items = {}
+        courses = Course.objects.filter(is_published=True).values_list('pk', 'title')
+        for pk, title in courses:
+            items[('course', pk)] = course_item(pk, title)
+        for pk, name in Category.objects.values_list('pk', 'name'):
+            items[('category', pk)] = {
+                'type': 'category',
+                'label': name,
+                'url': reverse('courses:course_list') + '?' + urlencode({'category': pk}),
+            }
+        instructors = Instructor.objects.filter(course__is_published=True).distinct().select_related('user')
+        for instructor in instructors:
+            items[('instructor', instructor.pk)] = instructor_item(instructor)
+
+        pairs = sorted(
+            (key, item_id) for item_id, item in items.items() for key in item_keys(item['label'])
+        )
+        with self._lock:
+            self._keys = [key for key, _ in pairs]
+            self._ids = [item_id for _, item_id in pairs]
+            self._items = items
+            self._labels = {item_id: normalize(item['label']) for item_id, item in items.items()}
+            self.generation = generation
+            self._checked_at = self._built_at = time.monotonic()
+
+    def update(self, item_id, item):
+        """Replace one entry; ``item=None`` removes it"""
+        with self._lock:
+            self._remove(item_id)
+            if item is not None:
+                self._add(item_id, item)
+
+    def lookup(self, query, limit=8):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        now = time.monotonic()
+        if now - self._checked_at > GENERATION_CHECK_SECONDS:
+            self._checked_at = now
+            expired = self._built_at is None or now - self._built_at > MAX_INDEX_AGE_SECONDS
+            if expired or self.generation != _generation():
+                self.rebuild()
+
+        with self._lock:
+            position = bisect.bisect_left(self._keys, prefix)
+            found = {}
+            end = min(len(self._keys), position + SCAN_LIMIT)
+            while position < end and self._keys[position].startswith(prefix):
+                item_id = self._ids[position]
+                # Matching the start of the whole label beats matching a later word
+                whole = self._keys[position] == self._labels[item_id]
+                if item_id not in found or whole:
+                    found[item_id] = whole
+                position += 1
+            ranked = sorted(
+                found.items(),
+                key=lambda entry: (not entry[1], KIND_ORDER[entry[0][0]], self._items[entry[0]]['label'].lower()),
+            )
+            return [dict(self._items[item_id]) for item_id, _ in ranked[:limit]]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def course_item(pk, title):
+    return {'type': 'course', 'label': title, 'url': reverse('courses:course_detail', kwargs={'pk': pk})}
+
+
+def instructor_item(instructor):
+    name = instructor.user.get_full_name() or instructor.user.username
+    return {
+        'type': 'instructor',
+        'label': name,
+        'url': reverse('courses:course_list') + '?' + urlencode({'search': name}),
+    }
+
+
+suggestions = PrefixIndex()
+
+
+def _bump_generation():
+    """Tell other processes to rebuild, without this one rebuilding too"""
+    try:
+        generation = cache.incr(GENERATION_KEY)
+    except ValueError:
+        generation = time.time_ns()
+        cache.set(GENERATION_KEY, generation, None)
+        return
+    if suggestions.generation == generation - 1:
+        suggestions.generation = generation
+
+
+def course_changed(course, deleted=False):
+    """Patch the index for a saved or deleted course"""
+    if suggestions.generation is None:
+        # Not built in this process yet; the next lookup builds it
+        _bump_generation()
+        return
+    from .models import Course, Instructor
+
+    published = course.is_published and not deleted
+    suggestions.update(('course', course.pk), course_item(course.pk, course.title) if published else None)
+
+    instructor = Instructor.objects.filter(pk=course.instructor_id).select_related('user').first()
+    other_courses = Course.objects.filter(instructor_id=course.instructor_id, is_published=True)
+    if deleted:
+        other_courses = other_courses.exclude(pk=course.pk)
+    if instructor is not None and other_courses.exists():
+        suggestions.update(('instructor', course.instructor_id), instructor_item(instructor))
+    else:
+        suggestions.update(('instructor', course.instructor_id), None)
+    _bump_generation()
+
+
+def invalidate():
+    """Rebuild everywhere, e.g. after a category or instructor rename"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
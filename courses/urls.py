@@ -5,10 +5,12 @@ app_name = 'courses'
 
 urlpatterns = [
     path('', views.course_list, name='course_list'),
+    path('suggestions/', views.course_suggestions, name='course_suggestions'),
     path('certify/',views.get_certify,name='get_certify'),
     path('<int:pk>/', views.course_detail, name='course_detail'),
     path('<int:pk>/edit/', views.edit_course, name='edit_course'),
     path('<int:pk>/enroll/', views.enroll_course, name='enroll_course'),
+    path('<int:pk>/review/', views.review_course, name='review_course'),
     path('<int:course_pk>/lesson/<int:lesson_pk>/', views.lesson_detail, name='lesson_detail'),
     path('instructor/dashboard/', views.instructor_dashboard, name='instructor_dashboard'),
     path('instructor/create/', views.create_course, name='create_course'),
@@ -29,6 +31,9 @@ urlpatterns = [
     # Assignment URLs
     path('course/<int:course_pk>/assignments/', views.assignment_list, name='assignment_list'),
     path('course/<int:course_pk>/assignment/<int:assignment_pk>/', views.assignment_detail, name='assignment_detail'),
+    path('course/<int:course_pk>/assignment/<int:assignment_pk>/status/', views.assignment_submission_status, name='assignment_submission_status'),
+    path('course/<int:course_pk>/assignment/<int:assignment_pk>/stream/', views.assignment_submission_stream, name='assignment_submission_stream'),
+    path('course/<int:course_pk>/assignment/<int:assignment_pk>/question/<int:question_pk>/run/', views.run_code_tests, name='run_code_tests'),
     path('assignment/<int:assignment_pk>/submissions/', views.view_submissions, name='view_submissions'),  
     path('assignment/<int:assignment_id>/add-question/',views.add_question,name='add_question'),
     path('course/<int:course_pk>/assignment/<int:assignment_pk>/edit/', views.edit_assignment, name='edit_assignment'),
@@ -1,32 +1,46 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Sum, Count
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
 from django.core.paginator import Paginator
 from django.utils import timezone
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.contrib.auth.views import redirect_to_login
+from django.conf import settings
+from asgiref.sync import sync_to_async
 from django.template.loader import render_to_string
-from django.utils.safestring import mark_safe
 from weasyprint import HTML
-import markdown
 from datetime import timedelta
+import asyncio
 import json
 from django.db.models import Sum, Avg
 
-from .models import Course, Lesson, Category, Enrollment, Instructor, LessonProgress
-from .forms import CourseForm, LessonForm
+from .models import Course, Lesson, Category, Enrollment, Instructor, LessonProgress, Review
+from .forms import CourseForm, LessonForm, ReviewForm
 
 # Import assignment models and forms
 from .models import (
     Assignment, AssignmentSubmission, MultipleChoiceQuestion,
     CodeQuestion, TextQuestion, MultipleChoiceSubmission,
-    CodeSubmission, TextSubmission
+    CodeSubmission, TextSubmission, GradingJob
 )
 from .forms import (
     AssignmentForm, MultipleChoiceQuestionForm, CodeQuestionForm,
     TextQuestionForm
 )
 from .services import CodeExecutor
+from .grading import (
+    PENDING_RESULT, claim_submission_job, enqueue_submission, process_job_async, public_test_result,
+)
+from .admission import AdmissionRejected, practice_runs
+from .conditional import conditional_page, course_detail_validators, course_list_validators
+from .pagecache import anonymous_page_cache
+from .pagination import CursorPaginator, cached_count, listing_key
+from .facets import DURATION_BUCKETS, PRICE_BUCKETS, catalog_facets
+from .recommendations import related_courses
+from .search import search_courses
+from . import instructor_stats, typeahead
 
 
 # Certificate Views
@@ -142,24 +156,42 @@ def mark_lesson_complete(request, course_pk, lesson_pk):
 
 
 # Course Display Views
+COURSES_PER_PAGE = 9
+
+COURSE_SORTS = {
+    'relevance': ('-search_rank', '-pk'),
+    'recommended': ('-created_at', '-pk'),
+    'newest': ('-created_at', '-pk'),
+    'rating': ('-average_rating', '-rating_count', '-pk'),
+    'price_low': ('price', '-pk'),
+    'price_high': ('-price', '-pk'),
+}
+
+
+@conditional_page(course_list_validators)
+@anonymous_page_cache
 def course_list(request):
-    courses = Course.objects.filter(is_published=True).select_related('instructor', 'category')
+    courses = Course.objects.filter(is_published=True).select_related(
+        'instructor__user__profile', 'category'
+    )
     
     # Apply filters
     search_query = request.GET.get('search')
-    category_filter = request.GET.getlist('category')
+    category_filter = [pk for pk in request.GET.getlist('category') if pk.isdigit()]
     difficulty_filter = request.GET.getlist('difficulty')
     price_filter = request.GET.get('price')
     duration_filter = request.GET.get('duration')
-    sort_by = request.GET.get('sort', 'recommended')
+    sort_by = request.GET.get('sort', 'relevance' if search_query else 'recommended')
     
     if search_query:
-        courses = courses.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(instructor__user__first_name__icontains=search_query) |
-            Q(instructor__user__last_name__icontains=search_query)
-        )
+        courses = search_courses(courses, search_query)
+    
+    facets = catalog_facets(courses, search_query, {
+        'category': category_filter,
+        'difficulty': difficulty_filter,
+        'price': [price_filter] if price_filter else [],
+        'duration': [duration_filter] if duration_filter else [],
+    })
     
     if category_filter:
         courses = courses.filter(category_id__in=category_filter)
@@ -167,67 +199,106 @@ def course_list(request):
     if difficulty_filter:
         courses = courses.filter(difficulty__in=difficulty_filter)
     
-    if price_filter == 'free':
-        courses = courses.filter(price=0)
-    elif price_filter == 'paid':
-        courses = courses.filter(price__gt=0)
-    
-    if duration_filter == 'short':
-        courses = courses.filter(duration_hours__lte=5)
-    elif duration_filter == 'medium':
-        courses = courses.filter(duration_hours__gt=5, duration_hours__lte=10)
-    elif duration_filter == 'long':
-        courses = courses.filter(duration_hours__gt=10)
-    
-    # Sorting
-    if sort_by == 'newest':
-        courses = courses.order_by('-created_at')
-    elif sort_by == 'price_low':
-        courses = courses.order_by('price')
-    elif sort_by == 'price_high':
-        courses = courses.order_by('-price')
-    elif sort_by == 'rating':
-        courses = courses.order_by('-created_at')
-    else:
-        courses = courses.order_by('-created_at')
+    if price_filter in PRICE_BUCKETS:
+        courses = courses.filter(PRICE_BUCKETS[price_filter])
     
-    # Add enrollment counts
-    for course in courses:
-        course.enrollment_count = Enrollment.objects.filter(course=course).count()
-        course.average_rating = 4.5
+    if duration_filter in DURATION_BUCKETS:
+        courses = courses.filter(DURATION_BUCKETS[duration_filter])
     
-    categories = Category.objects.annotate(course_count=Count('course'))
+    # pk breaks ties, so cursors always point at exactly one row
+    if sort_by not in COURSE_SORTS or (sort_by == 'relevance' and not search_query):
+        sort_by = 'recommended'
+    ordering = COURSE_SORTS[sort_by]
     
-    paginator = Paginator(courses, 9)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if 'page' in request.GET:
+        # Numbered pages, for links made before cursor pagination
+        paginator = Paginator(courses.order_by(*ordering), COURSES_PER_PAGE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        total_count = paginator.count
+    else:
+        paginator = CursorPaginator(courses, ordering, COURSES_PER_PAGE, key=listing_key(request.GET))
+        page_obj = paginator.page(request.GET.get('cursor'))
+        total_count = None
+        if settings.COURSE_COUNT_CACHE_TIMEOUT:
+            total_count = cached_count(courses, settings.COURSE_COUNT_CACHE_TIMEOUT)
     
     context = {
         'courses': page_obj,
-        'categories': categories,
+        'total_count': total_count,
+        'categories': facets['categories'],
+        'facets': facets,
     }
     return render(request, 'courses/course_list.html', context)
 
 
+def course_suggestions(request):
+    """Search-as-you-type suggestions for the catalog, served from memory"""
+    query = request.GET.get('q', '')[:100]
+    return JsonResponse({
+        'query': query,
+        'suggestions': typeahead.suggestions.lookup(query),
+    })
+
+
+@conditional_page(course_detail_validators)
 def course_detail(request, pk):
     course = get_object_or_404(Course, pk=pk, is_published=True)
     lessons = course.lessons.all().order_by('order')
     
     is_enrolled = False
+    user_review = None
     if request.user.is_authenticated:
         is_enrolled = Enrollment.objects.filter(
             user=request.user, 
             course=course
         ).exists()
+        user_review = Review.objects.filter(user=request.user, course=course).first()
     
     context = {
         'course': course,
         'lessons': lessons,
         'is_enrolled': is_enrolled,
+        'enrollment_count': course.enrollment_count,
+        'related_courses': related_courses(course, limit=2, user=request.user),
+        'reviews': course.reviews.select_related('user')[:6],
+        'user_review': user_review,
+        'review_form': ReviewForm(instance=user_review) if is_enrolled else None,
     }
     return render(request, 'courses/course_detail.html', context)
 
 
+@login_required
+def review_course(request, pk):
+    course = get_object_or_404(Course, pk=pk, is_published=True)
+    if request.method != 'POST':
+        return redirect('courses:course_detail', pk=pk)
+    if not Enrollment.objects.filter(user=request.user, course=course).exists():
+        messages.error(request, 'Only enrolled students can review this course.')
+        return redirect('courses:course_detail', pk=pk)
+    
+    # Twice: a first review posted twice at once makes one insert fail,
+    # and that request then updates the review the other one created
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                # Locked, so concurrent edits adjust the course totals from the rating actually saved
+                review = Review.objects.select_for_update().filter(user=request.user, course=course).first()
+                form = ReviewForm(request.POST, instance=review)
+                if not form.is_valid():
+                    messages.error(request, 'Please choose a rating from 1 to 5 stars.')
+                    break
+                review = form.save(commit=False)
+                review.user = request.user
+                review.course = course
+                review.save()
+            messages.success(request, 'Thanks for reviewing this course!')
+            break
+        except IntegrityError:
+            if attempt:
+                raise
+    return redirect('courses:course_detail', pk=pk)
+
+
 @login_required
 def enroll_course(request, pk):
     course = get_object_or_404(Course, pk=pk, is_published=True)
@@ -254,79 +325,17 @@ def instructor_dashboard(request):
         return redirect('pages:home')
     
     instructor_courses = Course.objects.filter(instructor=request.user.instructor)
-    
-    # Calculate statistics
-    total_students = Enrollment.objects.filter(
-        course__in=instructor_courses
-    ).values('user').distinct().count()
-    
-    total_revenue = instructor_courses.aggregate(
-        total_revenue=Sum('price')
-    )['total_revenue'] or 0
-    
-    # Assignment statistics
-    total_assignments = Assignment.objects.filter(course__in=instructor_courses).count()
-    total_submissions = AssignmentSubmission.objects.filter(
-        assignment__course__in=instructor_courses
-    ).count()
-    
-    # Assignment type breakdown
-    assignment_stats = {
-        'multiple_choice': Assignment.objects.filter(
-            course__in=instructor_courses, 
-            assignment_type='multiple_choice'
-        ).count(),
-        'code': Assignment.objects.filter(
-            course__in=instructor_courses, 
-            assignment_type='code'
-        ).count(),
-        'text': Assignment.objects.filter(
-            course__in=instructor_courses, 
-            assignment_type='text'
-        ).count(),
-        'mixed': Assignment.objects.filter(
-            course__in=instructor_courses, 
-            assignment_type='mixed'
-        ).count(),
-    }
-    
-    # Recent assignments
-    recent_assignments = Assignment.objects.filter(
-        course__in=instructor_courses
-    ).select_related('course').order_by('-created_at')[:4]
-    
-    # Add question counts to recent assignments
-    for assignment in recent_assignments:
-        assignment.question_count = assignment.get_question_count()
+    stats = instructor_stats.get_stats(request.user.instructor.pk)
     
     # Get recent students (last 5 enrollments)
     recent_students = Enrollment.objects.filter(
         course__in=instructor_courses
     ).select_related('user', 'course').order_by('-enrolled_at')[:5]
     
-    # Calculate enrollment counts for each course first
-    course_enrollment_counts = {}
-    for course in instructor_courses:
-        course_enrollment_counts[course.id] = Enrollment.objects.filter(course=course).count()
-    
-    # Calculate total possible submissions
-    total_possible_submissions = 0
-    for course in instructor_courses:
-        course_assignments_count = course.assignments.count()
-        course_enrollments = course_enrollment_counts[course.id]
-        total_possible_submissions += course_assignments_count * course_enrollments
-    
-    # Calculate submission rate
-    submission_rate = (total_submissions / total_possible_submissions * 100) if total_possible_submissions > 0 else 0
-    
     # Add calculated fields to each course
     for course in instructor_courses:
-        course.enrollment_count = course_enrollment_counts[course.id]
         course.revenue = course.price * course.enrollment_count
-        course.average_rating = 4.5  # This would come from reviews
-        course.review_count = 12  # This would come from reviews
-        # Prefetch assignments count to avoid N+1 queries
-        course.assignments_count = course.assignments.count()
+        course.assignments_count = stats['assignments_per_course'].get(course.pk, 0)
     
     # Recent activity (simplified - you can enhance this)
     recent_activity = [
@@ -349,16 +358,16 @@ def instructor_dashboard(request):
     
     context = {
         'instructor_courses': instructor_courses,
-        'total_students': total_students,
-        'total_revenue': total_revenue,
-        'total_assignments': total_assignments,
-        'total_submissions': total_submissions,
-        'assignment_stats': assignment_stats,
-        'recent_assignments': recent_assignments,
+        'total_students': stats['total_students'],
+        'total_revenue': stats['total_revenue'],
+        'total_assignments': stats['total_assignments'],
+        'total_submissions': stats['total_submissions'],
+        'assignment_stats': stats['assignment_stats'],
+        'recent_assignments': stats['recent_assignments'],
         'recent_students': recent_students,
         'recent_activity': recent_activity,
-        'submission_rate': round(submission_rate, 1),
-        'average_rating': 4.8,
+        'submission_rate': stats['submission_rate'],
+        'average_rating': stats['average_rating'],
         'completion_rate': 65,  # This would be calculated
         'satisfaction_percentage': 92,  # This would be calculated
         'response_time': '2.1h',
@@ -426,27 +435,7 @@ def lesson_detail(request, course_pk, lesson_pk):
     course = get_object_or_404(Course, pk=course_pk)
     lesson = get_object_or_404(Lesson, pk=lesson_pk, course=course)
     
-    # Convert markdown to HTML with proper code block handling
-    if lesson.content:
-        lesson.content_html = mark_safe(markdown.markdown(
-            lesson.content,
-            extensions=[
-                'fenced_code',  # For code blocks with ```
-                'codehilite',   # For syntax highlighting
-                'tables',       # For tables
-                'nl2br',        # For line breaks
-            ],
-            extension_configs={
-                'codehilite': {
-                    'css_class': 'highlight',
-                    'linenums': False,
-                    'guess_lang': True,
-                }
-            }
-        ))
-    else:
-        lesson.content_html = ""
-    
+    # lesson.content_html is rendered when the lesson is saved
     user_lessons_progress = LessonProgress.objects.filter(
         user=request.user,
         lesson__course=course,
@@ -605,7 +594,7 @@ def update_lesson_order(request):
                     course__instructor=request.user.instructor
                 )
                 lesson.order = lesson_data['order']
-                lesson.save()
+                lesson.save(update_fields=['order'])
             return JsonResponse({'success': True})
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
@@ -694,96 +683,257 @@ def assignment_detail(request, course_pk, assignment_pk):
 
 def handle_assignment_submission(request, course_pk, assignment_pk, assignment):
     """Handle submission of assignment with multiple questions"""
-    # Create assignment submission
-    submission = AssignmentSubmission.objects.create(
-        assignment=assignment,
+    with transaction.atomic():
+        # Create assignment submission
+        submission = AssignmentSubmission.objects.create(
+            assignment=assignment,
+            user=request.user
+        )
+        
+        total_score = 0
+        
+        # Handle multiple choice submissions
+        for question in assignment.multiplechoicequestion_questions.all():
+            selected_answer = request.POST.get(f'mc_{question.id}')
+            if selected_answer:
+                is_correct = selected_answer == question.correct_answer
+                score = question.points if is_correct else 0
+                
+                MultipleChoiceSubmission.objects.create(
+                    submission=submission,
+                    question=question,
+                    selected_answer=selected_answer,
+                    score=score,
+                    is_correct=is_correct,
+                    feedback=question.explanation if is_correct else "Incorrect answer"
+                )
+                total_score += score
+        
+        # Handle code submissions: saved now, executed by the grading workers
+        has_code = False
+        for question in assignment.codequestion_questions.all():
+            code = request.POST.get(f'code_{question.id}')
+            language = request.POST.get(f'language_{question.id}', question.language)
+            
+            if code:
+                CodeSubmission.objects.create(
+                    submission=submission,
+                    question=question,
+                    code=code,
+                    language=language,
+                    execution_result=PENDING_RESULT,
+                    feedback="Waiting to be graded"
+                )
+                has_code = True
+        
+        # Handle text submissions
+        for question in assignment.textquestion_questions.all():
+            answer_text = request.POST.get(f'text_{question.id}')
+            
+            if answer_text:
+                # Simple keyword matching for auto-grading
+                expected_answer = question.expected_answer.lower()
+                user_answer = answer_text.lower()
+                
+                expected_keywords = set(expected_answer.split())
+                user_keywords = set(user_answer.split())
+                matching_keywords = expected_keywords.intersection(user_keywords)
+                
+                similarity = len(matching_keywords) / len(expected_keywords) if expected_keywords else 0
+                score = similarity * question.points
+                is_correct = similarity > 0.8
+                
+                TextSubmission.objects.create(
+                    submission=submission,
+                    question=question,
+                    answer_text=answer_text,
+                    score=score,
+                    is_correct=is_correct,
+                    feedback=f"Answer similarity: {similarity:.2%}"
+                )
+                total_score += score
+        
+        # Update total score
+        submission.total_score = total_score
+        if has_code:
+            submission.save()
+            enqueue_submission(submission)
+        else:
+            submission.is_completed = True
+            submission.save()
+    
+    if has_code:
+        messages.success(request, 'Assignment submitted! Your code is being graded, results will appear here shortly.')
+    else:
+        messages.success(request, f'Assignment submitted! Total score: {total_score:.1f}/{assignment.get_total_points()}')
+    return redirect('courses:assignment_detail', course_pk=course_pk, assignment_pk=assignment_pk)
+
+
+def submission_status_payload(submission):
+    """Grading status of a submission, as returned by the status and stream views"""
+    code_results = [
+        {
+            'question_id': code_submission.question_id,
+            'status': code_submission.execution_result.get('status'),
+            'score': code_submission.score,
+            'is_correct': code_submission.is_correct,
+        }
+        for code_submission in submission.codesubmission_submissions.all()
+    ]
+    
+    data = {
+        'status': submission.status,
+        'total_score': submission.total_score,
+        'code_results': code_results,
+    }
+    job = getattr(submission, 'grading_job', None)
+    if job and job.status == 'queued':
+        data['queue_position'] = GradingJob.objects.filter(status='queued', created_at__lte=job.created_at).count()
+    return data
+
+
+@login_required
+def assignment_submission_status(request, course_pk, assignment_pk):
+    """Polled by the assignment page while code answers are being graded"""
+    submission = get_object_or_404(
+        AssignmentSubmission.objects.select_related('grading_job'),
+        assignment__pk=assignment_pk,
+        assignment__course__pk=course_pk,
         user=request.user
     )
+    return JsonResponse(submission_status_payload(submission))
+
+
+# Streams grading inline only while the sandbox pool can take the work;
+# beyond that, streams just follow the grading workers' progress.
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_POLL_SECONDS = 1
+_streams_grading = 0
+_grading_tasks = set()
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _grading_events(submission):
+    global _streams_grading
     
-    total_score = 0
+    job = None
+    if submission.status == 'grading' and _streams_grading < settings.CODE_EXECUTOR_POOL_SIZE:
+        job = await sync_to_async(claim_submission_job)(submission)
     
-    # Handle multiple choice submissions
-    for question in assignment.multiplechoicequestion_set.all():
-        selected_answer = request.POST.get(f'mc_{question.id}')
-        if selected_answer:
-            is_correct = selected_answer == question.correct_answer
-            score = question.points if is_correct else 0
-            
-            MultipleChoiceSubmission.objects.create(
-                submission=submission,
-                question=question,
-                selected_answer=selected_answer,
-                score=score,
-                is_correct=is_correct,
-                feedback=question.explanation if is_correct else "Incorrect answer"
-            )
-            total_score += score
-    
-    # Handle code submissions
-    for question in assignment.codequestion_set.all():
-        code = request.POST.get(f'code_{question.id}')
-        language = request.POST.get(f'language_{question.id}', question.language)
+    if job:
+        _streams_grading += 1
+        events = asyncio.Queue()
         
-        if code:
-            # Execute code and evaluate
-            executor = CodeExecutor(timeout=question.timeout_seconds)
-            execution_result = executor.evaluate_code(
-                code,
-                language,
-                question.test_cases
-            )
-            
-            # Calculate score
-            passed_tests = [r for r in execution_result.get('results', []) if r.get('passed')]
-            score = (len(passed_tests) / len(question.test_cases)) * question.points if question.test_cases else 0
-            is_correct = len(passed_tests) == len(question.test_cases)
-            
-            CodeSubmission.objects.create(
-                submission=submission,
-                question=question,
-                code=code,
-                language=language,
-                execution_result=execution_result,
-                score=score,
-                is_correct=is_correct,
-                feedback=json.dumps(execution_result)
-            )
-            total_score += score
-    
-    # Handle text submissions
-    for question in assignment.textquestion_set.all():
-        answer_text = request.POST.get(f'text_{question.id}')
+        def on_result(code_submission, result):
+            result = public_test_result(code_submission.question, result)
+            events.put_nowait(dict(result, question_id=code_submission.question_id))
         
-        if answer_text:
-            # Simple keyword matching for auto-grading
-            expected_answer = question.expected_answer.lower()
-            user_answer = answer_text.lower()
-            
-            expected_keywords = set(expected_answer.split())
-            user_keywords = set(user_answer.split())
-            matching_keywords = expected_keywords.intersection(user_keywords)
-            
-            similarity = len(matching_keywords) / len(expected_keywords) if expected_keywords else 0
-            score = similarity * question.points
-            is_correct = similarity > 0.8
-            
-            TextSubmission.objects.create(
-                submission=submission,
-                question=question,
-                answer_text=answer_text,
-                score=score,
-                is_correct=is_correct,
-                feedback=f"Answer similarity: {similarity:.2%}"
-            )
-            total_score += score
-    
-    # Update total score
-    submission.total_score = total_score
-    submission.is_completed = True
-    submission.save()
+        async def grade():
+            global _streams_grading
+            try:
+                await process_job_async(job, on_result)
+            finally:
+                _streams_grading -= 1
+                events.put_nowait(None)
+        
+        # Grading carries on if the student closes the page
+        task = asyncio.create_task(grade())
+        _grading_tasks.add(task)
+        task.add_done_callback(_grading_tasks.discard)
+        while True:
+            try:
+                result = await asyncio.wait_for(events.get(), STREAM_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if result is None:
+                break
+            yield _sse('test', result)
+    else:
+        # Queued for, or being graded by, a grading worker
+        waited = 0
+        while submission.status == 'grading':
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+            waited += STREAM_POLL_SECONDS
+            await submission.arefresh_from_db(fields=['status'])
+            if waited >= STREAM_KEEPALIVE_SECONDS:
+                waited = 0
+                yield ': keep-alive\n\n'
+    
+    submission = await AssignmentSubmission.objects.select_related('grading_job').aget(pk=submission.pk)
+    yield _sse('complete', await sync_to_async(submission_status_payload)(submission))
+
+
+async def assignment_submission_stream(request, course_pk, assignment_pk):
+    """
+    Server-sent events for a submission being graded: a "test" event per
+    test result as soon as it is known, then a "complete" event with the
+    same data as the status view. Needs the ASGI server to stream.
+    """
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+    try:
+        submission = await AssignmentSubmission.objects.aget(
+            assignment__pk=assignment_pk,
+            assignment__course__pk=course_pk,
+            user=user
+        )
+    except AssignmentSubmission.DoesNotExist:
+        raise Http404('No submission for this assignment')
     
-    messages.success(request, f'Assignment submitted! Total score: {total_score:.1f}/{assignment.get_total_points()}')
-    return redirect('courses:assignment_detail', course_pk=course_pk, assignment_pk=assignment_pk)
+    response = StreamingHttpResponse(_grading_events(submission), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def run_code_tests(request, course_pk, assignment_pk, question_pk):
+    """
+    Practice run of a code answer against the question's visible test
+    cases. Nothing is saved. Runs are admission controlled and answered
+    with 429 and Retry-After when the user or the grader is busy.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return JsonResponse({'error': 'Please log in to run your code'}, status=401)
+    
+    question = await CodeQuestion.objects.select_related('assignment').filter(
+        pk=question_pk,
+        assignment__pk=assignment_pk,
+        assignment__course__pk=course_pk
+    ).afirst()
+    if question is None or not (question.assignment.is_published or user.is_staff):
+        raise Http404('No such question')
+    
+    code = request.POST.get('code', '')
+    language = request.POST.get('language') or question.language
+    if not code.strip():
+        return JsonResponse({'error': 'Write some code first'}, status=400)
+    if language not in dict(CodeQuestion.LANGUAGES):
+        return JsonResponse({'error': f'Unsupported language: {language}'}, status=400)
+    
+    test_cases = question.visible_test_cases
+    if not test_cases:
+        return JsonResponse({'status': 'error', 'message': 'This question has no sample tests', 'results': []})
+    
+    try:
+        async with practice_runs.admit(user.pk):
+            executor = CodeExecutor(timeout=question.timeout_seconds)
+            result = await executor.evaluate_code_async(code, language, test_cases)
+    except AdmissionRejected as e:
+        response = JsonResponse({'error': str(e), 'retry_after': e.retry_after}, status=429)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+    
+    result = dict(result or {"status": "error", "message": "No result", "results": []})
+    result['hidden_tests'] = len(question.test_cases) - len(test_cases)
+    return JsonResponse(result)
 
 
 # Instructor views for managing assignments
@@ -6,6 +6,7 @@ from django.core.mail import send_mail
 from django.conf import settings
 from django.contrib import messages
 from courses.models import Course
+from courses.pagecache import anonymous_page_cache
 from django.shortcuts import render
 from .forms import ContactForm
 from django.contrib import messages
@@ -23,7 +24,7 @@ def about(request):
     return render(request, 'pages/about.html')
 
 
-home = HomeView.as_view()
+home = anonymous_page_cache(HomeView.as_view())
 
 def contact(request):
     courses = Course.objects.filter(is_published=True)
@@ -1,12 +1,12 @@
 # users/middleware.py
 from django.utils import translation
+from django.utils.deprecation import MiddlewareMixin
 from django.conf import settings
 
-class UserLanguageMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+class UserLanguageMiddleware(MiddlewareMixin):
+    # MiddlewareMixin makes this usable in the async (ASGI) middleware chain
 
-    def __call__(self, request):
+    def process_request(self, request):
         # Check if user is authenticated and has a language preference
         if request.user.is_authenticated:
             try:
@@ -17,6 +17,3 @@ class UserLanguageMiddleware:
             except:
                 # Use default language if any error occurs
                 pass
-        
-        response = self.get_response(request)
-        return response
\ No newline at end of file
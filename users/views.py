@@ -10,6 +10,7 @@ from django.utils import timezone
 from .forms import CustomUserCreationForm, UserUpdateForm, ProfileUpdateForm, PreferencesForm
 from .models import UserProfile, LoginHistory, UserActivity
 from courses.models import Enrollment, Course,Assignment
+from courses.recommendations import recommended_courses
 from django.utils import translation
 from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
@@ -223,8 +224,8 @@ def dashboard(request):
         # Get recently accessed courses (last 3 in-progress courses)
         recent_courses = in_progress_courses.order_by('-enrolled_at')[:3]
         
-        # Add some sample data for demonstration
-        sample_courses = Course.objects.filter(is_published=True)[:3]
+        # Courses taken by students with similar enrollments
+        featured_courses = recommended_courses(request.user, limit=3)
         
         # Get pending assignments for completed courses
         completed_course_list = [e.course for e in completed_courses]
@@ -246,7 +247,7 @@ def dashboard(request):
             'completed_courses': completed_courses,
             'recent_courses': recent_courses,
             'total_learning_hours': total_learning_hours,
-            'featured_courses': sample_courses,
+            'featured_courses': featured_courses,
             'pending_assignments': pending_assignments,  # Add this
         }
         return render(request, 'users/dashboard.html', context)